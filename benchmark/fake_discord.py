@@ -0,0 +1,181 @@
+import asyncio
+import itertools
+from typing import List, Optional
+
+import discord
+
+BOT_USER_ID = 1
+GUILD_ID = 10
+
+# Snowflake ids increase over time, messages and threads share one sequence
+snowflakes = itertools.count(1_000_000)
+
+
+class FakeRest:
+    # Seconds of each REST call, e.g. sending a message
+    latency_seconds = 0.0
+
+    @classmethod
+    async def call(cls):
+        if cls.latency_seconds > 0:
+            await asyncio.sleep(cls.latency_seconds)
+
+
+class FakeUser:
+    def __init__(self, user_id: int, name: str, bot: bool = False):
+        self.id = user_id
+        self.name = name
+        self.bot = bot
+
+    def __str__(self):
+        return self.name
+
+
+BOT_USER = FakeUser(BOT_USER_ID, "bot", bot=True)
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int = GUILD_ID):
+        self.id = guild_id
+        self.system_channel = None
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *_):
+        return False
+
+
+class FakeMessage:
+    def __init__(self, channel, author: FakeUser, content: Optional[str], embed: Optional[discord.Embed] = None):
+        self.id = next(snowflakes)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.embeds = [embed] if embed else []
+        self.type = discord.MessageType.default
+        self.reference = None
+        self.thread: Optional[FakeThread] = None
+
+    async def edit(self, content: Optional[str] = None, **_) -> "FakeMessage":
+        await FakeRest.call()
+        self.content = content
+        self.channel.on_activity()
+        return self
+
+    async def create_thread(self, name: str, **_) -> "FakeThread":
+        await FakeRest.call()
+        self.thread = FakeThread(name=name, guild=self.guild, thread_id=self.id)
+        return self.thread
+
+
+class FakeThread(discord.Thread):
+    """Thread held in memory, recording messages sent by the bot. Subclass of discord.Thread to pass type checks."""
+
+    # noinspection PyMissingConstructor
+    def __init__(self, name: str, guild: FakeGuild, thread_id: Optional[int] = None):
+        self.id = thread_id or next(snowflakes)
+        self.name = name
+        self.guild = guild
+        self.owner_id = BOT_USER_ID
+        self.parent_id = None
+        self.archived = False
+        self.locked = False
+        self.message_count = 0
+        self.last_message_id = None
+        self.messages: List[FakeMessage] = []
+        self.last_activity = 0.0
+
+    @property
+    def jump_url(self) -> str:
+        return f"https://discord.com/channels/{self.guild.id}/{self.id}"
+
+    def typing(self) -> FakeTyping:
+        return FakeTyping()
+
+    def on_activity(self):
+        self.last_activity = asyncio.get_running_loop().time()
+
+    def add_message(self, author: FakeUser, content: Optional[str], embed: Optional[discord.Embed] = None):
+        message = FakeMessage(self, author, content, embed)
+        self.messages.append(message)
+        self.message_count += 1
+        self.last_message_id = message.id
+        self.on_activity()
+        return message
+
+    async def send(self, content: Optional[str] = None, embed: Optional[discord.Embed] = None, **_) -> FakeMessage:
+        await FakeRest.call()
+        return self.add_message(BOT_USER, content, embed)
+
+    async def edit(self, name: Optional[str] = None, archived: Optional[bool] = None, locked: Optional[bool] = None,
+                   **_):
+        await FakeRest.call()
+        self.name = name if name is not None else self.name
+        self.archived = archived if archived is not None else self.archived
+        self.locked = locked if locked is not None else self.locked
+        return self
+
+    async def history(self, limit: Optional[int] = 100, after: Optional[discord.abc.Snowflake] = None,
+                      oldest_first: Optional[bool] = None, **_):
+        messages = [message for message in self.messages if after is None or message.id > after.id]
+        for message in messages[:limit]:
+            yield message
+
+
+class FakeTextChannel(discord.TextChannel):
+
+    # noinspection PyMissingConstructor
+    def __init__(self, guild: FakeGuild):
+        self.id = next(snowflakes)
+        self.guild = guild
+
+
+class FakeInteractionResponse:
+    def __init__(self, interaction: "FakeInteraction"):
+        self.interaction = interaction
+        self.done = False
+
+    def is_done(self) -> bool:
+        return self.done
+
+    async def send_message(self, content: Optional[str] = None, embed: Optional[discord.Embed] = None, **_):
+        await FakeRest.call()
+        self.done = True
+        self.interaction.message = FakeMessage(self.interaction.channel, BOT_USER, content, embed)
+
+    async def defer(self, **_):
+        self.done = True
+
+
+class FakeFollowup:
+    def __init__(self):
+        self.messages: List[str] = []
+
+    async def send(self, content: Optional[str] = None, embed: Optional[discord.Embed] = None, **_):
+        self.messages.append(content or embed.description)
+
+
+class FakeInteraction:
+    """Slash command interaction in a text channel of the guild."""
+
+    def __init__(self, user: FakeUser, guild: FakeGuild):
+        self.id = next(snowflakes)
+        self.user = user
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = FakeTextChannel(guild)
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup()
+        self.message: Optional[FakeMessage] = None
+
+    async def original_response(self) -> FakeMessage:
+        await FakeRest.call()
+        return self.message
+
+    @property
+    def thread(self) -> Optional[FakeThread]:
+        return self.message.thread if self.message else None
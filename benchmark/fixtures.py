@@ -0,0 +1,69 @@
+import random
+from typing import List, Dict, Callable
+
+from src.model.message import Message
+from src.model.role import Role
+
+# Messages of a thread, as the conversation cache keeps at most 200 messages per thread
+THREAD_MESSAGES = 200
+
+# Discord splits replies longer than this into consecutive messages
+DISCORD_MESSAGE_LIMIT = 2000
+
+WORDS = (
+    "deploy cache thread token model prompt reply latency queue worker service request error retry config "
+    "python async await function class return value list dict string index budget context window"
+).split()
+
+
+def sentence(rng: random.Random, words: int) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + "."
+
+
+def code_block(rng: random.Random, lines: int) -> str:
+    body = "\n".join(
+        f"    {rng.choice(WORDS)}_{index} = {rng.choice(WORDS)}({rng.randint(0, 999)})" for index in range(lines)
+    )
+    return f"```python\ndef {rng.choice(WORDS)}():\n{body}\n```"
+
+
+def code_thread(rng: random.Random) -> List[Message]:
+    """Questions about code, answered with long code blocks split into several messages."""
+    messages = [Message(role=Role.USER.value, content="Review this module and suggest a refactor.")]
+    while len(messages) < THREAD_MESSAGES:
+        messages.append(Message(role=Role.USER.value, content=f"{sentence(rng, 12)}\n{code_block(rng, 20)}"))
+        reply = f"{sentence(rng, 30)}\n{code_block(rng, 80)}\n{sentence(rng, 20)}"
+        for start in range(0, len(reply), DISCORD_MESSAGE_LIMIT):
+            messages.append(Message(role=Role.ASSISTANT.value, content=reply[start:start + DISCORD_MESSAGE_LIMIT]))
+    return messages[:THREAD_MESSAGES]
+
+
+def short_turns_thread(rng: random.Random) -> List[Message]:
+    """Chat with many short turns."""
+    messages = [Message(role=Role.USER.value, content="Let's chat.")]
+    for index in range(1, THREAD_MESSAGES):
+        role = Role.ASSISTANT.value if index % 2 == 1 else Role.USER.value
+        messages.append(Message(role=role, content=sentence(rng, rng.randint(3, 15))))
+    return messages
+
+
+def image_thread(rng: random.Random) -> List[Message]:
+    """Questions about uploaded images, every fourth message has an image."""
+    messages = [Message(role=Role.USER.value, content="Describe the images I upload.")]
+    for index in range(1, THREAD_MESSAGES):
+        role = Role.ASSISTANT.value if index % 2 == 1 else Role.USER.value
+        image_url = f"https://cdn.discordapp.com/attachments/1/{index}/image.png" if index % 4 == 0 else None
+        messages.append(Message(role=role, content=sentence(rng, rng.randint(10, 40)), image_url=image_url))
+    return messages
+
+
+THREADS: Dict[str, Callable[[random.Random], List[Message]]] = {
+    "code": code_thread,
+    "short_turns": short_turns_thread,
+    "images": image_thread,
+}
+
+
+def build_threads(seed: int = 0) -> Dict[str, List[Message]]:
+    """Return the fixture threads, identical for the same seed."""
+    return {name: build(random.Random(seed)) for name, build in THREADS.items()}
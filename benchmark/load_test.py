@@ -0,0 +1,179 @@
+"""Drive the bot with synthetic threads against a local mock OpenAI server, fully offline.
+
+Usage: python -m benchmark.load_test --threads 10 50 100 --turns 5
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+from dataclasses import dataclass, asdict
+from time import perf_counter
+from typing import List, Optional
+
+from benchmark.fake_discord import FakeGuild, FakeInteraction, FakeUser, FakeThread, FakeRest, BOT_USER, GUILD_ID
+from benchmark.mock_openai_server import MockOpenAIServer, add_config_arguments, parse_config
+from src.service.request_limiter import percentile
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class LevelResult:
+    threads: int
+    replies: int
+    failures: int
+    seconds: float
+    replies_per_second: float
+    # Seconds from a message, or /chat, to its reply delivered
+    p50_seconds: float
+    p95_seconds: float
+    p99_seconds: float
+    max_rss_mb: float
+
+
+def max_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class LoadTest:
+    def __init__(self, main, turns: int, think_seconds: float, timeout_seconds: float):
+        self.main = main
+        self.turns = turns
+        self.think_seconds = think_seconds
+        self.timeout_seconds = timeout_seconds
+        self.guild = FakeGuild()
+        self.replies: dict[int, asyncio.Event] = {}
+
+        # Signal delivered replies of thread messages, on_message looks up the function when a reply is delivered
+        deliver_thread_completion = main.deliver_thread_completion
+
+        async def deliver(thread, response_data):
+            await deliver_thread_completion(thread, response_data)
+            self.replies[thread.id].set()
+
+        main.deliver_thread_completion = deliver
+
+    async def run_level(self, thread_count: int) -> LevelResult:
+        latencies: List[float] = []
+        failures = 0
+
+        async def converse(index: int):
+            nonlocal failures
+            user = FakeUser(user_id=100 + index, name=f"user{index}")
+
+            # Start thread with /chat, reply is delivered when the command returns
+            interaction = FakeInteraction(user, self.guild)
+            start = perf_counter()
+            await self.main.chat_command.callback(interaction, f"Hello from {user.name}", None)
+            latencies.append(perf_counter() - start)
+
+            thread: Optional[FakeThread] = interaction.thread
+            if thread is None:
+                failures += 1
+                return
+            self.replies[thread.id] = asyncio.Event()
+
+            for turn in range(self.turns):
+                await asyncio.sleep(self.think_seconds)
+                self.replies[thread.id].clear()
+                message = thread.add_message(user, f"Follow up {turn} from {user.name}")
+
+                start = perf_counter()
+                await self.main.on_message(message)
+                try:
+                    await asyncio.wait_for(self.replies[thread.id].wait(), self.timeout_seconds)
+                    latencies.append(perf_counter() - start)
+                except asyncio.TimeoutError:
+                    failures += 1
+
+            del self.replies[thread.id]
+
+        start = perf_counter()
+        await asyncio.gather(*[converse(index) for index in range(thread_count)])
+        seconds = perf_counter() - start
+
+        latencies.sort()
+        return LevelResult(
+            threads=thread_count,
+            replies=len(latencies),
+            failures=failures,
+            seconds=round(seconds, 3),
+            replies_per_second=round(len(latencies) / seconds, 2),
+            p50_seconds=round(percentile(latencies, 0.5), 3),
+            p95_seconds=round(percentile(latencies, 0.95), 3),
+            p99_seconds=round(percentile(latencies, 0.99), 3),
+            max_rss_mb=round(max_rss_mb(), 1),
+        )
+
+
+def import_bot(base_url: str, args: argparse.Namespace):
+    """Import the bot module configured against the mock server, without connecting to Discord."""
+    os.environ.update({
+        "CHAT_SERVICE": "openai",
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": base_url,
+        "DISCORD_BOT_TOKEN": "benchmark",
+        "DISCORD_CLIENT_ID": str(BOT_USER.id),
+        "ALLOWED_SERVER_IDS": str(GUILD_ID),
+        "BOT_INVITE_URL": "",
+        "MAX_CONCURRENT_REQUESTS": str(args.max_concurrent_requests),
+    })
+
+    from src import main
+    from src.message.thread_scheduler import ThreadScheduler
+
+    logging.getLogger().setLevel(logging.DEBUG if args.verbose else logging.WARNING)
+
+    # Bot user is set on login
+    main.client._connection.user = BOT_USER
+    main.client.thread_scheduler = ThreadScheduler(min_delay=args.debounce_seconds, max_delay=args.debounce_seconds)
+
+    # A large context keeps prompts under the byte upper bound, so no tokenizer has to be downloaded
+    model = next(model for model in main.client.chat_service.get_supported_models() if model.name == args.model)
+    main.client.chat_service.set_current_model(model)
+    return main
+
+
+async def run(args: argparse.Namespace):
+    FakeRest.latency_seconds = args.discord_latency_seconds
+    server = MockOpenAIServer(parse_config(args))
+    base_url = await server.start()
+    main = import_bot(base_url, args)
+
+    load_test = LoadTest(main, turns=args.turns, think_seconds=args.think_seconds, timeout_seconds=args.timeout)
+    results = []
+    try:
+        print(f"{'threads':>8} {'replies':>8} {'failed':>7} {'rps':>8} {'p50':>7} {'p95':>7} {'p99':>7} {'rss_mb':>8}")
+        for thread_count in args.threads:
+            result = await load_test.run_level(thread_count)
+            results.append(result)
+            print(
+                f"{result.threads:>8} {result.replies:>8} {result.failures:>7} {result.replies_per_second:>8} "
+                f"{result.p50_seconds:>7} {result.p95_seconds:>7} {result.p99_seconds:>7} {result.max_rss_mb:>8}"
+            )
+    finally:
+        await server.stop()
+
+    print(f"Mock server: {server.requests} requests, {server.rate_limited} rate limited")
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump([asdict(result) for result in results], file, indent=2)
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Load test the bot with synthetic threads, fully offline")
+    arg_parser.add_argument("--threads", type=int, nargs="+", default=[10, 50, 100], help="Threads of each level")
+    arg_parser.add_argument("--turns", type=int, default=3, help="Follow up messages per thread")
+    arg_parser.add_argument("--think-seconds", type=float, default=0.1, help="Pause before each follow up")
+    arg_parser.add_argument("--debounce-seconds", type=float, default=0.05)
+    arg_parser.add_argument("--discord-latency-seconds", type=float, default=0.0, help="Seconds of each REST call")
+    arg_parser.add_argument("--max-concurrent-requests", type=int, default=8)
+    arg_parser.add_argument("--model", default="gpt-4-32k")
+    arg_parser.add_argument("--timeout", type=float, default=120, help="Seconds to wait for a reply")
+    arg_parser.add_argument("--output", help="Write results as JSON")
+    arg_parser.add_argument("--verbose", action="store_true")
+    add_config_arguments(arg_parser)
+    asyncio.run(run(arg_parser.parse_args()))
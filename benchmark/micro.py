@@ -0,0 +1,166 @@
+"""Time prompt building, rendering and token counting of every chat service over fixture threads.
+
+Usage:
+    python -m benchmark.micro --save      # record baselines
+    python -m benchmark.micro             # compare with baselines, exit with 1 on regression
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import timeit
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+# Services read API keys on init, no request is sent
+for key in ("OPENAI_API_KEY", "AZURE_OPENAI_API_KEY", "PALM_API_KEY", "AZURE_OPENAI_API_VERSION"):
+    os.environ.setdefault(key, "benchmark")
+os.environ.setdefault("AZURE_OPENAI_API_BASE", "https://benchmark.openai.azure.com")
+
+from benchmark.fixtures import build_threads  # noqa: E402
+from src.model.message import Message  # noqa: E402
+from src.model.prompt import Prompt  # noqa: E402
+from src.service.azure_openai_service import AzureOpenAIService  # noqa: E402
+from src.service.chat_service import ChatService  # noqa: E402
+from src.service.openai_service import OpenAIService  # noqa: E402
+from src.service.palm_service import PalmService  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+# Slowdown over baseline reported as a regression, timings of the same machine vary by a few percent
+DEFAULT_TOLERANCE = 0.25
+
+REPEAT = 5
+
+
+@dataclass(frozen=True)
+class Benchmark:
+    name: str
+    func: Callable[[], object]
+
+
+@dataclass(frozen=True)
+class BenchmarkResult:
+    name: str
+    # Best seconds per call, None if the benchmark cannot run, e.g. a tokenizer cannot be downloaded
+    seconds: Optional[float]
+    error: Optional[str] = None
+
+
+def service_benchmarks(service: ChatService, thread_name: str, history: List[Message]) -> List[Benchmark]:
+    prefix = f"{service.name}.{thread_name}"
+    # Render every message of the thread, regardless of trimming
+    prompt = Prompt(conversation=history, header=service.build_system_message())
+    loop = asyncio.new_event_loop()
+
+    def build_prompt():
+        # Token counts of messages are cached across requests, as in the bot
+        return service.build_prompt(history)
+
+    def render_message():
+        return [service.render_message(message) for message in history]
+
+    def count_message_tokens():
+        # Uncached, the cost of a thread seen for the first time
+        return sum(service.count_message_tokens(message) for message in history)
+
+    benchmarks = [
+        Benchmark(f"{prefix}.build_prompt", build_prompt),
+        Benchmark(f"{prefix}.render_prompt", lambda: service.render_prompt(prompt)),
+        Benchmark(f"{prefix}.render_message", render_message),
+        Benchmark(f"{prefix}.count_message_tokens", count_message_tokens),
+    ]
+    # Palm counts tokens with a request to its API
+    if not isinstance(service, PalmService):
+        benchmarks.append(Benchmark(
+            f"{prefix}.count_token_usage", lambda: loop.run_until_complete(service.count_token_usage(history))
+        ))
+    return benchmarks
+
+
+def collect_benchmarks() -> List[Benchmark]:
+    threads = build_threads()
+    benchmarks = []
+    for service in (OpenAIService(), AzureOpenAIService(), PalmService()):
+        for thread_name, history in threads.items():
+            benchmarks.extend(service_benchmarks(service, thread_name, history))
+    return benchmarks
+
+
+def measure(benchmark: Benchmark) -> BenchmarkResult:
+    """Return the best time per call of repeated runs, each run long enough for timer resolution."""
+    try:
+        benchmark.func()
+    except Exception as err:
+        return BenchmarkResult(name=benchmark.name, seconds=None, error=f"{err.__class__.__name__}: {err}"[:80])
+
+    timer = timeit.Timer(benchmark.func)
+    number, _ = timer.autorange()
+    best = min(timer.repeat(repeat=REPEAT, number=number))
+    return BenchmarkResult(name=benchmark.name, seconds=best / number)
+
+
+def load_baselines(path: str) -> Dict[str, float]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as file:
+        return json.load(file)
+
+
+def save_baselines(path: str, results: List[BenchmarkResult]):
+    baselines = load_baselines(path)
+    baselines.update({result.name: result.seconds for result in results if result.seconds is not None})
+    with open(path, "w") as file:
+        json.dump(dict(sorted(baselines.items())), file, indent=2)
+        file.write("\n")
+
+
+def report(results: List[BenchmarkResult], baselines: Dict[str, float], tolerance: float) -> List[str]:
+    """Print results against baselines, return names of benchmarks slower than baseline beyond tolerance."""
+    regressions = []
+    width = max(len(result.name) for result in results)
+    for result in results:
+        if result.seconds is None:
+            print(f"{result.name:<{width}}  skipped    {result.error}")
+            continue
+
+        line = f"{result.name:<{width}}  {result.seconds * 1000:9.3f} ms"
+        baseline = baselines.get(result.name)
+        if baseline:
+            ratio = result.seconds / baseline
+            line += f"  {ratio:6.2f}x baseline"
+            if ratio > 1 + tolerance:
+                line += "  REGRESSION"
+                regressions.append(result.name)
+        print(line)
+    return regressions
+
+
+def main(args: argparse.Namespace) -> int:
+    benchmarks = [benchmark for benchmark in collect_benchmarks() if args.filter in benchmark.name]
+    results = [measure(benchmark) for benchmark in benchmarks]
+    if not results:
+        print(f"No benchmark matches {args.filter}")
+        return 1
+
+    if args.save:
+        save_baselines(args.baselines, results)
+        report(results, {}, args.tolerance)
+        print(f"Saved baselines to {args.baselines}")
+        return 0
+
+    regressions = report(results, load_baselines(args.baselines), args.tolerance)
+    if regressions:
+        print(f"{len(regressions)} benchmarks are more than {args.tolerance:.0%} slower than baseline")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    arg_parser = argparse.ArgumentParser(description="Microbenchmarks of prompt building and token counting")
+    arg_parser.add_argument("--save", action="store_true", help="Save results as baselines")
+    arg_parser.add_argument("--baselines", default=BASELINE_PATH)
+    arg_parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    arg_parser.add_argument("-k", "--filter", default="", help="Run benchmarks with names containing this")
+    sys.exit(main(arg_parser.parse_args()))
@@ -0,0 +1,143 @@
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class MockServerConfig:
+    # Seconds before the response, or the first chunk when streaming
+    first_token_seconds: float = 0.2
+    # Seconds between chunks of a streaming response
+    chunk_interval_seconds: float = 0.01
+    reply_words: int = 50
+    # Fraction of requests rejected with 429
+    rate_limit_ratio: float = 0.0
+    retry_after_seconds: float = 0.0
+
+
+class MockOpenAIServer:
+    """Local OpenAI-compatible chat completion endpoint with configurable latency, streaming and rate limiting."""
+
+    def __init__(self, config: MockServerConfig = MockServerConfig()):
+        self.config = config
+        self.requests = 0
+        self.rate_limited = 0
+        self.runner: Optional[web.AppRunner] = None
+        self.port = 0
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0) -> str:
+        """Start server, return its base url for OPENAI_BASE_URL."""
+        app = web.Application()
+        app.router.add_post("/v1/chat/completions", self.chat_completions)
+        app.router.add_get("/v1/models", self.models)
+        # Azure OpenAI path, with the server root as AZURE_OPENAI_API_BASE
+        app.router.add_post("/openai/deployments/{deployment}/chat/completions", self.chat_completions)
+
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+        return f"http://{host}:{self.port}/v1"
+
+    async def stop(self):
+        await self.runner.cleanup()
+
+    async def models(self, _: web.Request) -> web.Response:
+        # Listed by the bot on warm-up to open connections
+        return web.json_response({"object": "list", "data": []})
+
+    async def chat_completions(self, request: web.Request) -> web.StreamResponse:
+        self.requests += 1
+        body = await request.json()
+
+        if random.random() < self.config.rate_limit_ratio:
+            self.rate_limited += 1
+            return web.json_response(
+                {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}},
+                status=429,
+                headers={"retry-after": f"{self.config.retry_after_seconds}"}
+            )
+
+        await asyncio.sleep(self.config.first_token_seconds)
+        words = [f"word{index} " for index in range(self.config.reply_words)]
+        completion_id = f"chatcmpl-{self.requests}"
+
+        if not body.get("stream"):
+            return web.json_response({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body["model"],
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(words)},
+                    "finish_reason": "stop"
+                }],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)}
+            })
+
+        response = web.StreamResponse(headers={"content-type": "text/event-stream"})
+        await response.prepare(request)
+        for index, word in enumerate(words):
+            if index > 0:
+                await asyncio.sleep(self.config.chunk_interval_seconds)
+            await response.write(self.__event(completion_id, body["model"], {"content": word}, None))
+        await response.write(self.__event(completion_id, body["model"], {}, "stop"))
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    @staticmethod
+    def __event(completion_id: str, model: str, delta: dict, finish_reason) -> bytes:
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+        return f"data: {json.dumps(chunk)}\n\n".encode()
+
+
+def parse_config(args: argparse.Namespace) -> MockServerConfig:
+    return MockServerConfig(
+        first_token_seconds=args.first_token_seconds,
+        chunk_interval_seconds=args.chunk_interval_seconds,
+        reply_words=args.reply_words,
+        rate_limit_ratio=args.rate_limit_ratio,
+        retry_after_seconds=args.retry_after_seconds,
+    )
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    default = MockServerConfig()
+    parser.add_argument("--first-token-seconds", type=float, default=default.first_token_seconds)
+    parser.add_argument("--chunk-interval-seconds", type=float, default=default.chunk_interval_seconds)
+    parser.add_argument("--reply-words", type=int, default=default.reply_words)
+    parser.add_argument("--rate-limit-ratio", type=float, default=default.rate_limit_ratio)
+    parser.add_argument("--retry-after-seconds", type=float, default=default.retry_after_seconds)
+
+
+async def serve(port: int, config: MockServerConfig):
+    server = MockOpenAIServer(config)
+    logger.info(f"Mock OpenAI server at {await server.start(port=port)}")
+    await asyncio.Event().wait()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    arg_parser = argparse.ArgumentParser(description="Run a mock OpenAI-compatible chat completion server")
+    arg_parser.add_argument("--port", type=int, default=8000)
+    add_config_arguments(arg_parser)
+    cli_args = arg_parser.parse_args()
+    asyncio.run(serve(cli_args.port, parse_config(cli_args)))
@@ -1,12 +1,29 @@
-SECONDS_DELAY_RECEIVING_MSG = (
-    3  # give a delay for the bot to respond, so it can catch multiple messages
-)
+# Give a delay for the bot to respond, so it can catch multiple messages. The delay adapts to how long the user pauses
+# between messages of a burst.
+MIN_SECONDS_DELAY_RECEIVING_MSG = 1
+MAX_SECONDS_DELAY_RECEIVING_MSG = 5
 MAX_THREAD_MESSAGES = 200
+MAX_CACHED_THREADS = 500
 ACTIVATE_THREAD_PREFIX = "💬✅"
 INACTIVATE_THREAD_PREFIX = "💬❌"
-MAX_CHARS_PER_REPLY_MSG = (
-    1500  # message has a 2k limit, we just break message into 1.5k
+# Choices of /model and /pin_model besides model names
+AUTO_MODEL_CHOICE = "auto"
+UNPIN_MODEL_CHOICE = "unpin"
+# Characters of a message, longer replies are packed into several messages
+MAX_MESSAGE_LENGTH = 2000
+# Replies needing more messages are sent as a file in the last message
+MAX_REPLY_MESSAGES = 3
+REPLY_ATTACHMENT_NAME = "reply.md"
+# Sends and edits are paced below the rate limits of Discord, about 5 per 5 seconds in a channel and 50 requests per
+# second in total
+CHANNEL_SENDS_PER_WINDOW = 5
+CHANNEL_SEND_WINDOW_SECONDS = 5
+GLOBAL_REQUESTS_PER_SECOND = 50
+SECONDS_BETWEEN_REPLY_EDITS = (
+    1.0  # discord allows 5 message edits per 5 seconds in a channel
 )
+# System channel messages sent at once when the bot comes online
+MAX_CONCURRENT_ANNOUNCEMENTS = 5
 EMBED_TITLE_LENGTH = 256
 EMBED_DESCRIPTION_LENGTH = 4096
 EMBED_FIELD_COUNT = 25
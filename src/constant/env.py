@@ -1,6 +1,6 @@
 import os
 from dataclasses import dataclass
-from typing import List
+from typing import List, Dict, Optional
 
 from dotenv import load_dotenv
 
@@ -14,6 +14,21 @@ class CommonEnv:
     discord_client_id: str
     allow_server_ids: List[int]
     bot_invite_url: str
+    max_concurrent_requests: int
+    guild_weights: Dict[int, float]
+    completion_cache_size: int
+    completion_cache_ttl_seconds: int
+    completion_cache_path: Optional[str]
+    conversation_store_path: Optional[str]
+    summary_trigger_tokens: int
+    summary_model: Optional[str]
+    prompt_selection: str
+    auto_model: bool
+    metrics_port: Optional[int]
+    trace_path: Optional[str]
+    # Chat services outside this package by type, as module:class
+    chat_service_plugins: Dict[str, str]
+    command_hash_path: Optional[str]
 
     @staticmethod
     def load() -> "CommonEnv":
@@ -25,6 +40,28 @@ class CommonEnv:
                 int(server_id) for server_id in os.environ["ALLOWED_SERVER_IDS"].split(",")
             ],
             bot_invite_url=os.environ["BOT_INVITE_URL"],
+            max_concurrent_requests=int(os.environ.get("MAX_CONCURRENT_REQUESTS", 8)),
+            guild_weights={
+                int(server_id): float(weight) for server_id, weight in (
+                    item.split(":") for item in os.environ.get("GUILD_WEIGHTS", "").split(",") if item
+                )
+            },
+            completion_cache_size=int(os.environ.get("COMPLETION_CACHE_SIZE", 0)),
+            completion_cache_ttl_seconds=int(os.environ.get("COMPLETION_CACHE_TTL_SECONDS", 86400)),
+            completion_cache_path=os.environ.get("COMPLETION_CACHE_PATH") or None,
+            conversation_store_path=os.environ.get("CONVERSATION_STORE_PATH") or None,
+            summary_trigger_tokens=int(os.environ.get("SUMMARY_TRIGGER_TOKENS", 0)),
+            summary_model=os.environ.get("SUMMARY_MODEL") or None,
+            prompt_selection=os.environ.get("PROMPT_SELECTION", "recent"),
+            auto_model=os.environ.get("AUTO_MODEL", "false").lower() == "true",
+            metrics_port=int(os.environ["METRICS_PORT"]) if os.environ.get("METRICS_PORT") else None,
+            trace_path=os.environ.get("TRACE_PATH") or None,
+            chat_service_plugins={
+                service_type.strip(): path.strip() for service_type, path in (
+                    item.split("=", 1) for item in os.environ.get("CHAT_SERVICE_PLUGINS", "").split(",") if item
+                )
+            },
+            command_hash_path=os.environ.get("COMMAND_HASH_PATH") or None,
         )
 
 
@@ -33,9 +70,9 @@ class OpenAIEnv:
     openai_api_key: str
 
     @staticmethod
-    def load() -> "OpenAIEnv":
+    def load(label: Optional[str] = None) -> "OpenAIEnv":
         return OpenAIEnv(
-            openai_api_key=os.environ["OPENAI_API_KEY"],
+            openai_api_key=os.environ[env_name("OPENAI_API_KEY", label)],
         )
 
 
@@ -46,11 +83,11 @@ class AzureOpenAIEnv:
     openai_api_version: str
 
     @staticmethod
-    def load() -> "AzureOpenAIEnv":
+    def load(label: Optional[str] = None) -> "AzureOpenAIEnv":
         return AzureOpenAIEnv(
-            openai_api_key=os.environ["AZURE_OPENAI_API_KEY"],
-            openai_api_base=os.environ["AZURE_OPENAI_API_BASE"],
-            openai_api_version=os.environ["AZURE_OPENAI_API_VERSION"],
+            openai_api_key=os.environ[env_name("AZURE_OPENAI_API_KEY", label)],
+            openai_api_base=os.environ[env_name("AZURE_OPENAI_API_BASE", label)],
+            openai_api_version=os.environ[env_name("AZURE_OPENAI_API_VERSION", label)],
         )
 
 
@@ -59,7 +96,27 @@ class PalmEnv:
     palm_api_key: str
 
     @staticmethod
-    def load() -> "PalmEnv":
+    def load(label: Optional[str] = None) -> "PalmEnv":
         return PalmEnv(
-            palm_api_key=os.environ["PALM_API_KEY"],
+            palm_api_key=os.environ[env_name("PALM_API_KEY", label)],
         )
+
+
+@dataclass(frozen=True)
+class RouterEnv:
+    # Chat services to route between, as type or type:label, e.g. azure:EASTUS loads AZURE_OPENAI_API_KEY_EASTUS
+    services: List[str]
+    # Send duplicate requests to another service when a request is slow
+    hedge: bool
+
+    @staticmethod
+    def load() -> "RouterEnv":
+        return RouterEnv(
+            services=[service.strip() for service in os.environ["ROUTER_SERVICES"].split(",") if service.strip()],
+            hedge=os.environ.get("ROUTER_HEDGE", "false").lower() == "true",
+        )
+
+
+def env_name(name: str, label: Optional[str]) -> str:
+    """Return name of environment variable for a labelled chat service, e.g. a second Azure region."""
+    return f"{name}_{label.upper()}" if label else name
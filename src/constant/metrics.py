@@ -0,0 +1,8 @@
+# Seconds between samples of event loop lag
+LOOP_LAG_INTERVAL_SECONDS = 0.5
+
+# A callback blocking the event loop for longer is reported with the handler responsible
+SLOW_CALLBACK_SECONDS = 0.1
+
+# Discord closes the connection after missed heartbeats, warn well before that
+HEARTBEAT_WARNING_SECONDS = 1.0
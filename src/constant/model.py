@@ -2,22 +2,37 @@ from typing import List
 
 from src.model.model import Model
 
+# Estimated tokens of an image, a 1024x1024 image in high detail costs 765 tokens
+IMAGE_TOKENS = 765
+
+# Upper bound of tokens added to every message apart from its content, e.g. role separators
+MESSAGE_OVERHEAD_TOKENS = 8
+
+MESSAGE_TOKEN_CACHE_SIZE = 10000
+
+# Share of prompt budget for the latest messages when older messages are selected by relevance
+RECENT_TAIL_SHARE = 0.5
+
+# Words a rolling summary of older messages is asked to stay within
+SUMMARY_MAX_WORDS = 300
+
 OPENAI_MODELS: List[Model] = [
-    Model(name='gpt-3.5-turbo'),
-    Model(name='gpt-3.5-turbo-16k'),
-    Model(name='gpt-4'),
-    Model(name='gpt-4-32k'),
-    Model(name='gpt-4-vision-preview', upload_image=True)
+    Model(name='gpt-3.5-turbo', context_window=4096, cost=0.0015),
+    Model(name='gpt-3.5-turbo-16k', context_window=16384, cost=0.003),
+    Model(name='gpt-4', context_window=8192, cost=0.03),
+    Model(name='gpt-4-32k', context_window=32768, cost=0.06),
+    Model(name='gpt-4-vision-preview', upload_image=True, context_window=128000, max_output_tokens=4096, cost=0.01)
 ]
 
 AZURE_MODELS: List[Model] = [
-    Model(name='gpt-35-turbo'),
-    Model(name='gpt-35-turbo-16k'),
-    Model(name='gpt-4'),
-    Model(name='gpt-4-32k')
+    Model(name='gpt-35-turbo', context_window=4096, cost=0.0015),
+    Model(name='gpt-35-turbo-16k', context_window=16384, cost=0.003),
+    Model(name='gpt-4', context_window=8192, cost=0.03),
+    Model(name='gpt-4-32k', context_window=32768, cost=0.06)
 ]
 
+# Priced per 1K characters, both models cost the same
 PALM_MODELS: List[Model] = [
-    Model(name='models/chat-bison-001'),
-    Model(name='models/codechat-bison-001'),
+    Model(name='models/chat-bison-001', context_window=5120, cost=0.0005),
+    Model(name='models/codechat-bison-001', context_window=7168, cost=0.0005),
 ]
@@ -0,0 +1,26 @@
+# Timeout of a single request to chat service, streaming requests time out between chunks
+REQUEST_TIMEOUT_SECONDS = 120
+CONNECT_TIMEOUT_SECONDS = 10
+
+# Idle connections to chat service are kept open, so that requests after warm-up or a quiet minute skip TLS handshakes
+KEEPALIVE_SECONDS = 120
+MAX_CONNECTIONS = 100
+MAX_KEEPALIVE_CONNECTIONS = 20
+# Connections opened at once on warm-up
+WARM_UP_CONNECTIONS = 4
+
+# Retry transient errors with jittered exponential backoff, no retry starts after the deadline
+RETRY_MAX_ATTEMPTS = 4
+RETRY_BASE_SECONDS = 1
+RETRY_MAX_BACKOFF_SECONDS = 20
+RETRY_DEADLINE_SECONDS = 60
+
+# Fail fast after consecutive transient errors, until the cooldown passes
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_RESET_SECONDS = 30
+
+# Send a duplicate request to another backend of router when there is no first chunk after the percentile of recent
+# latencies, for at most a fraction of requests
+HEDGE_PERCENTILE = 0.95
+HEDGE_BUDGET = 0.05
+HEDGE_MIN_SAMPLES = 20
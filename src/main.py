@@ -1,20 +1,37 @@
 import asyncio
 import logging
+from time import perf_counter
 from typing import Optional
 
 import discord
 from discord import Message as DiscordMessage
 
-from src.constant.discord import EMBED_FIELD_VALUE_LENGTH, ACTIVATE_THREAD_PREFIX, SECONDS_DELAY_RECEIVING_MSG, \
-    MAX_THREAD_MESSAGES, EMBED_DESCRIPTION_LENGTH
+from src.constant.discord import EMBED_FIELD_VALUE_LENGTH, ACTIVATE_THREAD_PREFIX, EMBED_DESCRIPTION_LENGTH, \
+    AUTO_MODEL_CHOICE, UNPIN_MODEL_CHOICE
 from src.constant.env import CommonEnv
+from src.message.command_sync import CommandSync
+from src.message.conversation_cache import ConversationCache
+from src.message.conversation_store import ConversationStore
 from src.message.discord_utils import logger, send_message_to_system_channel, allow_command, allow_message, \
-    is_last_message_stale, discord_message_to_message
+    should_block, starter_embed_to_message
 from src.message.process_response import process_response
+from src.message.send_queue import SEND_QUEUE
+from src.message.thread_scheduler import ThreadScheduler
+from src.metrics.instrumentation import track_stage, Stage
+from src.metrics.loop_monitor import LoopMonitor
+from src.metrics.registry import REGISTRY
+from src.metrics.server import start_metrics_server
+from src.metrics.tracing import TRACER, start_trace
+from src.model.completion_data import CompletionData
 from src.model.message import Message
+from src.model.request_context import RequestContext, RequestPriority
 from src.model.role import Role
-from src.service.chat_service import ChatServiceType
-from src.service.chat_service_factory import ChatServiceFactory
+from src.service.chat_service_factory import ChatServiceFactory, register_chat_service
+from src.service.completion_cache import CompletionCache
+from src.service.conversation_summarizer import ConversationSummarizer
+from src.service.reply_stream import close_stream
+from src.service.request_limiter import RequestLimiter
+from src.service.retrieval import RetrievalIndex
 
 logging.basicConfig(
     format="[%(asctime)s] [%(filename)s:%(lineno)d] %(message)s",
@@ -29,29 +46,132 @@ common_env = CommonEnv.load()
 
 # Create message client
 client = discord.Client(intents=intents)
-client.chat_service = ChatServiceFactory.get_service_cls(ChatServiceType(common_env.chat_service))
+for plugin_type, plugin_path in common_env.chat_service_plugins.items():
+    register_chat_service(plugin_type, plugin_path)
+client.chat_service = ChatServiceFactory.get_service_cls(common_env.chat_service)
+client.chat_service.set_auto_model(common_env.auto_model)
+client.chat_service.set_request_limiter(
+    RequestLimiter(max_concurrency=common_env.max_concurrent_requests, guild_weights=common_env.guild_weights)
+)
+if common_env.completion_cache_size > 0:
+    client.chat_service.set_completion_cache(CompletionCache(
+        max_size=common_env.completion_cache_size,
+        ttl_seconds=common_env.completion_cache_ttl_seconds,
+        path=common_env.completion_cache_path
+    ))
+if common_env.summary_trigger_tokens > 0:
+    client.chat_service.set_summarizer(ConversationSummarizer(
+        trigger_tokens=common_env.summary_trigger_tokens,
+        model_name=common_env.summary_model
+    ))
+if common_env.prompt_selection == "relevant":
+    client.chat_service.set_retrieval_index(RetrievalIndex())
+client.conversation_cache = ConversationCache(
+    store=ConversationStore(common_env.conversation_store_path) if common_env.conversation_store_path else None
+)
+client.thread_scheduler = ThreadScheduler()
+# Set once chat service is warmed up, online status is reported after that
+client.ready = asyncio.Event()
+client.announced = False
 tree = discord.app_commands.CommandTree(client)
+client.command_sync = CommandSync(common_env.command_hash_path)
+
+
+@client.event
+async def setup_hook():
+    # Report blocking work which stalls gateway heartbeats
+    client.loop_monitor = LoopMonitor(get_heartbeat_latency=lambda: client.latency)
+    client.loop_monitor.start()
+
+    # Warm up alongside login, so that the first chat does not pay for loading tokenizers and opening connections
+    client.warm_up_task = asyncio.create_task(warm_up())
+
+    await client.conversation_cache.restore()
+
+    if common_env.trace_path is not None:
+        TRACER.open(common_env.trace_path)
+    if common_env.metrics_port is not None:
+        register_metrics()
+        client.metrics_runner = await start_metrics_server(common_env.metrics_port)
+
+
+async def warm_up():
+    start = perf_counter()
+    try:
+        await client.chat_service.warm_up()
+    finally:
+        client.ready.set()
+        logger.info(f"Warmed up {client.chat_service.name} in {perf_counter() - start:.2f}s")
+
+
+def register_metrics():
+    """Export stats of request limiter and caches, read when metrics are scraped."""
+    request_limiter = client.chat_service.request_limiter
+    if request_limiter is not None:
+        REGISTRY.gauge("chat_requests_active", "Chat requests being sent", lambda: [
+            ({}, request_limiter.stats().active)
+        ])
+        REGISTRY.gauge("chat_requests_queued", "Chat requests waiting for a slot", lambda: [
+            ({"priority": priority.name.lower()}, queued) for priority, queued in request_limiter.stats().queued.items()
+        ])
+        REGISTRY.gauge("chat_request_wait_p95_seconds", "95th percentile of recent waits for a slot", lambda: [
+            ({}, request_limiter.stats().p95_wait_seconds)
+        ])
+
+    completion_cache = client.chat_service.completion_cache
+    if completion_cache is not None:
+        REGISTRY.gauge("completion_cache_entries", "Entries of completion cache in memory", lambda: [
+            ({}, completion_cache.stats().size)
+        ])
+
+    REGISTRY.gauge("conversation_cache_threads", "Threads cached in memory", lambda: [
+        ({}, len(client.conversation_cache.threads))
+    ])
+    REGISTRY.gauge("discord_send_queued", "Sends and edits waiting in outbound queues", lambda: [
+        ({}, SEND_QUEUE.stats().queued)
+    ])
+    REGISTRY.gauge("discord_send_backlogged_channels", "Channels with sends or edits waiting", lambda: [
+        ({}, SEND_QUEUE.stats().backlogged_channels)
+    ])
+    REGISTRY.gauge("discord_send_oldest_wait_seconds", "Seconds the oldest queued send or edit has waited", lambda: [
+        ({}, SEND_QUEUE.stats().oldest_wait_seconds)
+    ])
+    REGISTRY.gauge("bot_ready", "1 once chat service is warmed up", lambda: [
+        ({}, int(client.ready.is_set()))
+    ])
 
 
 @client.event
 async def on_ready():
     logger.info("We have logged in as %s. Invite URL: %s", client.user, common_env.bot_invite_url)
 
-    await send_message_to_system_channel(
-        client,
-        message=f"<@{client.user.id}> is online, using `{client.chat_service.__class__.__name__} `🥳",
-    )
+    await client.ready.wait()
+
+    # on_ready fires again on every gateway reconnect, announce once per process and sync commands only if changed
+    tasks = [update_presence(), client.command_sync.sync(tree)]
+    if not client.announced:
+        client.announced = True
+        tasks.append(send_message_to_system_channel(
+            client,
+            message=f"<@{client.user.id}> is online, using `{client.chat_service.__class__.__name__} `🥳",
+        ))
+
+    await asyncio.gather(*tasks)
+
 
+async def update_presence():
     # Set current model name as game status
-    if client.chat_service.model is not None:
+    if client.chat_service.auto_model:
+        await client.change_presence(activity=discord.Game(name=AUTO_MODEL_CHOICE))
+    elif client.chat_service.model is not None:
         await client.change_presence(activity=discord.Game(name=client.chat_service.model.name))
 
-    await tree.sync()
-
 
 @tree.command(name="model", description="Switch chat completion model")
 @discord.app_commands.checks.has_permissions(administrator=True)
 @discord.app_commands.choices(models=[
+    discord.app_commands.Choice(name=AUTO_MODEL_CHOICE, value=AUTO_MODEL_CHOICE)
+] + [
     discord.app_commands.Choice(name=model.name, value=model.name) for model in
     client.chat_service.get_supported_models()
 ])
@@ -59,17 +179,47 @@ async def model_command(interaction: discord.Interaction, models: discord.app_co
     if not allow_command(interaction, allow_server_ids=common_env.allow_server_ids):
         return
 
-    # Update current model
+    # Route each request to the cheapest model fitting its prompt
+    client.chat_service.set_auto_model(models.value == AUTO_MODEL_CHOICE)
+
+    # Update current model, kept as fallback in auto mode
     model_list = client.chat_service.get_supported_models()
     model = next((model for model in model_list if model.name == models.name), None)
-    client.chat_service.set_current_model(model)
+    if model is not None:
+        client.chat_service.set_current_model(model)
 
-    # Set current model name as game status
-    if client.chat_service.model is not None:
-        await client.change_presence(activity=discord.Game(name=client.chat_service.model.name))
+    await update_presence()
 
     # noinspection PyUnresolvedReferences
-    await interaction.response.send_message(f"✅ Chat model switched to `{model.name}`")
+    await interaction.response.send_message(f"✅ Chat model switched to `{models.name}`")
+
+
+@tree.command(name="pin_model", description="Pin chat completion model of this thread")
+@discord.app_commands.checks.has_permissions(administrator=True)
+@discord.app_commands.choices(models=[
+    discord.app_commands.Choice(name=UNPIN_MODEL_CHOICE, value=UNPIN_MODEL_CHOICE)
+] + [
+    discord.app_commands.Choice(name=model.name, value=model.name) for model in
+    client.chat_service.get_supported_models()
+])
+async def pin_model_command(interaction: discord.Interaction, models: discord.app_commands.Choice[str]):
+    # Used inside threads, which allow_command rejects as they are not text channels
+    if should_block(guild=interaction.guild, allow_server_ids=common_env.allow_server_ids):
+        return
+
+    if not isinstance(interaction.channel, discord.Thread):
+        # noinspection PyUnresolvedReferences
+        await interaction.response.send_message("❌ Model can only be pinned in a thread", ephemeral=True)
+        return
+
+    model_list = client.chat_service.get_supported_models()
+    model = next((model for model in model_list if model.name == models.name), None)
+    client.chat_service.pin_model(interaction.channel.id, model)
+
+    # noinspection PyUnresolvedReferences
+    await interaction.response.send_message(
+        f"📌 Thread model pinned to `{model.name}`" if model else "✅ Thread model unpinned"
+    )
 
 
 @tree.command(name="chat", description="Create a new thread for conversation")
@@ -92,7 +242,7 @@ async def chat_command(interaction: discord.Interaction, message: str, attachmen
             if not attachment.content_type.startswith("image/"):
                 raise Exception(f"Unsupported attachment type: {attachment.content_type}")
 
-            if not client.chat_service.model.upload_image:
+            if not client.chat_service.can_upload_image():
                 raise Exception(f"{client.chat_service.model.name} does not support image upload")
 
             logger.debug(f"Uploaded attachment: {attachment.url}")
@@ -105,82 +255,128 @@ async def chat_command(interaction: discord.Interaction, message: str, attachmen
         )
         embed.add_field(name=user.name, value=message[:EMBED_FIELD_VALUE_LENGTH])
 
-        # Send embed message
-        # noinspection PyUnresolvedReferences
-        await interaction.response.send_message(embed=embed)
-        response = await interaction.original_response()
-
-        # Create a new thread for /chat
-        thread = await response.create_thread(
-            name=f"{ACTIVATE_THREAD_PREFIX} {user.name[:20]} - {message[:30]}",
-            slowmode_delay=1,
-            reason="chat_with_bot",
-            auto_archive_duration=60,
-        )
+        # Start chat request right away, it only depends on the message while the thread is created alongside
+        start_trace(command="chat", interaction_id=interaction.id)
+        new_message = Message(role=Role.USER.value, content=message, image_url=image_url)
+        completion = asyncio.create_task(client.chat_service.chat(
+            history=[new_message],
+            stream=True,
+            context=RequestContext(guild_id=interaction.guild_id, user_id=user.id, priority=RequestPriority.NEW_THREAD)
+        ))
+
+        try:
+            thread = await create_chat_thread(interaction, embed, name=f"{user.name[:20]} - {message[:30]}")
+        except BaseException:
+            await discard_completion(completion)
+            raise
+
+        # Thread starter message shares the same id as the thread, it is cached as a fetch would convert it
+        client.conversation_cache.seed(thread.id, {thread.id: starter_embed_to_message(embed)})
 
-        # Send chat request
         async with thread.typing():
-            new_message = Message(role=Role.USER.value, content=message, image_url=image_url)
-            response_data = await client.chat_service.chat(history=[new_message])
-            await process_response(thread=thread, response_data=response_data)
+            response_data = await completion
+            with track_stage(Stage.DISCORD_SEND, status=response_data.status.name):
+                sent_messages = await process_response(thread=thread, response_data=response_data)
+            client.conversation_cache.add_messages(sent_messages)
 
     except Exception as err:
         logger.exception(err)
-        await interaction.response.send_message(
-            embed=discord.Embed(
-                description=f"Failed to start chat {str(err)}",
-                color=discord.Color.red()
-            ),
-            ephemeral=True
-        )
+        error_embed = discord.Embed(description=f"Failed to start chat {str(err)}", color=discord.Color.red())
+        # Embed message may have been sent before the failure
+        if interaction.response.is_done():
+            await interaction.followup.send(embed=error_embed, ephemeral=True)
+        else:
+            # noinspection PyUnresolvedReferences
+            await interaction.response.send_message(embed=error_embed, ephemeral=True)
+
+
+async def create_chat_thread(interaction: discord.Interaction, embed: discord.Embed, name: str) -> discord.Thread:
+    """Reply to /chat with embed message, and create a thread from the reply."""
+    # noinspection PyUnresolvedReferences
+    await interaction.response.send_message(embed=embed)
+    response = await interaction.original_response()
+    return await response.create_thread(
+        name=f"{ACTIVATE_THREAD_PREFIX} {name}",
+        slowmode_delay=1,
+        reason="chat_with_bot",
+        auto_archive_duration=60,
+    )
+
+
+async def discard_completion(completion: asyncio.Task):
+    """Cancel a chat request whose reply has nowhere to go. A reply already streaming is closed, which closes the
+    provider response and releases its request slot."""
+    completion.cancel()
+    try:
+        response_data = await completion
+    except (asyncio.CancelledError, Exception):
+        return
+    if response_data.reply_stream is not None:
+        await close_stream(response_data.reply_stream)
 
 
 @client.event
 async def on_message(message: DiscordMessage):
     try:
+        client.conversation_cache.add_messages([message])
+
         if not await allow_message(client, message, allow_server_ids=common_env.allow_server_ids):
             return
 
         thread = message.channel
-
-        # wait a bit in case user has more messages
-        if SECONDS_DELAY_RECEIVING_MSG > 0:
-            await asyncio.sleep(SECONDS_DELAY_RECEIVING_MSG)
-            if is_last_message_stale(
-                    interaction_message=message,
-                    last_message=thread.last_message,
-                    bot_id=client.user.id,
-            ):
-                # there is another message, so ignore this one
-                return
-
         logger.info(
-            f"Thread message to process - {message.author}: {message.content[:50]} - {thread.name} {thread.jump_url}"
+            f"Thread message received - {message.author}: {message.content[:50]} - {thread.name} {thread.jump_url}"
         )
 
-        # Send chat request
-        async with thread.typing():
-            response_data = await client.chat_service.chat(
-                history=[
-                    discord_message_to_message(message)
-                    async for message in thread.history(limit=MAX_THREAD_MESSAGES, oldest_first=True)
-                ],
-            )
-
-        # there is another message, and it's not from us, so ignore this response
-        if is_last_message_stale(
-                interaction_message=message,
-                last_message=thread.last_message,
-                bot_id=client.user.id,
-        ):
-            return
-
-        # send response
-        await process_response(thread=thread, response_data=response_data)
+        # Wait a bit in case user has more messages, a new message cancels the request of this one
+        context = RequestContext(guild_id=message.guild.id, user_id=message.author.id, thread_id=thread.id)
+        start_trace(message_id=message.id, thread_id=thread.id)
+        client.thread_scheduler.schedule(
+            thread.id,
+            request=lambda: request_thread_completion(thread, context),
+            deliver=lambda response_data: deliver_thread_completion(thread, response_data),
+        )
     except Exception as err:
         logger.exception(err)
 
 
+async def request_thread_completion(thread: discord.Thread, context: RequestContext) -> CompletionData:
+    logger.info(f"Thread to process - {thread.name} {thread.jump_url}")
+
+    # Send chat request
+    async with thread.typing():
+        with track_stage(Stage.HISTORY_FETCH):
+            history = await client.conversation_cache.get_history(thread)
+        return await client.chat_service.chat(history=history, stream=True, context=context)
+
+
+async def deliver_thread_completion(thread: discord.Thread, response_data: CompletionData):
+    with track_stage(Stage.DISCORD_SEND, status=response_data.status.name):
+        sent_messages = await process_response(thread=thread, response_data=response_data)
+    client.conversation_cache.add_messages(sent_messages)
+
+
+@client.event
+async def on_raw_message_edit(payload: discord.RawMessageUpdateEvent):
+    if "content" in payload.data:
+        client.conversation_cache.edit_message(payload.channel_id, payload.message_id, payload.data["content"])
+
+
+@client.event
+async def on_raw_message_delete(payload: discord.RawMessageDeleteEvent):
+    client.conversation_cache.delete_messages(payload.channel_id, [payload.message_id])
+
+
+@client.event
+async def on_raw_bulk_message_delete(payload: discord.RawBulkMessageDeleteEvent):
+    client.conversation_cache.delete_messages(payload.channel_id, payload.message_ids)
+
+
+@client.event
+async def on_raw_thread_delete(payload: discord.RawThreadDeleteEvent):
+    client.conversation_cache.discard(payload.thread_id)
+
+
 @tree.command(name="count_token", description="Count the token usage of a message")
 @discord.app_commands.checks.bot_has_permissions(send_messages=True)
 async def count_token(interaction: discord.Interaction, message: str):
@@ -191,7 +387,7 @@ async def count_token(interaction: discord.Interaction, message: str):
         # noinspection PyUnresolvedReferences
         await interaction.response.defer()
 
-        tokens = await client.chat_service.count_token_usage(
+        tokens = await client.chat_service.count_tokens(
             messages=[Message(role=Role.USER.value, content=message)],
         )
 
@@ -212,4 +408,5 @@ async def count_token(interaction: discord.Interaction, message: str):
         )
 
 
-client.run(common_env.discord_bot_token)
+if __name__ == "__main__":
+    client.run(common_env.discord_bot_token)
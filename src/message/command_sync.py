@@ -0,0 +1,57 @@
+import logging
+import os
+from hashlib import sha256
+from json import dumps
+from typing import Optional
+
+import discord
+
+logger = logging.getLogger(__name__)
+
+
+def command_tree_hash(tree: discord.app_commands.CommandTree) -> str:
+    """Return a digest of the global commands of tree as sent to Discord on sync, and the application of tree."""
+    payload = [command.to_dict() for command in tree.get_commands()]
+    schema = dumps({"application_id": tree.client.application_id, "commands": payload}, sort_keys=True, default=str)
+    return sha256(schema.encode()).hexdigest()
+
+
+class CommandSync:
+    """Sync global commands only when they changed since the last sync, as syncs are rate limited and on_ready fires on
+    every reconnect. The hash of the last sync is kept in a file across restarts if a path is given."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = path
+        self.synced_hash: Optional[str] = self.__read_hash()
+
+    async def sync(self, tree: discord.app_commands.CommandTree) -> bool:
+        """Sync commands of tree if changed, return whether they were synced."""
+        tree_hash = command_tree_hash(tree)
+        if tree_hash == self.synced_hash:
+            logger.debug("Commands unchanged, skip sync")
+            return False
+
+        await tree.sync()
+        self.synced_hash = tree_hash
+        self.__write_hash(tree_hash)
+        logger.info(f"Synced {len(tree.get_commands())} commands")
+        return True
+
+    def __read_hash(self) -> Optional[str]:
+        if self.path is None or not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path) as file:
+                return file.read().strip() or None
+        except OSError as err:
+            logger.warning(f"Failed to read command hash from {self.path}: {err}")
+            return None
+
+    def __write_hash(self, tree_hash: str):
+        if self.path is None:
+            return
+        try:
+            with open(self.path, "w") as file:
+                file.write(tree_hash)
+        except OSError as err:
+            logger.warning(f"Failed to write command hash to {self.path}: {err}")
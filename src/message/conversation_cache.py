@@ -0,0 +1,138 @@
+import logging
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional, Iterable
+
+import discord
+from cachetools import LRUCache
+from discord import Message as DiscordMessage
+
+from src.constant.discord import MAX_THREAD_MESSAGES, MAX_CACHED_THREADS
+from src.message.conversation_store import ConversationStore
+from src.message.discord_utils import discord_message_to_message
+from src.model.message import Message
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ThreadConversation:
+    # Converted messages keyed by discord message id, None for messages without content (e.g. embeds)
+    messages: Dict[int, Optional[Message]] = field(default_factory=dict)
+    last_message_id: int = 0
+
+    def put(self, message_id: int, message: Optional[Message]):
+        self.messages[message_id] = message
+        self.last_message_id = max(self.last_message_id, message_id)
+
+    def history(self) -> List[Optional[Message]]:
+        return [self.messages[message_id] for message_id in sorted(self.messages)]
+
+
+class ConversationCache:
+    """In-memory conversation history of bot threads, kept up to date from gateway events. With a store, conversations
+    are also persisted and read back from the store instead of Discord after a restart."""
+
+    def __init__(self, max_threads: int = MAX_CACHED_THREADS, store: Optional[ConversationStore] = None):
+        self.threads: LRUCache = LRUCache(maxsize=max_threads)
+        self.store = store
+
+    async def restore(self):
+        """Load the most recently active threads from store, e.g. on startup."""
+        if self.store is None:
+            return
+
+        thread_ids = await self.store.recent_thread_ids(limit=self.threads.maxsize)
+        for thread_id in reversed(thread_ids):
+            await self.__load(thread_id)
+        logger.info(f"Restored {len(thread_ids)} conversations from store")
+
+    async def get_history(self, thread: discord.Thread) -> List[Optional[Message]]:
+        """Return conversation history of thread in chronological order, fetching from Discord only if needed."""
+        conversation: Optional[ThreadConversation] = self.threads.get(thread.id)
+        if conversation is None:
+            conversation = await self.__load(thread.id)
+
+        if conversation is None:
+            conversation = ThreadConversation()
+            await self.__fetch(thread, conversation, after=None)
+            self.threads[thread.id] = conversation
+        elif self.__is_outdated(thread, conversation):
+            await self.__fetch(thread, conversation, after=discord.Object(id=conversation.last_message_id))
+
+        return conversation.history()
+
+    def seed(self, thread_id: int, messages: Dict[int, Optional[Message]]):
+        """Start caching a new thread with known messages, e.g. the thread starter of /chat."""
+        conversation = ThreadConversation()
+        for message_id, message in messages.items():
+            conversation.put(message_id, message)
+        self.threads[thread_id] = conversation
+        self.__persist(thread_id, messages)
+
+    def add_messages(self, messages: Iterable[DiscordMessage]):
+        """Add or replace messages of cached threads. Messages of other channels are ignored."""
+        for message in messages:
+            conversation: Optional[ThreadConversation] = self.threads.get(message.channel.id)
+            if conversation is not None:
+                converted = discord_message_to_message(message)
+                conversation.put(message.id, converted)
+                self.__persist(message.channel.id, {message.id: converted})
+
+    def edit_message(self, channel_id: int, message_id: int, content: Optional[str]):
+        # Stored threads may not be cached, e.g. evicted from cache
+        if self.store is not None:
+            self.store.edit_message(channel_id, message_id, content)
+
+        conversation: Optional[ThreadConversation] = self.threads.get(channel_id)
+        if conversation is None or conversation.messages.get(message_id) is None:
+            return
+
+        message = conversation.messages[message_id]
+        conversation.messages[message_id] = replace(message, content=content) if content else None
+
+    def delete_messages(self, channel_id: int, message_ids: Iterable[int]):
+        message_ids = list(message_ids)
+        if self.store is not None:
+            self.store.delete_messages(channel_id, message_ids)
+
+        conversation: Optional[ThreadConversation] = self.threads.get(channel_id)
+        if conversation is None:
+            return
+
+        for message_id in message_ids:
+            conversation.messages.pop(message_id, None)
+
+    def discard(self, thread_id: int):
+        self.threads.pop(thread_id, None)
+        if self.store is not None:
+            self.store.delete_thread(thread_id)
+
+    async def __load(self, thread_id: int) -> Optional[ThreadConversation]:
+        if self.store is None:
+            return None
+
+        stored = await self.store.load(thread_id)
+        if stored is None:
+            return None
+
+        messages, last_message_id = stored
+        conversation = ThreadConversation(messages=messages, last_message_id=last_message_id)
+        self.threads[thread_id] = conversation
+        return conversation
+
+    def __persist(self, thread_id: int, messages: Dict[int, Optional[Message]]):
+        if self.store is not None:
+            self.store.put_messages(thread_id, messages)
+
+    @staticmethod
+    def __is_outdated(thread: discord.Thread, conversation: ThreadConversation) -> bool:
+        # Gateway events keep last_message_id up to date, so a newer id means we have missed some messages
+        return thread.last_message_id is not None and thread.last_message_id > conversation.last_message_id
+
+    async def __fetch(self, thread: discord.Thread, conversation: ThreadConversation, after: Optional[discord.Object]):
+        logger.debug(f"Fetch history of thread {thread.id} after {after.id if after else None}")
+        fetched = {}
+        async for message in thread.history(limit=MAX_THREAD_MESSAGES, after=after, oldest_first=True):
+            fetched[message.id] = discord_message_to_message(message)
+            conversation.put(message.id, fetched[message.id])
+        self.__persist(thread.id, fetched)
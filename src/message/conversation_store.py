@@ -0,0 +1,131 @@
+import asyncio
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Iterable, Tuple
+
+from src.model.message import Message
+
+logger = logging.getLogger(__name__)
+
+
+class ConversationStore:
+    """Converted messages of bot threads kept in a SQLite file in WAL mode, so conversations survive restarts without
+    fetching them from Discord again. Each thread has a resume cursor, the last message id seen by the bot.
+    Statements run in order on a single worker thread, writes can be issued without waiting for them."""
+
+    def __init__(self, path: str):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="conversation-store")
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS threads (thread_id INTEGER PRIMARY KEY, last_message_id INTEGER)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "thread_id INTEGER, message_id INTEGER, role TEXT, name TEXT, content TEXT, image_url TEXT, "
+            "PRIMARY KEY (thread_id, message_id))"
+        )
+        self.connection.commit()
+
+    async def load(self, thread_id: int) -> Optional[Tuple[Dict[int, Optional[Message]], int]]:
+        """Return stored messages and resume cursor of thread, or None if thread is not stored."""
+        return await self.__run(self.__select_thread, thread_id)
+
+    async def recent_thread_ids(self, limit: int) -> List[int]:
+        """Return ids of threads with the most recent messages."""
+        rows = await self.__run(
+            lambda: self.connection.execute(
+                "SELECT thread_id FROM threads ORDER BY last_message_id DESC LIMIT ?", (limit,)
+            ).fetchall()
+        )
+        return [thread_id for thread_id, in rows]
+
+    def put_messages(self, thread_id: int, messages: Dict[int, Optional[Message]]):
+        if messages:
+            self.__submit(self.__insert_messages, thread_id, list(messages.items()))
+
+    def edit_message(self, thread_id: int, message_id: int, content: Optional[str]):
+        self.__submit(self.__update_message, thread_id, message_id, content)
+
+    def delete_messages(self, thread_id: int, message_ids: Iterable[int]):
+        self.__submit(self.__delete_messages, thread_id, list(message_ids))
+
+    def delete_thread(self, thread_id: int):
+        self.__submit(self.__delete_thread, thread_id)
+
+    async def close(self):
+        await self.__run(self.connection.close)
+        self.executor.shutdown()
+
+    async def __run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, func, *args)
+
+    def __submit(self, func, *args):
+        future = self.executor.submit(func, *args)
+        future.add_done_callback(self.__log_error)
+
+    @staticmethod
+    def __log_error(future):
+        if future.exception() is not None:
+            logger.error(f"Failed to write conversation store: {future.exception()}")
+
+    def __select_thread(self, thread_id: int) -> Optional[Tuple[Dict[int, Optional[Message]], int]]:
+        row = self.connection.execute(
+            "SELECT last_message_id FROM threads WHERE thread_id = ?", (thread_id,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        messages = {}
+        for message_id, role, name, content, image_url in self.connection.execute(
+                "SELECT message_id, role, name, content, image_url FROM messages WHERE thread_id = ?", (thread_id,)
+        ):
+            # Messages without content are stored without role to keep their ids
+            messages[message_id] = None if role is None else Message(
+                role=role, name=name, content=content, image_url=image_url
+            )
+        return messages, row[0]
+
+    def __insert_messages(self, thread_id: int, messages: List[Tuple[int, Optional[Message]]]):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO messages (thread_id, message_id, role, name, content, image_url) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (thread_id, message_id, *((m.role, m.name, m.content, m.image_url) if m else (None,) * 4))
+                    for message_id, m in messages
+                ]
+            )
+            self.connection.execute(
+                "INSERT INTO threads (thread_id, last_message_id) VALUES (?, ?) ON CONFLICT (thread_id) "
+                "DO UPDATE SET last_message_id = MAX(last_message_id, excluded.last_message_id)",
+                (thread_id, max(message_id for message_id, _ in messages))
+            )
+
+    def __update_message(self, thread_id: int, message_id: int, content: Optional[str]):
+        with self.connection:
+            if content:
+                self.connection.execute(
+                    "UPDATE messages SET content = ? WHERE thread_id = ? AND message_id = ? AND role IS NOT NULL",
+                    (content, thread_id, message_id)
+                )
+            else:
+                self.connection.execute(
+                    "UPDATE messages SET role = NULL, name = NULL, content = NULL, image_url = NULL "
+                    "WHERE thread_id = ? AND message_id = ?",
+                    (thread_id, message_id)
+                )
+
+    def __delete_messages(self, thread_id: int, message_ids: List[int]):
+        with self.connection:
+            self.connection.executemany(
+                "DELETE FROM messages WHERE thread_id = ? AND message_id = ?",
+                [(thread_id, message_id) for message_id in message_ids]
+            )
+
+    def __delete_thread(self, thread_id: int):
+        with self.connection:
+            self.connection.execute("DELETE FROM messages WHERE thread_id = ?", (thread_id,))
+            self.connection.execute("DELETE FROM threads WHERE thread_id = ?", (thread_id,))
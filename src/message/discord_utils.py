@@ -1,11 +1,13 @@
+import asyncio
 import logging
 from typing import Optional, List
 import discord
 
 from src.constant.discord import ACTIVATE_THREAD_PREFIX, MAX_THREAD_MESSAGES, INACTIVATE_THREAD_PREFIX, \
-    MAX_CHARS_PER_REPLY_MSG
+    MAX_CONCURRENT_ANNOUNCEMENTS
 from discord import Message as DiscordMessage
 
+from src.message.send_queue import SEND_QUEUE
 from src.model.message import Message
 from src.model.role import Role
 
@@ -19,10 +21,7 @@ def discord_message_to_message(message: DiscordMessage) -> Optional[Message]:
             and len(message.reference.resolved.embeds) > 0
             and len(message.reference.resolved.embeds[0].fields) > 0
     ):
-        # Thread starter message must be sent by user
-        field = message.reference.resolved.embeds[0].fields[0]
-        if field.value:
-            return Message(role=Role.USER.value, content=field.value)
+        return starter_embed_to_message(message.reference.resolved.embeds[0])
     else:
         if message.content:
             role = Role.ASSISTANT if message.author.bot else Role.USER
@@ -31,35 +30,27 @@ def discord_message_to_message(message: DiscordMessage) -> Optional[Message]:
     return None
 
 
-def split_into_shorter_messages(message: str) -> List[str]:
-    return [
-        message[i: i + MAX_CHARS_PER_REPLY_MSG]
-        for i in range(0, len(message), MAX_CHARS_PER_REPLY_MSG)
-    ]
+def starter_embed_to_message(embed: discord.Embed) -> Optional[Message]:
+    """Convert the embed of a /chat thread starter, whose first field holds the user message."""
+    # Thread starter message must be sent by user
+    field = embed.fields[0]
+    if field.value:
+        return Message(role=Role.USER.value, content=field.value)
 
-
-def is_last_message_stale(
-        interaction_message: DiscordMessage,
-        last_message: Optional[DiscordMessage],
-        bot_id: int
-) -> bool:
-    return (
-            last_message
-            and last_message.id != interaction_message.id
-            and last_message.author
-            and last_message.author.id != bot_id
-    )
+    return None
 
 
 async def close_thread(thread: discord.Thread):
-    await thread.edit(name=INACTIVATE_THREAD_PREFIX)
-    await thread.send(
+    await SEND_QUEUE.edit_channel(thread, name=INACTIVATE_THREAD_PREFIX)
+    await SEND_QUEUE.send(
+        thread,
         embed=discord.Embed(
             description="**Thread closed** - Context limit reached, closing...",
             color=discord.Color.blue(),
-        )
+        ),
+        mergeable=True
     )
-    await thread.edit(archived=True, locked=True)
+    await SEND_QUEUE.edit_channel(thread, archived=True, locked=True)
 
 
 def allow_command(interaction: discord.Interaction, allow_server_ids: List[int]) -> bool:
@@ -123,9 +114,20 @@ async def allow_message(client: discord.Client, message: DiscordMessage, allow_s
 async def send_message_to_system_channel(
         client: discord.Client,
         message: Optional[str],
-        embed: Optional[discord.Embed] = None
+        embed: Optional[discord.Embed] = None,
+        max_concurrency: int = MAX_CONCURRENT_ANNOUNCEMENTS
 ):
-    for guild in client.guilds:
-        channel = guild.system_channel
-        if channel and channel.permissions_for(guild.me).send_messages:
-            await channel.send(message, embed=embed)
+    """Send message to system channels of all guilds, a few at a time. A failed guild does not stop the others."""
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def send(channel: discord.TextChannel):
+        async with semaphore:
+            try:
+                await SEND_QUEUE.send(channel, message, embed=embed)
+            except discord.HTTPException as err:
+                logger.warning(f"Failed to send message to system channel of {channel.guild}: {err}")
+
+    await asyncio.gather(*[
+        send(guild.system_channel) for guild in client.guilds
+        if guild.system_channel and guild.system_channel.permissions_for(guild.me).send_messages
+    ])
@@ -1,52 +1,185 @@
+import io
+import logging
+from time import monotonic
+from typing import List, AsyncIterator, Optional
+
 import discord
+from discord import Message as DiscordMessage
 
-from src.message.discord_utils import split_into_shorter_messages, close_thread
+from src.constant.discord import SECONDS_BETWEEN_REPLY_EDITS, MAX_MESSAGE_LENGTH, MAX_REPLY_MESSAGES, \
+    REPLY_ATTACHMENT_NAME
+from src.message.discord_utils import close_thread
+from src.message.reply_packer import pack_reply, split_reply
+from src.message.send_queue import SEND_QUEUE
 from src.model.completion_data import CompletionData, CompletionResult
+from src.service.reply_stream import close_stream
+
+logger = logging.getLogger(__name__)
 
 
-async def process_response(thread: discord.Thread, response_data: CompletionData):
+async def process_response(thread: discord.Thread, response_data: CompletionData) -> List[DiscordMessage]:
+    """Send completion response to thread, return the messages sent."""
     status = response_data.status
     reply_text = response_data.reply_text
     status_text = response_data.status_text
+    sent_messages = []
 
     if status is CompletionResult.OK:
-        if not reply_text:
+        if response_data.reply_stream is not None:
+            # Send response while it is streaming
+            sent_messages = await send_reply_stream(thread, response_data.reply_stream)
+        elif reply_text:
+            # Send response
+            sent_messages = await send_reply(thread, reply_text)
+
+        if not sent_messages:
             # Send empty response message
-            await thread.send(
+            sent_messages.append(await SEND_QUEUE.send(
+                thread,
                 embed=discord.Embed(
                     description='**Invalid response** - empty response',
                     color=discord.Color.yellow(),
-                )
-            )
-        else:
-            # Send response
-            shorter_response = split_into_shorter_messages(reply_text)
-            for response in shorter_response:
-                await thread.send(response)
+                ),
+                mergeable=True
+            ))
     elif status is CompletionResult.TOO_LONG:
         # Close thread for too long response
         await close_thread(thread)
     elif status is CompletionResult.INVALID_REQUEST:
         # Send invalid request response
-        await thread.send(
+        sent_messages.append(await SEND_QUEUE.send(
+            thread,
             embed=discord.Embed(
                 description=f"**Invalid request** - {status_text}",
                 color=discord.Color.yellow(),
-            )
-        )
+            ),
+            mergeable=True
+        ))
     elif status is CompletionResult.BLOCKED:
         # Send blocked request response
-        await thread.send(
+        sent_messages.append(await SEND_QUEUE.send(
+            thread,
             embed=discord.Embed(
                 description=f"**Message blocked** - {status_text}",
                 color=discord.Color.pink(),
-            )
-        )
+            ),
+            mergeable=True
+        ))
     else:
         # Send unknown error response
-        await thread.send(
+        sent_messages.append(await SEND_QUEUE.send(
+            thread,
             embed=discord.Embed(
                 description=f"**Error** - {status_text}",
                 color=discord.Color.yellow(),
-            )
-        )
+            ),
+            mergeable=True
+        ))
+
+    return sent_messages
+
+
+async def send_reply(thread: discord.Thread, reply_text: str) -> List[DiscordMessage]:
+    """Send reply packed into messages. A reply needing too many messages is sent as a file after the first messages.
+    Return the messages sent."""
+    # Messages are not edited afterwards, so a short one may be merged with sends queued around it
+    messages = pack_reply(reply_text)
+    if len(messages) <= MAX_REPLY_MESSAGES:
+        return [await SEND_QUEUE.send(thread, message, mergeable=True) for message in messages]
+
+    sent_messages = [
+        await SEND_QUEUE.send(thread, message, mergeable=True) for message in messages[:MAX_REPLY_MESSAGES - 1]
+    ]
+    sent_messages.append(await send_reply_file(thread, reply_text))
+    return sent_messages
+
+
+async def send_reply_file(
+        thread: discord.Thread,
+        reply_text: str,
+        message: Optional[DiscordMessage] = None
+) -> DiscordMessage:
+    """Send the whole reply as a file, or replace message with it, e.g. the last message of a streamed reply."""
+    content = "Full reply is attached."
+    file = discord.File(io.BytesIO(reply_text.encode()), filename=REPLY_ATTACHMENT_NAME)
+    if message is not None:
+        return await SEND_QUEUE.edit_message(message, content, attachments=[file])
+    return await SEND_QUEUE.send(thread, content, file=file)
+
+
+async def send_reply_stream(thread: discord.Thread, reply_stream: AsyncIterator[str]) -> List[DiscordMessage]:
+    """Send reply as soon as the first chunk arrives, then keep editing it as more chunks arrive. Reply is rolled
+    over to a new message at a paragraph or line break when it exceeds the message length limit. A reply needing too
+    many messages has its last message replaced with the reply as a file once complete, as in send_reply. Return the
+    messages sent."""
+    sent_messages: List[DiscordMessage] = []
+    current_message: Optional[DiscordMessage] = None
+    shown_text = ''
+    last_update = 0.0
+
+    async def update_message(text: str):
+        nonlocal current_message, shown_text, last_update
+        if current_message is None:
+            current_message = await SEND_QUEUE.send(thread, text)
+            sent_messages.append(current_message)
+        elif text != shown_text:
+            current_message = await SEND_QUEUE.edit_message(current_message, text)
+            sent_messages[-1] = current_message
+
+        shown_text = text
+        last_update = monotonic()
+
+    # Whole reply, sent as a file on overflow
+    chunks: List[str] = []
+    overflow = False
+    text = ''
+    try:
+        async for chunk in reply_stream:
+            chunks.append(chunk)
+            if overflow:
+                continue
+
+            text += chunk
+            while len(text) > MAX_MESSAGE_LENGTH and (
+                    current_message is not None or len(sent_messages) < MAX_REPLY_MESSAGES
+            ):
+                # Complete current message, and continue with a new message
+                message, text = split_reply(text)
+                await update_message(message)
+                current_message, shown_text = None, ''
+
+            # Discord rejects blank messages
+            if not text.strip():
+                continue
+
+            if current_message is None and len(sent_messages) >= MAX_REPLY_MESSAGES:
+                # Reply needs one more message than allowed
+                overflow = True
+            elif current_message is None or monotonic() - last_update >= SECONDS_BETWEEN_REPLY_EDITS:
+                await update_message(text)
+
+        if overflow:
+            sent_messages[-1] = await send_reply_file(thread, "".join(chunks), message=sent_messages[-1])
+        elif text.strip():
+            await update_message(text)
+    except Exception as err:
+        logger.exception(err)
+
+        if overflow:
+            sent_messages[-1] = await send_reply_file(thread, "".join(chunks), message=sent_messages[-1])
+        elif text.strip():
+            await update_message(text)
+
+        sent_messages.append(await SEND_QUEUE.send(
+            thread,
+            embed=discord.Embed(
+                description=f"**Error** - {str(err)}",
+                color=discord.Color.yellow(),
+            ),
+            mergeable=True
+        ))
+    finally:
+        # Release the request behind the reply, also when sending is cancelled, e.g. by a newer message
+        await close_stream(reply_stream)
+
+    return sent_messages
@@ -0,0 +1,76 @@
+from typing import List, Optional, Tuple
+
+from src.constant.discord import MAX_MESSAGE_LENGTH
+
+FENCE = "```"
+# Info string of a reopened code block is cut, so that a reopened block always leaves room for content
+MAX_FENCE_LENGTH = 20
+
+
+def split_pieces(text: str, max_length: int) -> List[str]:
+    """Split text into lines, and lines longer than max_length at the last space within max_length."""
+    pieces = []
+    for line in text.splitlines(keepends=True):
+        while len(line) > max_length:
+            cut = line.rfind(" ", max_length // 2, max_length) + 1 or max_length
+            pieces.append(line[:cut])
+            line = line[cut:]
+        pieces.append(line)
+    return pieces
+
+
+def take_message(pieces: List[str], limit: int) -> Tuple[int, Optional[str]]:
+    """Return the number of pieces filling a message up to limit, and the code block left open after them. Messages
+    end at a paragraph break if possible, then at a line break, once they are at least half full."""
+    size = 0
+    fence: Optional[str] = None
+    paragraph_end: Optional[Tuple[int, Optional[str]]] = None
+    line_end: Optional[Tuple[int, Optional[str]]] = None
+
+    for end, piece in enumerate(pieces):
+        line_start = end == 0 or pieces[end - 1].endswith("\n")
+        next_fence = fence
+        if line_start and piece.lstrip().startswith(FENCE):
+            next_fence = None if fence else piece.strip()[:MAX_FENCE_LENGTH]
+
+        # An open code block is closed at the end of message
+        closing = len(FENCE) + 1 if next_fence else 0
+        if end > 0 and size + len(piece) + closing > limit:
+            return paragraph_end or line_end or (end, fence)
+
+        opens_fence = next_fence is not None and fence is None
+        size, fence = size + len(piece), next_fence
+        if piece.endswith("\n") and size >= limit // 2 and not opens_fence:
+            if not piece.strip() and fence is None:
+                paragraph_end = (end + 1, fence)
+            else:
+                line_end = (end + 1, fence)
+
+    return len(pieces), fence
+
+
+def split_reply(text: str, limit: int = MAX_MESSAGE_LENGTH) -> Tuple[str, str]:
+    """Split the first message off reply. Return the message, with an open code block closed, and the rest of reply,
+    with the code block reopened."""
+    if len(text) <= limit:
+        return text, ""
+
+    pieces = split_pieces(text, limit // 2)
+    end, fence = take_message(pieces, limit)
+    message, rest = "".join(pieces[:end]), "".join(pieces[end:])
+    if fence is not None:
+        message = message if message.endswith("\n") else message + "\n"
+        message, rest = message + FENCE, f"{fence}\n{rest}"
+    return message, rest
+
+
+def pack_reply(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """Split reply into as few messages as possible within limit, at paragraph and line breaks, keeping code blocks
+    intact across messages."""
+    messages = []
+    while text:
+        message, text = split_reply(text, limit)
+        # Discord rejects blank messages
+        if message.strip():
+            messages.append(message)
+    return messages
@@ -0,0 +1,240 @@
+import asyncio
+import logging
+from collections import deque
+from dataclasses import dataclass, field
+from enum import Enum
+from time import monotonic
+from typing import Optional, Deque, List, Any, Dict
+
+import discord
+from discord import Message as DiscordMessage
+
+from src.constant.discord import CHANNEL_SENDS_PER_WINDOW, CHANNEL_SEND_WINDOW_SECONDS, GLOBAL_REQUESTS_PER_SECOND, \
+    MAX_MESSAGE_LENGTH
+from src.metrics.registry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SEND_WAIT_SECONDS = REGISTRY.histogram(
+    "discord_send_wait_seconds",
+    "Seconds a send or edit waits in the outbound queue of its channel",
+    ("kind",)
+)
+SENDS_MERGED = REGISTRY.counter("discord_sends_merged_total", "Queued sends merged into the message before them")
+
+
+class TokenBucket:
+    """Allow capacity calls per period, in bursts of up to capacity. Calls over the rate are delayed in order."""
+
+    def __init__(self, capacity: int, period: float):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.tokens = float(capacity)
+        self.updated_at = monotonic()
+
+    def reserve(self) -> float:
+        """Take a token, return seconds to wait until it is available."""
+        now = monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def seconds_until_full(self) -> float:
+        return max(0.0, (self.capacity - self.tokens) / self.rate - (monotonic() - self.updated_at))
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class OutboundKind(Enum):
+    SEND = "send"
+    EDIT_MESSAGE = "edit_message"
+    EDIT_CHANNEL = "edit_channel"
+
+
+@dataclass
+class Outbound:
+    kind: OutboundKind
+    # Channel to send to or edit, or message to edit
+    target: Any
+    content: Optional[str] = None
+    kwargs: Dict[str, Any] = field(default_factory=dict)
+    # Sends not edited afterwards may be merged with the send before them
+    mergeable: bool = False
+    # Callers waiting for the result, several when edits are coalesced or sends are merged
+    futures: List[asyncio.Future] = field(default_factory=list)
+    enqueued_at: float = field(default_factory=monotonic)
+
+
+@dataclass
+class ChannelQueue:
+    bucket: TokenBucket
+    pending: Deque[Outbound] = field(default_factory=deque)
+    worker: Optional[asyncio.Task] = None
+
+
+@dataclass(frozen=True)
+class SendQueueStats:
+    queued: int
+    backlogged_channels: int
+    # Seconds the oldest queued request has waited
+    oldest_wait_seconds: float
+
+
+class SendQueue:
+    """Send messages and edits of each channel one at a time in order, paced by per-channel and global rate limits of
+    Discord, so that rate limits delay only the channel over its limit. Queued edits of a message are coalesced, and
+    small queued sends are merged. The queue of a channel is kept until it is idle and its rate limit has recovered,
+    so that a channel never has two workers."""
+
+    def __init__(
+            self,
+            global_requests_per_second: int = GLOBAL_REQUESTS_PER_SECOND,
+            channel_sends_per_window: int = CHANNEL_SENDS_PER_WINDOW,
+            channel_send_window_seconds: float = CHANNEL_SEND_WINDOW_SECONDS
+    ):
+        self.channels: Dict[int, ChannelQueue] = {}
+        self.global_bucket = TokenBucket(global_requests_per_second, 1.0)
+        self.channel_sends_per_window = channel_sends_per_window
+        self.channel_send_window_seconds = channel_send_window_seconds
+
+    async def send(
+            self,
+            channel: discord.abc.Messageable,
+            content: Optional[str] = None,
+            mergeable: bool = False,
+            **kwargs: Any
+    ) -> DiscordMessage:
+        """Send a message to channel, e.g. with embed or file in kwargs. A mergeable send of content or an embed may
+        share its message with the send queued before it, so it must not be edited afterwards."""
+        return await self.__enqueue(channel.id, Outbound(
+            kind=OutboundKind.SEND,
+            target=channel,
+            content=content,
+            kwargs=kwargs,
+            mergeable=mergeable and set(kwargs) <= {"embed"}
+        ))
+
+    async def edit_message(self, message: DiscordMessage, content: str, **kwargs: Any) -> DiscordMessage:
+        """Replace content of message, e.g. with attachments in kwargs. A queued content only edit of the same message
+        is replaced instead."""
+        queue = self.__get_channel_queue(message.channel.id)
+        for outbound in reversed(queue.pending):
+            if outbound.kind is OutboundKind.EDIT_MESSAGE and outbound.target.id == message.id:
+                if kwargs or outbound.kwargs:
+                    break
+                outbound.content = content
+                future = asyncio.get_running_loop().create_future()
+                outbound.futures.append(future)
+                return await future
+
+        return await self.__enqueue(message.channel.id, Outbound(
+            kind=OutboundKind.EDIT_MESSAGE,
+            target=message,
+            content=content,
+            kwargs=kwargs
+        ))
+
+    async def edit_channel(self, channel: discord.Thread, **kwargs: Any):
+        """Edit channel, e.g. rename or archive a thread, in order with its messages."""
+        return await self.__enqueue(channel.id, Outbound(kind=OutboundKind.EDIT_CHANNEL, target=channel, kwargs=kwargs))
+
+    def stats(self) -> SendQueueStats:
+        now = monotonic()
+        queues = [queue for queue in list(self.channels.values()) if queue.pending]
+        return SendQueueStats(
+            queued=sum(len(queue.pending) for queue in queues),
+            backlogged_channels=len(queues),
+            oldest_wait_seconds=max((now - queue.pending[0].enqueued_at for queue in queues), default=0.0)
+        )
+
+    def __get_channel_queue(self, channel_id: int) -> ChannelQueue:
+        queue = self.channels.get(channel_id)
+        if queue is None:
+            queue = ChannelQueue(bucket=TokenBucket(self.channel_sends_per_window, self.channel_send_window_seconds))
+            self.channels[channel_id] = queue
+        return queue
+
+    async def __enqueue(self, channel_id: int, outbound: Outbound):
+        queue = self.__get_channel_queue(channel_id)
+        future = asyncio.get_running_loop().create_future()
+        outbound.futures.append(future)
+        queue.pending.append(outbound)
+
+        if queue.worker is None or queue.worker.done():
+            queue.worker = asyncio.create_task(self.__run(channel_id, queue))
+        return await future
+
+    async def __run(self, channel_id: int, queue: ChannelQueue):
+        try:
+            await self.__send_pending(queue)
+        finally:
+            # Drop the idle queue once its bucket is full again, a new queue would not know about recent sends
+            asyncio.get_running_loop().call_later(
+                queue.bucket.seconds_until_full(), self.__drop_if_idle, channel_id, queue
+            )
+
+    async def __send_pending(self, queue: ChannelQueue):
+        while queue.pending:
+            outbound = queue.pending.popleft()
+            if all(future.done() for future in outbound.futures):
+                # Callers are cancelled, e.g. a superseded reply
+                continue
+
+            await queue.bucket.acquire()
+            await self.global_bucket.acquire()
+            # Sends queued while waiting for the rate limit may join this one
+            self.__merge_sends(queue, outbound)
+            SEND_WAIT_SECONDS.observe(monotonic() - outbound.enqueued_at, kind=outbound.kind.value)
+
+            try:
+                result = await self.__execute(outbound)
+                for future in outbound.futures:
+                    if not future.done():
+                        future.set_result(result)
+            except Exception as err:
+                for future in outbound.futures:
+                    if not future.done():
+                        future.set_exception(err)
+
+    @staticmethod
+    def __merge_sends(queue: ChannelQueue, outbound: Outbound):
+        if not outbound.mergeable:
+            return
+
+        # Embed of a message is shown below its content, so no send can follow an embed
+        while queue.pending and queue.pending[0].mergeable and "embed" not in outbound.kwargs:
+            following = queue.pending[0]
+            if all(future.done() for future in following.futures):
+                queue.pending.popleft()
+                continue
+
+            content = "\n".join(text for text in (outbound.content, following.content) if text) or None
+            if content is not None and len(content) > MAX_MESSAGE_LENGTH:
+                break
+
+            queue.pending.popleft()
+            outbound.content = content
+            outbound.kwargs.update(following.kwargs)
+            outbound.futures.extend(following.futures)
+            SENDS_MERGED.inc()
+
+    def __drop_if_idle(self, channel_id: int, queue: ChannelQueue):
+        # New sends may have arrived, or a new worker may be running
+        if self.channels.get(channel_id) is queue and not queue.pending and queue.worker.done():
+            del self.channels[channel_id]
+
+    @staticmethod
+    async def __execute(outbound: Outbound):
+        if outbound.kind is OutboundKind.SEND:
+            return await outbound.target.send(outbound.content, **outbound.kwargs)
+        if outbound.kind is OutboundKind.EDIT_MESSAGE:
+            return await outbound.target.edit(content=outbound.content, **outbound.kwargs)
+        return await outbound.target.edit(**outbound.kwargs)
+
+
+# Outbound queue of the bot, all sends and edits of thread messages go through it
+SEND_QUEUE = SendQueue()
@@ -0,0 +1,110 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Callable, Awaitable, Optional, TypeVar, Dict
+
+from src.constant.discord import MIN_SECONDS_DELAY_RECEIVING_MSG, MAX_SECONDS_DELAY_RECEIVING_MSG
+from src.metrics.instrumentation import record_stage, Stage
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+@dataclass
+class ThreadSchedule:
+    # Task of the latest message which has not started delivering its reply
+    pending: Optional[asyncio.Task] = None
+    # Replies of a thread are delivered one at a time
+    delivery_lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    last_arrival: Optional[float] = None
+    # Moving average of pauses between messages of a burst
+    burst_gap: Optional[float] = None
+
+
+class ThreadScheduler:
+    """Debounce messages of each thread, so that only one completion is requested per burst of messages. A new message
+    resets the debounce timer, and cancels the completion in flight if its reply is not delivered yet."""
+
+    def __init__(
+            self,
+            min_delay: float = MIN_SECONDS_DELAY_RECEIVING_MSG,
+            max_delay: float = MAX_SECONDS_DELAY_RECEIVING_MSG
+    ):
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        # Schedules hold the request in flight and the delivery lock, so they are kept until idle rather than evicted
+        self.schedules: Dict[int, ThreadSchedule] = {}
+
+    def schedule(
+            self,
+            thread_id: int,
+            request: Callable[[], Awaitable[T]],
+            deliver: Callable[[T], Awaitable[None]]
+    ) -> asyncio.Task:
+        """Run request after the debounce delay, then deliver its result. Any pending request of the thread is
+        cancelled."""
+        schedule = self.schedules.get(thread_id)
+        if schedule is None:
+            schedule = ThreadSchedule()
+            self.schedules[thread_id] = schedule
+
+        delay = self.__next_delay(schedule)
+
+        if schedule.pending is not None and not schedule.pending.done():
+            logger.debug(f"Cancel superseded request of thread {thread_id}")
+            schedule.pending.cancel()
+
+        schedule.pending = asyncio.create_task(self.__run(thread_id, schedule, delay, request, deliver))
+        return schedule.pending
+
+    def __next_delay(self, schedule: ThreadSchedule) -> float:
+        now = monotonic()
+        if schedule.last_arrival is not None:
+            gap = now - schedule.last_arrival
+            if gap <= self.max_delay:
+                schedule.burst_gap = gap if schedule.burst_gap is None else (schedule.burst_gap + gap) / 2
+        schedule.last_arrival = now
+
+        if schedule.burst_gap is None:
+            return self.min_delay
+
+        # Wait a bit longer than the user usually pauses within a burst
+        return min(self.max_delay, max(self.min_delay, schedule.burst_gap * 1.5))
+
+    async def __run(
+            self,
+            thread_id: int,
+            schedule: ThreadSchedule,
+            delay: float,
+            request: Callable[[], Awaitable[T]],
+            deliver: Callable[[T], Awaitable[None]]
+    ):
+        try:
+            await asyncio.sleep(delay)
+            record_stage(Stage.DEBOUNCE, delay)
+
+            # Wait for the previous reply, so the request includes it in history
+            async with schedule.delivery_lock:
+                result = await request()
+
+                # Reply is being delivered, new messages no longer cancel it
+                if schedule.pending is asyncio.current_task():
+                    schedule.pending = None
+
+                await deliver(result)
+        except Exception as err:
+            logger.exception(err)
+        finally:
+            # Keep the schedule while a burst may go on, so that its pauses are still averaged
+            asyncio.get_running_loop().call_later(self.max_delay, self.__drop_if_idle, thread_id, schedule)
+
+    def __drop_if_idle(self, thread_id: int, schedule: ThreadSchedule):
+        # New messages may have arrived, or a reply may be delivering
+        if (
+                self.schedules.get(thread_id) is schedule
+                and (schedule.pending is None or schedule.pending.done())
+                and not schedule.delivery_lock.locked()
+        ):
+            del self.schedules[thread_id]
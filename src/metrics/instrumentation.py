@@ -0,0 +1,47 @@
+from contextlib import contextmanager
+from enum import Enum
+from time import perf_counter, time
+from typing import Dict, Iterator, Optional
+
+from src.metrics.registry import REGISTRY
+from src.metrics.tracing import TRACER
+
+
+class Stage(Enum):
+    DEBOUNCE = "debounce"
+    HISTORY_FETCH = "history_fetch"
+    PROMPT_BUILD = "prompt_build"
+    TOKEN_COUNT = "token_count"
+    QUEUE_WAIT = "queue_wait"
+    FIRST_TOKEN = "first_token"
+    COMPLETION = "completion"
+    # Includes streaming of the reply, which is sent as it is generated
+    DISCORD_SEND = "discord_send"
+
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "chat_stage_seconds",
+    "Seconds spent in each stage of replying to a message",
+    ("stage", "provider", "model", "status")
+)
+
+
+def record_stage(stage: Stage, duration: float, start: Optional[float] = None, export_span: bool = True, **labels: str):
+    """Record duration of a stage, and export it as a span of the current trace."""
+    STAGE_SECONDS.observe(duration, stage=stage.value, **labels)
+    if export_span:
+        TRACER.export(name=stage.value, start=start or time() - duration, duration=duration, attributes=labels)
+
+
+@contextmanager
+def track_stage(stage: Stage, **labels: str) -> Iterator[Dict[str, str]]:
+    """Time the block as a stage. Labels known only at the end, e.g. status, can be set on the yielded labels."""
+    start = time()
+    counter_start = perf_counter()
+    try:
+        yield labels
+    except BaseException as err:
+        labels.setdefault("status", err.__class__.__name__)
+        raise
+    finally:
+        record_stage(stage, perf_counter() - counter_start, start=start, **labels)
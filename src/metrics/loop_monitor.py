@@ -0,0 +1,111 @@
+import asyncio
+import logging
+import math
+from time import perf_counter
+from typing import Callable, Optional
+
+from src.constant.metrics import LOOP_LAG_INTERVAL_SECONDS, SLOW_CALLBACK_SECONDS, HEARTBEAT_WARNING_SECONDS
+from src.metrics.registry import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+LOOP_LAG_SECONDS = REGISTRY.histogram("event_loop_lag_seconds", "Delay of event loop in running a scheduled wake up")
+SLOW_CALLBACKS = REGISTRY.counter(
+    "event_loop_slow_callbacks_total",
+    "Callbacks blocking event loop for longer than the threshold",
+    ("callback",)
+)
+SLOW_CALLBACK_SECONDS_TOTAL = REGISTRY.counter(
+    "event_loop_slow_callback_seconds_total",
+    "Seconds event loop was blocked by slow callbacks",
+    ("callback",)
+)
+
+
+def describe_callback(handle: asyncio.Handle) -> str:
+    """Return name of the code run by a handle, the coroutine of a task step or the function called back."""
+    callback = handle._callback
+    task = getattr(callback, "__self__", None)
+    if isinstance(task, asyncio.Task):
+        coro = task.get_coro()
+        return getattr(coro, "__qualname__", repr(coro))
+    return getattr(callback, "__qualname__", repr(callback))
+
+
+class LoopMonitor:
+    """Sample event loop lag, report callbacks blocking the loop, and warn when Discord heartbeat latency is high.
+    Blocking work stalls gateway heartbeats, and Discord drops the connection after missed heartbeats."""
+
+    def __init__(
+            self,
+            get_heartbeat_latency: Optional[Callable[[], float]] = None,
+            interval: float = LOOP_LAG_INTERVAL_SECONDS,
+            slow_callback_seconds: float = SLOW_CALLBACK_SECONDS,
+            heartbeat_warning_seconds: float = HEARTBEAT_WARNING_SECONDS
+    ):
+        self.get_heartbeat_latency = get_heartbeat_latency
+        self.interval = interval
+        self.slow_callback_seconds = slow_callback_seconds
+        self.heartbeat_warning_seconds = heartbeat_warning_seconds
+        self.heartbeat_slow = False
+        self.task: Optional[asyncio.Task] = None
+        self.original_run: Optional[Callable[[asyncio.Handle], None]] = None
+
+        if get_heartbeat_latency is not None:
+            REGISTRY.gauge("discord_heartbeat_latency_seconds", "Latency of the latest gateway heartbeat", lambda: [
+                ({}, latency) for latency in [get_heartbeat_latency()] if math.isfinite(latency)
+            ])
+
+    def start(self):
+        self.__install_callback_timer()
+        self.task = asyncio.create_task(self.__sample())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        if self.original_run is not None:
+            asyncio.Handle._run = self.original_run
+            self.original_run = None
+
+    def report_slow_callback(self, handle: asyncio.Handle, duration: float):
+        callback = describe_callback(handle)
+        SLOW_CALLBACKS.inc(callback=callback)
+        SLOW_CALLBACK_SECONDS_TOTAL.inc(duration, callback=callback)
+        logger.warning(f"Event loop blocked for {duration:.3f}s by {callback} ({handle})")
+
+    def check_heartbeat(self):
+        latency = self.get_heartbeat_latency()
+        if not math.isfinite(latency):
+            return
+
+        if latency > self.heartbeat_warning_seconds and not self.heartbeat_slow:
+            logger.warning(f"Discord heartbeat latency is {latency:.3f}s, over {self.heartbeat_warning_seconds}s")
+        elif latency <= self.heartbeat_warning_seconds and self.heartbeat_slow:
+            logger.info(f"Discord heartbeat latency is back to {latency:.3f}s")
+        self.heartbeat_slow = latency > self.heartbeat_warning_seconds
+
+    def __install_callback_timer(self):
+        # Every callback, task step and timer of the event loop runs through Handle._run
+        original_run = asyncio.Handle._run
+        monitor = self
+
+        def run(handle: asyncio.Handle):
+            start = perf_counter()
+            original_run(handle)
+            duration = perf_counter() - start
+            if duration >= monitor.slow_callback_seconds:
+                monitor.report_slow_callback(handle, duration)
+
+        self.original_run = original_run
+        asyncio.Handle._run = run
+
+    async def __sample(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - expected))
+
+            if self.get_heartbeat_latency is not None:
+                self.check_heartbeat()
@@ -0,0 +1,143 @@
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from threading import Lock
+from typing import Dict, List, Tuple, Callable, Iterable
+
+# Upper bounds of histogram buckets in seconds, from cache hits to slow completions
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+Labels = Tuple[str, ...]
+Sample = Tuple[Dict[str, str], float]
+
+
+class Metric(ABC):
+    def __init__(self, name: str, description: str, label_names: Iterable[str] = ()):
+        self.name = name
+        self.description = description
+        self.label_names = tuple(label_names)
+        self.lock = Lock()
+
+    def label_values(self, labels: Dict[str, str]) -> Labels:
+        return tuple(str(labels.get(name, "")) for name in self.label_names)
+
+    @abstractmethod
+    def render(self) -> List[str]:
+        """Return lines of metric in Prometheus text exposition format."""
+
+    def header(self, metric_type: str) -> List[str]:
+        return [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} {metric_type}"]
+
+    def format_labels(self, values: Labels, extra: str = "") -> str:
+        pairs = [f'{name}="{escape(value)}"' for name, value in zip(self.label_names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(Metric):
+    def __init__(self, name: str, description: str, label_names: Iterable[str] = ()):
+        super().__init__(name, description, label_names)
+        self.values: Dict[Labels, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = self.label_values(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = list(self.values.items())
+        return self.header("counter") + [f"{self.name}{self.format_labels(key)} {value}" for key, value in values]
+
+
+class Histogram(Metric):
+    def __init__(
+            self,
+            name: str,
+            description: str,
+            label_names: Iterable[str] = (),
+            buckets: Tuple[float, ...] = DEFAULT_BUCKETS
+    ):
+        super().__init__(name, description, label_names)
+        self.buckets = buckets
+        # Counts of each bucket, not cumulative, then sum and count
+        self.values: Dict[Labels, Tuple[List[int], List[float]]] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self.label_values(labels)
+        with self.lock:
+            counts, total = self.values.setdefault(key, ([0] * (len(self.buckets) + 1), [0.0, 0]))
+            counts[bisect_left(self.buckets, value)] += 1
+            total[0] += value
+            total[1] += 1
+
+    def render(self) -> List[str]:
+        lines = self.header("histogram")
+        with self.lock:
+            values = [(key, list(counts), list(total)) for key, (counts, total) in self.values.items()]
+
+        for key, counts, (total_sum, total_count) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound}"
+                labels = self.format_labels(key, 'le="' + le + '"')
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{self.format_labels(key)} {total_sum}")
+            lines.append(f"{self.name}_count{self.format_labels(key)} {total_count}")
+        return lines
+
+
+class Gauge(Metric):
+    """Gauge read from a callback at collection time, e.g. the queue length of a limiter."""
+
+    def __init__(self, name: str, description: str, collect: Callable[[], Iterable[Sample]]):
+        super().__init__(name, description)
+        self.collect = collect
+
+    def render(self) -> List[str]:
+        lines = self.header("gauge")
+        for labels, value in self.collect():
+            pairs = ",".join(f'{name}="{escape(str(label))}"' for name, label in labels.items())
+            lines.append(f"{self.name}{{{pairs}}} {value}" if pairs else f"{self.name} {value}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics of the process, rendered in Prometheus text exposition format."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def counter(self, name: str, description: str, label_names: Iterable[str] = ()) -> Counter:
+        return self.__register(Counter(name, description, label_names))
+
+    def histogram(self, name: str, description: str, label_names: Iterable[str] = ()) -> Histogram:
+        return self.__register(Histogram(name, description, label_names))
+
+    def gauge(self, name: str, description: str, collect: Callable[[], Iterable[Sample]]) -> Gauge:
+        """Register a gauge, replacing any gauge of the same name, e.g. when its source is replaced."""
+        gauge = Gauge(name, description, collect)
+        self.metrics[name] = gauge
+        return gauge
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def __register(self, metric: Metric) -> Metric:
+        existing = self.metrics.get(metric.name)
+        if existing is not None:
+            return existing
+        self.metrics[metric.name] = metric
+        return metric
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+# Registry of the bot, exported by the metrics server
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,27 @@
+import logging
+
+from aiohttp import web
+
+from src.metrics.registry import MetricsRegistry, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+async def start_metrics_server(
+        port: int,
+        host: str = "127.0.0.1",
+        registry: MetricsRegistry = REGISTRY
+) -> web.AppRunner:
+    """Serve metrics in Prometheus text format at /metrics, return the runner to stop the server."""
+
+    async def metrics(_: web.Request) -> web.Response:
+        return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"Serving metrics at http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,52 @@
+import json
+import logging
+import os
+from contextvars import ContextVar
+from threading import Lock
+from time import time
+from typing import Optional, Dict, Any, TextIO
+
+logger = logging.getLogger(__name__)
+
+# Trace of the request being handled, inherited by tasks created while handling it
+current_trace_id: ContextVar[Optional[str]] = ContextVar("current_trace_id", default=None)
+
+
+def start_trace(**attributes: Any) -> str:
+    """Start a trace for a request in the current context, e.g. a thread message, and return its id."""
+    trace_id = os.urandom(8).hex()
+    current_trace_id.set(trace_id)
+    TRACER.export(name="request", start=time(), duration=0.0, attributes=attributes)
+    return trace_id
+
+
+class SpanExporter:
+    """Write finished spans as JSON lines, one span per line, if a path is given."""
+
+    def __init__(self):
+        self.file: Optional[TextIO] = None
+        self.lock = Lock()
+
+    def open(self, path: str):
+        self.file = open(path, "a", buffering=1)
+
+    def export(self, name: str, start: float, duration: float, attributes: Dict[str, Any]):
+        if self.file is None:
+            return
+
+        span = {
+            "trace_id": current_trace_id.get(),
+            "name": name,
+            "start": round(start, 6),
+            "duration": round(duration, 6),
+            "attributes": attributes,
+        }
+        try:
+            with self.lock:
+                self.file.write(json.dumps(span, default=str) + "\n")
+        except OSError as err:
+            logger.warning(f"Failed to export span {name}: {err}")
+
+
+# Span exporter of the bot, enabled by TRACE_PATH
+TRACER = SpanExporter()
@@ -1,6 +1,6 @@
 from dataclasses import dataclass
 from enum import Enum
-from typing import Optional
+from typing import Optional, AsyncIterator
 
 
 class CompletionResult(Enum):
@@ -16,3 +16,5 @@ class CompletionData:
     status: CompletionResult
     reply_text: Optional[str]
     status_text: Optional[str]
+    # Reply chunks of a streaming completion, replaces reply_text
+    reply_stream: Optional[AsyncIterator[str]] = None
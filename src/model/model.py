@@ -6,3 +6,9 @@ class Model:
     name: str
     is_default: bool = False
     upload_image: bool = False
+    # Total tokens of prompt and completion
+    context_window: int = 4096
+    # Tokens requested at most for completion, reserved when fitting conversation history into context window
+    max_output_tokens: int = 1024
+    # USD per 1K prompt tokens, requests in auto mode are routed to the cheapest model fitting the prompt
+    cost: float = 0.0
@@ -2,9 +2,12 @@ from dataclasses import dataclass
 from typing import List, Optional
 
 from src.model.message import Message
+from src.model.model import Model
 
 
 @dataclass(frozen=True)
 class Prompt:
     conversation: List[Message]
     header: Optional[Message] = None
+    # Model to use instead of current model of chat service, e.g. a cheaper model for summaries
+    model: Optional[Model] = None
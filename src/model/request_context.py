@@ -0,0 +1,18 @@
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional
+
+
+class RequestPriority(Enum):
+    NEW_THREAD = 0
+    FOLLOW_UP = 1
+    # Work not awaited by users, e.g. summarizing conversations
+    BACKGROUND = 2
+
+
+@dataclass(frozen=True)
+class RequestContext:
+    guild_id: Optional[int] = None
+    user_id: Optional[int] = None
+    thread_id: Optional[int] = None
+    priority: RequestPriority = RequestPriority.FOLLOW_UP
@@ -1,10 +1,12 @@
 from typing import List
 
+from openai import Timeout
 from openai.lib.azure import AsyncAzureOpenAI
 
 from src.constant.env import AzureOpenAIEnv
 from src.constant.model import AZURE_MODELS
-from src.service.openai_service import OpenAIService
+from src.constant.service import REQUEST_TIMEOUT_SECONDS, CONNECT_TIMEOUT_SECONDS
+from src.service.openai_service import OpenAIService, create_http_client
 from src.model.model import Model
 
 
@@ -12,11 +14,14 @@ class AzureOpenAIService(OpenAIService):
     client: AsyncAzureOpenAI
 
     def init_env(self):
-        env = AzureOpenAIEnv.load()
+        env = AzureOpenAIEnv.load(self.label)
         self.client = AsyncAzureOpenAI(
             api_key=env.openai_api_key,
             api_version=env.openai_api_version,
-            azure_endpoint=env.openai_api_base
+            azure_endpoint=env.openai_api_base,
+            timeout=Timeout(REQUEST_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+            max_retries=0,  # retried by self.resilience
+            http_client=create_http_client()
         )
 
     def get_supported_models(self) -> List[Model]:
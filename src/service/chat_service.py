@@ -1,22 +1,57 @@
+import logging
 from abc import ABC, abstractmethod
+from dataclasses import replace
 from enum import Enum
-from typing import List, Optional
+from hashlib import blake2b, sha256
+from json import dumps
+from time import perf_counter
+from typing import List, Optional, AsyncIterator, Callable, Tuple
 
-from src.model.completion_data import CompletionData
+from cachetools import LRUCache
+
+from src.constant.discord import MAX_CACHED_THREADS
+from src.constant.model import MESSAGE_TOKEN_CACHE_SIZE, IMAGE_TOKENS, MESSAGE_OVERHEAD_TOKENS, RECENT_TAIL_SHARE
+from src.metrics.instrumentation import track_stage, record_stage, Stage
+from src.model.completion_data import CompletionData, CompletionResult
 from src.model.message import Message
 from src.model.model import Model
 from src.model.prompt import Prompt
+from src.model.request_context import RequestContext
+from src.model.role import Role
+from src.service.completion_cache import CompletionCache
+from src.service.conversation_summarizer import ConversationSummarizer
+from src.service.request_limiter import RequestLimiter
+from src.service.reply_stream import ReplyStream
+from src.service.resilience import Resilience
+from src.service.retrieval import RetrievalIndex
+from src.service.single_flight import SingleFlight, SharedStream
+
+logger = logging.getLogger(__name__)
 
 
 class ChatServiceType(Enum):
     OPENAI = 'openai'
     AZURE = 'azure'
     PALM = 'palm'
+    ROUTER = 'router'
 
 
 class ChatService(ABC):
-    def __init__(self):
+    def __init__(self, label: Optional[str] = None):
+        # Label tells apart services of the same type, e.g. Azure deployments in different regions
+        self.label = label
+        self.name = f"{self.__class__.__name__}:{label}" if label else self.__class__.__name__
         self.init_env()
+        self.message_token_cache = LRUCache(maxsize=MESSAGE_TOKEN_CACHE_SIZE)
+        self.request_limiter: Optional[RequestLimiter] = None
+        self.completion_cache: Optional[CompletionCache] = None
+        self.summarizer: Optional[ConversationSummarizer] = None
+        self.retrieval_index: Optional[RetrievalIndex] = None
+        self.auto_model = False
+        # Models pinned to threads by thread id, used in place of routed or current model
+        self.pinned_models: LRUCache = LRUCache(maxsize=MAX_CACHED_THREADS)
+        self.single_flight = SingleFlight()
+        self.resilience = Resilience(name=self.name, get_retry_after=self.get_retry_after)
 
         # Set default model
         model_list = self.get_supported_models()
@@ -25,15 +60,331 @@ class ChatService(ABC):
     def init_env(self):
         """Initialize environment variables required for chat service."""
 
-    async def chat(self, history: List[Optional[Message]]) -> CompletionData:
-        """Send conversation history to chat service and return response. Messages are in chronological order."""
-        prompt = self.build_prompt(history)
-        return await self.send_prompt(prompt)
+    async def chat(
+            self,
+            history: List[Optional[Message]],
+            stream: bool = False,
+            context: Optional[RequestContext] = None
+    ) -> CompletionData:
+        """Send conversation history to chat service and return response. Messages are in chronological order.
+        If stream is True, the reply is returned as chunks in reply_stream as soon as the first chunk arrives."""
+        with track_stage(Stage.PROMPT_BUILD, provider=self.name) as labels:
+            history, summary = self.compact_history(history, context)
+            prompt = self.build_prompt(history, self.select_model(history, context), context)
+            if summary is not None:
+                prompt = self.add_summary(prompt, summary)
+            key = self.get_prompt_key(prompt)
+            labels["model"] = self.get_prompt_model(prompt).name
+
+        # Identical concurrent requests share one request to chat service
+        response_data = await self.single_flight.do(
+            (key, stream),
+            lambda: self.__send_prompt_shared(key, prompt, stream, context),
+            discard=self.__discard_shared
+        )
+        if response_data.reply_stream is None:
+            return response_data
+
+        # Every caller reads the shared reply stream from the beginning
+        return replace(response_data, reply_stream=response_data.reply_stream.subscribe())
+
+    async def __send_prompt_shared(
+            self,
+            key: str,
+            prompt: Prompt,
+            stream: bool,
+            context: Optional[RequestContext]
+    ) -> CompletionData:
+        response_data = await self.__send_prompt_cached(key, prompt, stream, context)
+        if response_data.reply_stream is None:
+            return response_data
+        return replace(response_data, reply_stream=SharedStream(response_data.reply_stream))
+
+    @staticmethod
+    async def __discard_shared(response_data: CompletionData):
+        # Nobody subscribes to the reply, closing a subscription stops the request behind it
+        if response_data.reply_stream is not None:
+            await response_data.reply_stream.subscribe().aclose()
+
+    async def __send_prompt_cached(
+            self,
+            key: str,
+            prompt: Prompt,
+            stream: bool,
+            context: Optional[RequestContext]
+    ) -> CompletionData:
+        if self.completion_cache is None:
+            return await self.__send_prompt_limited(prompt, stream, context)
+
+        reply_text = await self.completion_cache.get(key)
+        if reply_text is not None:
+            return CompletionData(
+                status=CompletionResult.OK,
+                reply_text=None if stream else reply_text,
+                status_text=None,
+                reply_stream=stream_chunks(reply_text) if stream else None
+            )
+
+        response_data = await self.__send_prompt_limited(prompt, stream, context)
+        return await self.completion_cache.put_response(key, response_data)
+
+    async def __send_prompt_limited(
+            self,
+            prompt: Prompt,
+            stream: bool,
+            context: Optional[RequestContext]
+    ) -> CompletionData:
+        if self.request_limiter is None:
+            return await self.__send_prompt(prompt, stream)
+
+        with track_stage(Stage.QUEUE_WAIT, provider=self.name, model=self.get_prompt_model(prompt).name):
+            await self.request_limiter.acquire(context)
+        try:
+            response_data = await self.__send_prompt(prompt, stream)
+        except BaseException:
+            self.request_limiter.release()
+            raise
+
+        if response_data.reply_stream is None:
+            self.request_limiter.release()
+            return response_data
+
+        # Hold the request slot until the reply finishes streaming
+        return replace(
+            response_data,
+            reply_stream=call_after_stream(response_data.reply_stream, self.request_limiter.release)
+        )
+
+    async def __send_prompt(self, prompt: Prompt, stream: bool) -> CompletionData:
+        labels = {"provider": self.name, "model": self.get_prompt_model(prompt).name}
+        with track_stage(Stage.FIRST_TOKEN if stream else Stage.COMPLETION, **labels) as stage_labels:
+            start = perf_counter()
+            response_data = await (self.send_prompt_stream(prompt) if stream else self.send_prompt(prompt))
+            stage_labels["status"] = response_data.status.name
+
+        if response_data.reply_stream is None:
+            return response_data
+
+        # Completion of a streaming reply ends with its last chunk
+        return replace(response_data, reply_stream=call_after_stream(
+            response_data.reply_stream,
+            lambda: record_stage(Stage.COMPLETION, perf_counter() - start, status=response_data.status.name, **labels)
+        ))
 
     def set_current_model(self, model: Optional[Model]):
         """Set current active model."""
         self.model = model
 
+    def set_auto_model(self, auto_model: bool):
+        """Route each request to the cheapest model fitting its prompt, instead of current model."""
+        self.auto_model = auto_model
+
+    def pin_model(self, thread_id: int, model: Optional[Model]):
+        """Pin a model to a thread, or unpin it if model is None."""
+        if model is None:
+            self.pinned_models.pop(thread_id, None)
+        else:
+            self.pinned_models[thread_id] = model
+
+    def can_upload_image(self) -> bool:
+        """Return whether a request with an image can be served."""
+        if self.auto_model:
+            return any(model.upload_image for model in self.get_supported_models())
+        return self.model is not None and self.model.upload_image
+
+    def select_model(
+            self,
+            history: List[Optional[Message]],
+            context: Optional[RequestContext] = None
+    ) -> Optional[Model]:
+        """Return model for a request: model pinned to the thread, the cheapest model whose context fits the prompt
+        in auto mode, or current model."""
+        if context is not None and context.thread_id is not None and context.thread_id in self.pinned_models:
+            return self.pinned_models[context.thread_id]
+
+        if not self.auto_model or self.model is None:
+            return self.model
+
+        messages = [self.build_system_message()] + [message for message in history if message is not None]
+        candidates = sorted(self.get_supported_models(), key=lambda model: model.cost)
+        # Image models are only used for images, e.g. their default completion limit is short
+        has_image = any(message.image_url is not None for message in messages)
+        candidates = [model for model in candidates if model.upload_image == has_image] or candidates
+
+        # Try the cheapest model first
+        for model in candidates:
+            if self.fits(messages, model.context_window - model.max_output_tokens - self.get_prompt_overhead_tokens()):
+                return model
+
+        # No model fits the whole prompt, history is trimmed to the largest context
+        return max(candidates, key=lambda model: model.context_window)
+
+    def set_request_limiter(self, request_limiter: Optional[RequestLimiter]):
+        """Set limiter of concurrent chat requests."""
+        self.request_limiter = request_limiter
+
+    def set_completion_cache(self, completion_cache: Optional[CompletionCache]):
+        """Set cache of completion replies."""
+        self.completion_cache = completion_cache
+
+    def set_summarizer(self, summarizer: Optional[ConversationSummarizer]):
+        """Set summarizer compacting long conversations."""
+        self.summarizer = summarizer
+
+    def set_retrieval_index(self, retrieval_index: Optional[RetrievalIndex]):
+        """Set index of thread messages, selecting older messages by relevance instead of recency when trimming."""
+        self.retrieval_index = retrieval_index
+
+    def compact_history(
+            self,
+            history: List[Optional[Message]],
+            context: Optional[RequestContext]
+    ) -> Tuple[List[Optional[Message]], Optional[str]]:
+        """Return history with older messages replaced by a summary of them if the conversation is long, and the
+        summary."""
+        if self.summarizer is None or context is None or context.thread_id is None:
+            return history, None
+        return self.summarizer.compact(self, history, context)
+
+    @staticmethod
+    def add_summary(prompt: Prompt, summary: str) -> Prompt:
+        """Return prompt with summary of earlier conversation appended to its header."""
+        summary_text = f"Summary of the earlier conversation:\n{summary}"
+        if prompt.header is None:
+            return replace(prompt, header=Message(role=Role.SYSTEM.value, content=summary_text))
+        return replace(prompt, header=replace(prompt.header, content=f"{prompt.header.content}\n\n{summary_text}"))
+
+    def get_prompt_model(self, prompt: Prompt) -> Model:
+        """Return model to send prompt to."""
+        return prompt.model or self.model
+
+    def get_prompt_key(self, prompt: Prompt) -> str:
+        """Return a digest of current model and rendered prompt, identifying requests with the same reply."""
+        rendered_prompt = dumps(self.render_prompt(prompt), sort_keys=True, separators=(",", ":"), default=str)
+        return sha256(f"{self.get_prompt_model(prompt).name}\0{rendered_prompt}".encode()).hexdigest()
+
+    async def count_tokens(self, messages: List[Message]) -> int:
+        """Return the number of tokens used by the messages, identical concurrent calls share one count."""
+        digest = sha256(self.model.name.encode())
+        for message in messages:
+            digest.update(hash_message(message))
+        key = ("count_tokens", digest.hexdigest())
+        with track_stage(Stage.TOKEN_COUNT, provider=self.name, model=self.model.name):
+            return await self.single_flight.do(key, lambda: self.count_token_usage(messages))
+
+    def get_message_tokens(self, message: Message) -> int:
+        """Return the number of tokens of a single message for current model, cached by hash of message content."""
+        key = (self.model.name, hash_message(message))
+        tokens = self.message_token_cache.get(key)
+        if tokens is None:
+            start = perf_counter()
+            tokens = self.count_message_tokens(message)
+            self.message_token_cache[key] = tokens
+            # Counted for every message, too fine grained for spans
+            record_stage(
+                Stage.TOKEN_COUNT, perf_counter() - start, export_span=False, provider=self.name, model=self.model.name
+            )
+        return tokens
+
+    def trim_history(
+            self,
+            messages: List[Message],
+            header: Optional[Message] = None,
+            model: Optional[Model] = None,
+            context: Optional[RequestContext] = None
+    ) -> List[Message]:
+        """Drop the oldest messages until the prompt fits into the context window of model, current model by default,
+        leaving room for the completion. The thread starter message and the latest message are always kept. With a
+        retrieval index and the thread in context, older messages relevant to the latest message are kept along with
+        the latest messages."""
+        model = model or self.model
+        if model is None or len(messages) <= 1:
+            return messages
+
+        budget = model.context_window - model.max_output_tokens - self.get_prompt_overhead_tokens()
+
+        if self.fits(messages if header is None else [header] + messages, budget):
+            return messages
+
+        if header is not None:
+            budget -= self.get_message_tokens(header)
+        budget -= self.get_message_tokens(messages[0])
+
+        if self.retrieval_index is not None and context is not None and context.thread_id is not None:
+            return self.__select_relevant(messages, budget, context.thread_id)
+
+        kept = 0
+        for message in reversed(messages[1:]):
+            budget -= self.get_message_tokens(message)
+            if budget < 0:
+                break
+            kept += 1
+
+        if kept == len(messages) - 1:
+            return messages
+
+        kept = max(kept, 1)
+        logger.info(f"Trim {len(messages) - 1 - kept} of {len(messages)} messages to fit {model.name} context")
+        return [messages[0]] + messages[-kept:]
+
+    def __select_relevant(self, messages: List[Message], budget: int, thread_id: int) -> List[Message]:
+        # Keep the latest messages within a share of budget
+        tail_budget = int(budget * RECENT_TAIL_SHARE)
+        tail = 0
+        for message in reversed(messages[1:]):
+            tokens = self.get_message_tokens(message)
+            if tail > 0 and tokens > tail_budget:
+                break
+            tail_budget -= tokens
+            budget -= tokens
+            tail += 1
+
+        # Fill the rest of budget with older messages by relevance to the latest message
+        keys = [hash_message(message) for message in messages]
+        index = self.retrieval_index.get_thread_index(thread_id)
+        index.sync((key, message.content or '') for key, message in zip(keys[1:], messages[1:]))
+        scores = index.score(messages[-1].content or '')
+
+        older = range(1, len(messages) - tail)
+        selected = []
+        for position in sorted(older, key=lambda i: scores.get(keys[i], 0.0), reverse=True):
+            if scores.get(keys[position], 0.0) <= 0:
+                break
+            tokens = self.get_message_tokens(messages[position])
+            if tokens <= budget:
+                budget -= tokens
+                selected.append(position)
+
+        logger.info(f"Keep {tail} latest and {len(selected)} relevant of {len(messages)} messages in prompt")
+        return [messages[0]] + [messages[i] for i in sorted(selected)] + messages[len(messages) - tail:]
+
+    def fits(self, messages: List[Message], budget: int) -> bool:
+        """Return whether messages take up at most budget tokens. Tokens are counted only if the upper bound of the
+        messages is over budget."""
+        if sum(self.get_message_tokens_upper_bound(message) for message in messages) <= budget:
+            return True
+        return sum(self.get_message_tokens(message) for message in messages) <= budget
+
+    @staticmethod
+    def get_message_tokens_upper_bound(message: Message) -> int:
+        """Return an upper bound of the tokens of a single message without tokenizing it. Every token covers at least
+        one byte of text."""
+        text = f"{message.role}{message.name or ''}{message.content or ''}"
+        return len(text.encode()) + MESSAGE_OVERHEAD_TOKENS + (IMAGE_TOKENS if message.image_url else 0)
+
+    def get_prompt_overhead_tokens(self) -> int:
+        """Return the number of tokens added to a prompt apart from its messages."""
+        return 0
+
+    async def warm_up(self):
+        """Load tokenizers and open connections ahead of the first request. Failures are logged, and left to requests
+        to report."""
+
+    def get_retry_after(self, err: Exception) -> Optional[float]:
+        """Return seconds to wait before retrying a transient error, 0 if the service gives no hint, or None if the
+        error is not transient."""
+        return None
+
     @abstractmethod
     def get_supported_models(self) -> List[Model]:
         """Return a list of supported models."""
@@ -43,8 +394,14 @@ class ChatService(ABC):
         """Return a system message to be sent to the chat service."""
 
     @abstractmethod
-    def build_prompt(self, history: List[Optional[Message]]) -> Prompt:
-        """Convert conversation history to prompt."""
+    def build_prompt(
+            self,
+            history: List[Optional[Message]],
+            model: Optional[Model] = None,
+            context: Optional[RequestContext] = None
+    ) -> Prompt:
+        """Convert conversation history to prompt for model, current model by default. Context identifies the thread
+        of history, if any."""
 
     @abstractmethod
     def render_prompt(self, prompt: Prompt) -> List[dict[str, str]]:
@@ -54,10 +411,48 @@ class ChatService(ABC):
     def render_message(self, message: Message) -> dict[str, str]:
         """Convert message to json structure."""
 
+    @abstractmethod
+    def count_message_tokens(self, message: Message) -> int:
+        """Return the number of tokens of a single message for current model."""
+
     @abstractmethod
     async def send_prompt(self, prompt: Prompt) -> CompletionData:
         """Send prompt to chat service and return response."""
 
+    async def send_prompt_stream(self, prompt: Prompt) -> CompletionData:
+        """Send prompt to chat service and return response with reply streamed in chunks. Services without
+        streaming support return the whole reply as a single chunk."""
+        response_data = await self.send_prompt(prompt)
+        if response_data.status is not CompletionResult.OK or not response_data.reply_text:
+            return response_data
+
+        return CompletionData(
+            status=CompletionResult.OK,
+            reply_text=None,
+            status_text=None,
+            reply_stream=stream_chunks(response_data.reply_text)
+        )
+
     @abstractmethod
     async def count_token_usage(self, messages: List[Message]) -> int:
         """Return the number of tokens used by the messages."""
+
+
+async def stream_chunks(*chunks: str) -> AsyncIterator[str]:
+    """Return an async iterator over the given reply chunks."""
+    for chunk in chunks:
+        yield chunk
+
+
+def call_after_stream(reply_stream: AsyncIterator[str], callback: Callable[[], None]) -> ReplyStream:
+    """Return reply_stream which calls callback once it is exhausted, fails or is closed, also when it is closed before
+    the first chunk is pulled."""
+    return ReplyStream(reply_stream, on_close=callback)
+
+
+def hash_message(message: Message) -> bytes:
+    """Return a digest of message content, used as cache key without holding the content."""
+    digest = blake2b(digest_size=16)
+    for value in (message.role, message.name, message.content, message.image_url):
+        digest.update(b'\0' if value is None else f"\1{value}\0".encode())
+    return digest.digest()
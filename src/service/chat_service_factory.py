@@ -1,19 +1,57 @@
-from src.service.azure_openai_service import AzureOpenAIService
+import logging
+from importlib import import_module
+from typing import Optional, Dict, Type, Union
+
+from src.constant.env import RouterEnv
 from src.service.chat_service import ChatServiceType, ChatService
-from src.service.openai_service import OpenAIService
-from src.service.palm_service import PalmService
+from src.service.hedge_policy import HedgePolicy
+from src.service.router_chat_service import RouterChatService
 
+logger = logging.getLogger(__name__)
 
-class ChatServiceFactory:
-    @staticmethod
-    def get_service_cls(service_type: ChatServiceType) -> ChatService:
-        if service_type == ChatServiceType.OPENAI:
-            return OpenAIService()
+# Chat services by type as module:class, imported when the type is selected so that only the SDK in use is loaded
+CHAT_SERVICES: Dict[str, str] = {
+    ChatServiceType.OPENAI.value: "src.service.openai_service:OpenAIService",
+    ChatServiceType.AZURE.value: "src.service.azure_openai_service:AzureOpenAIService",
+    ChatServiceType.PALM.value: "src.service.palm_service:PalmService",
+}
 
-        if service_type == ChatServiceType.AZURE:
-            return AzureOpenAIService()
 
-        if service_type == ChatServiceType.PALM:
-            return PalmService()
+def register_chat_service(service_type: str, path: str):
+    """Register a chat service class given as module:class, e.g. a provider outside this package."""
+    module_name, _, class_name = path.partition(":")
+    if not module_name or not class_name:
+        raise ValueError(f"Chat service {service_type} must be given as module:class, got {path}")
+    CHAT_SERVICES[service_type] = path
 
+
+def load_chat_service_cls(service_type: str) -> Type[ChatService]:
+    path = CHAT_SERVICES.get(service_type)
+    if path is None:
         raise ValueError(f'Unknown chat service type: {service_type}')
+
+    module_name, _, class_name = path.partition(":")
+    service_cls = getattr(import_module(module_name), class_name)
+    if not issubclass(service_cls, ChatService):
+        raise TypeError(f"{path} is not a ChatService")
+    return service_cls
+
+
+class ChatServiceFactory:
+    @staticmethod
+    def get_service_cls(service_type: Union[ChatServiceType, str], label: Optional[str] = None) -> ChatService:
+        service_type = service_type.value if isinstance(service_type, ChatServiceType) else service_type
+
+        if service_type == ChatServiceType.ROUTER.value:
+            env = RouterEnv.load()
+            return RouterChatService(
+                backends=[
+                    ChatServiceFactory.get_service_cls(backend_type, label or None)
+                    for backend_type, _, label in (service.partition(":") for service in env.services)
+                ],
+                hedge_policy=HedgePolicy() if env.hedge else None
+            )
+
+        service_cls = load_chat_service_cls(service_type)
+        logger.info(f"Loaded chat service {service_type} from {CHAT_SERVICES[service_type]}")
+        return service_cls(label)
@@ -0,0 +1,118 @@
+import logging
+import sqlite3
+from asyncio import to_thread
+from dataclasses import dataclass, replace
+from threading import Lock
+from time import time
+from typing import Optional, AsyncIterator
+
+from cachetools import TTLCache
+
+from src.metrics.registry import REGISTRY
+from src.model.completion_data import CompletionData, CompletionResult
+from src.service.reply_stream import ReplyStream, close_stream
+
+logger = logging.getLogger(__name__)
+
+CACHE_REQUESTS = REGISTRY.counter("completion_cache_requests_total", "Lookups of completion cache", ("result",))
+
+
+@dataclass(frozen=True)
+class CompletionCacheStats:
+    hits: int
+    misses: int
+    size: int
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class CompletionCache:
+    """Cache of successful completion replies keyed by prompt, in memory with least recently used eviction and a time
+    to live. Entries are also written to a SQLite file if path is given, so they survive restarts."""
+
+    def __init__(self, max_size: int, ttl_seconds: float, path: Optional[str] = None):
+        self.ttl_seconds = ttl_seconds
+        self.entries: TTLCache = TTLCache(maxsize=max_size, ttl=ttl_seconds)
+        self.hits = 0
+        self.misses = 0
+
+        self.connection: Optional[sqlite3.Connection] = None
+        self.connection_lock = Lock()
+        if path is not None:
+            self.connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS completions (key TEXT PRIMARY KEY, reply_text TEXT, created_at REAL)"
+            )
+            self.connection.execute("DELETE FROM completions WHERE created_at < ?", (time() - ttl_seconds,))
+
+    async def get(self, key: str) -> Optional[str]:
+        """Return cached reply of prompt key, or None."""
+        reply_text = self.entries.get(key)
+        if reply_text is None and self.connection is not None:
+            reply_text = await to_thread(self.__select, key)
+            if reply_text is not None:
+                self.entries[key] = reply_text
+
+        if reply_text is None:
+            self.misses += 1
+            CACHE_REQUESTS.inc(result="miss")
+        else:
+            self.hits += 1
+            CACHE_REQUESTS.inc(result="hit")
+            logger.debug(f"Completion cache hit, hit rate {self.stats().hit_rate:.2%}")
+
+        return reply_text
+
+    async def put(self, key: str, reply_text: str):
+        self.entries[key] = reply_text
+        if self.connection is not None:
+            await to_thread(self.__insert, key, reply_text)
+
+    async def put_response(self, key: str, response_data: CompletionData) -> CompletionData:
+        """Cache reply of a successful response, return the response to be used in place of the given one. A streaming
+        reply is cached once it is fully received."""
+        if response_data.status is not CompletionResult.OK:
+            return response_data
+
+        if response_data.reply_stream is not None:
+            reply_stream = response_data.reply_stream
+            return replace(response_data, reply_stream=ReplyStream(
+                self.__put_after_stream(key, reply_stream),
+                # Close the request stream even if the reply is closed before its first chunk
+                on_close=lambda: close_stream(reply_stream)
+            ))
+
+        if response_data.reply_text:
+            await self.put(key, response_data.reply_text)
+        return response_data
+
+    def stats(self) -> CompletionCacheStats:
+        return CompletionCacheStats(hits=self.hits, misses=self.misses, size=len(self.entries))
+
+    async def __put_after_stream(self, key: str, reply_stream: AsyncIterator[str]) -> AsyncIterator[str]:
+        chunks = []
+        async for chunk in reply_stream:
+            chunks.append(chunk)
+            yield chunk
+
+        if chunks:
+            await self.put(key, "".join(chunks))
+
+    def __select(self, key: str) -> Optional[str]:
+        with self.connection_lock:
+            row = self.connection.execute(
+                "SELECT reply_text FROM completions WHERE key = ? AND created_at >= ?",
+                (key, time() - self.ttl_seconds)
+            ).fetchone()
+        return row[0] if row else None
+
+    def __insert(self, key: str, reply_text: str):
+        with self.connection_lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO completions (key, reply_text, created_at) VALUES (?, ?, ?)",
+                (key, reply_text, time())
+            )
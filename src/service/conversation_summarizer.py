@@ -0,0 +1,176 @@
+import asyncio
+import logging
+from dataclasses import dataclass, field, replace
+from typing import List, Optional, Tuple, TYPE_CHECKING
+
+from cachetools import LRUCache
+
+from src.constant.discord import MAX_CACHED_THREADS
+from src.constant.model import SUMMARY_MAX_WORDS
+from src.model.completion_data import CompletionResult
+from src.model.message import Message
+from src.model.model import Model
+from src.model.prompt import Prompt
+from src.model.request_context import RequestContext, RequestPriority
+from src.model.role import Role
+
+if TYPE_CHECKING:
+    from src.service.chat_service import ChatService
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ThreadSummary:
+    text: Optional[str] = None
+    # Messages after the thread starter covered by summary, to tell whether history has changed since
+    covered_messages: List[Optional[Message]] = field(default_factory=list)
+    task: Optional[asyncio.Task] = None
+
+    @property
+    def covered(self) -> int:
+        return len(self.covered_messages)
+
+
+class ConversationSummarizer:
+    """Replace older messages of long threads with a rolling summary, so that prompt size stays roughly constant.
+    Summaries are generated in the background with a cheaper model and extended with new messages incrementally,
+    prompts use the latest summary available."""
+
+    def __init__(
+            self,
+            trigger_tokens: int,
+            model_name: Optional[str] = None,
+            max_threads: int = MAX_CACHED_THREADS
+    ):
+        self.trigger_tokens = trigger_tokens
+        # Messages not covered by summary are kept up to half of the trigger, leaving room for new messages
+        self.keep_tokens = trigger_tokens // 2
+        self.model_name = model_name
+        self.summaries: LRUCache = LRUCache(maxsize=max_threads)
+
+    def compact(
+            self,
+            service: "ChatService",
+            history: List[Optional[Message]],
+            context: RequestContext
+    ) -> Tuple[List[Optional[Message]], Optional[str]]:
+        """Return history with messages covered by summary removed, and the summary. The thread starter message is
+        always kept."""
+        if len(history) <= 2 or not self.__is_over(service, history, self.trigger_tokens):
+            return history, None
+
+        summary = self.__get_summary(context.thread_id, history)
+
+        # Summarize older messages in background, keeping the latest messages
+        covering = self.__get_covering(service, history)
+        if covering > summary.covered and summary.task is None:
+            summary.task = asyncio.create_task(self.__summarize(service, summary, history[:covering + 1], context))
+
+        if summary.text is None:
+            return history, None
+
+        return [history[0]] + history[summary.covered + 1:], summary.text
+
+    def __get_summary(self, thread_id: int, history: List[Optional[Message]]) -> ThreadSummary:
+        summary: Optional[ThreadSummary] = self.summaries.get(thread_id)
+
+        # Start over if covered messages have been edited or deleted, a running update writes to the old summary
+        if summary is None or history[1:summary.covered + 1] != summary.covered_messages:
+            summary = ThreadSummary()
+            self.summaries[thread_id] = summary
+
+        return summary
+
+    def __get_covering(self, service: "ChatService", history: List[Optional[Message]]) -> int:
+        """Return number of messages after the thread starter to be covered by summary."""
+        budget = self.keep_tokens
+        kept = 0
+        for message in reversed(history[2:]):
+            budget -= self.__get_tokens(service, message)
+            if budget < 0:
+                break
+            kept += 1
+        return len(history) - 1 - max(kept, 1)
+
+    @staticmethod
+    def __is_over(service: "ChatService", history: List[Optional[Message]], tokens: int) -> bool:
+        return not service.fits([message for message in history if message is not None], tokens)
+
+    @staticmethod
+    def __get_tokens(service: "ChatService", message: Optional[Message]) -> int:
+        return 0 if message is None else service.get_message_tokens(message)
+
+    async def __summarize(
+            self,
+            service: "ChatService",
+            summary: ThreadSummary,
+            covered_history: List[Optional[Message]],
+            context: RequestContext
+    ):
+        model = self.__get_model(service)
+        # Summarize as many new messages as fit into context of summary model, the rest are left for next update
+        budget = model.context_window - model.max_output_tokens - SUMMARY_MAX_WORDS * 2
+        covered = summary.covered
+        new_messages = []
+        for message in covered_history[summary.covered + 1:]:
+            budget -= self.__get_tokens(service, message)
+            if budget < 0 and new_messages:
+                break
+            covered += 1
+            if message is not None:
+                new_messages.append(message)
+
+        try:
+            text = await self.__request_summary(service, model, summary.text, new_messages, context)
+            if text:
+                summary.text = text
+                summary.covered_messages = covered_history[1:covered + 1]
+                logger.info(f"Summarized {summary.covered} messages of thread {context.thread_id}")
+        except Exception as err:
+            logger.exception(err)
+        finally:
+            summary.task = None
+
+    async def __request_summary(
+            self,
+            service: "ChatService",
+            model: Model,
+            previous_text: Optional[str],
+            new_messages: List[Message],
+            context: RequestContext
+    ) -> Optional[str]:
+        transcript = "\n\n".join(f"{message.role}: {message.content}" for message in new_messages)
+        content = f"Summary so far:\n{previous_text}\n\nNew messages:\n{transcript}" if previous_text else transcript
+        prompt = Prompt(
+            header=Message(
+                role=Role.SYSTEM.value,
+                content="Summarize the conversation between user and assistant for the assistant to continue it. "
+                        "Keep facts, names, code identifiers, decisions and open questions. "
+                        f"Use at most {SUMMARY_MAX_WORDS} words."
+            ),
+            conversation=[Message(role=Role.USER.value, content=content)],
+            model=model
+        )
+
+        limiter = service.request_limiter
+        if limiter is not None:
+            await limiter.acquire(replace(context, priority=RequestPriority.BACKGROUND))
+        try:
+            response_data = await service.send_prompt(prompt)
+        finally:
+            if limiter is not None:
+                limiter.release()
+
+        if response_data.status is not CompletionResult.OK:
+            logger.warning(f"Failed to summarize thread {context.thread_id}: {response_data.status_text}")
+            return None
+        return response_data.reply_text
+
+    def __get_model(self, service: "ChatService") -> Model:
+        models = service.get_supported_models()
+        # The cheapest model summarizes unless configured otherwise
+        return next(
+            (model for model in models if model.name == self.model_name),
+            min(models, key=lambda model: model.cost)
+        )
@@ -0,0 +1,48 @@
+from collections import deque
+from typing import Dict, Deque, Optional
+
+from src.constant.service import HEDGE_PERCENTILE, HEDGE_BUDGET, HEDGE_MIN_SAMPLES
+from src.service.request_limiter import percentile
+
+LATENCY_SAMPLES = 500
+BUDGET_WINDOW = 1000
+
+
+class HedgePolicy:
+    """Decide when a duplicate request is sent to another backend. A request is hedged when it has no response, or no
+    first chunk when streaming, after a percentile of recent latencies of its model. Hedged requests are capped to a
+    fraction of recent requests."""
+
+    def __init__(
+            self,
+            latency_percentile: float = HEDGE_PERCENTILE,
+            budget: float = HEDGE_BUDGET,
+            min_samples: int = HEDGE_MIN_SAMPLES
+    ):
+        self.latency_percentile = latency_percentile
+        self.budget = budget
+        self.min_samples = min_samples
+        self.latencies: Dict[str, Deque[float]] = {}
+        # Whether each recent request was hedged
+        self.recent_requests: Deque[bool] = deque(maxlen=BUDGET_WINDOW)
+        self.recent_hedged = 0
+
+    def record_latency(self, model_name: str, latency: float):
+        """Record seconds until response of a request to model, or until a cancelled request was given up on."""
+        self.latencies.setdefault(model_name, deque(maxlen=LATENCY_SAMPLES)).append(latency)
+
+    def get_delay(self, model_name: str) -> Optional[float]:
+        """Return seconds to wait before hedging a request, None if there are not enough samples yet."""
+        latencies = self.latencies.get(model_name)
+        if latencies is None or len(latencies) < self.min_samples:
+            return None
+        return percentile(sorted(latencies), self.latency_percentile)
+
+    def record_request(self, hedged: bool):
+        if len(self.recent_requests) == self.recent_requests.maxlen:
+            self.recent_hedged -= self.recent_requests[0]
+        self.recent_requests.append(hedged)
+        self.recent_hedged += hedged
+
+    def can_hedge(self) -> bool:
+        return self.recent_hedged + 1 <= self.budget * (len(self.recent_requests) + 1)
@@ -1,20 +1,29 @@
+import asyncio
 import logging
+from functools import lru_cache
 from json import dumps
-from typing import List, Any, Optional
+from time import perf_counter
+from typing import List, Any, Optional, AsyncIterator
 
+import httpx
 import openai
-from openai import AsyncOpenAI
-from openai.types.chat import ChatCompletion
-from tiktoken import encoding_for_model, get_encoding
+from openai import AsyncOpenAI, AsyncStream
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
+from tiktoken import encoding_for_model, get_encoding, Encoding
 
 from src.constant.env import OpenAIEnv
-from src.constant.model import OPENAI_MODELS
+from src.constant.model import OPENAI_MODELS, IMAGE_TOKENS
+from src.constant.service import REQUEST_TIMEOUT_SECONDS, CONNECT_TIMEOUT_SECONDS, KEEPALIVE_SECONDS, \
+    MAX_CONNECTIONS, MAX_KEEPALIVE_CONNECTIONS, WARM_UP_CONNECTIONS
 from src.model.completion_data import CompletionData, CompletionResult
 from src.model.message import Message
 from src.model.model import Model
 from src.model.prompt import Prompt
+from src.model.request_context import RequestContext
 from src.model.role import Role
 from src.service.chat_service import ChatService
+from src.service.reply_stream import ReplyStream
+from src.service.resilience import parse_retry_after
 
 logger = logging.getLogger(__name__)
 
@@ -23,8 +32,13 @@ class OpenAIService(ChatService):
     client: AsyncOpenAI
 
     def init_env(self):
-        env = OpenAIEnv.load()
-        self.client = AsyncOpenAI(api_key=env.openai_api_key)
+        env = OpenAIEnv.load(self.label)
+        self.client = AsyncOpenAI(
+            api_key=env.openai_api_key,
+            timeout=openai.Timeout(REQUEST_TIMEOUT_SECONDS, connect=CONNECT_TIMEOUT_SECONDS),
+            max_retries=0,  # retried by self.resilience
+            http_client=create_http_client()
+        )
 
     def get_supported_models(self) -> List[Model]:
         return OPENAI_MODELS
@@ -36,10 +50,17 @@ class OpenAIService(ChatService):
                     "accurately and provide detailed example."
         )
 
-    def build_prompt(self, history: List[Optional[Message]]) -> Prompt:
+    def build_prompt(
+            self,
+            history: List[Optional[Message]],
+            model: Optional[Model] = None,
+            context: Optional[RequestContext] = None
+    ) -> Prompt:
         sys_message = self.build_system_message()
-        all_messages = [x for x in history if x is not None]
-        return Prompt(conversation=all_messages, header=sys_message)
+        all_messages = self.trim_history(
+            [x for x in history if x is not None], header=sys_message, model=model, context=context
+        )
+        return Prompt(conversation=all_messages, header=sys_message, model=model)
 
     def render_prompt(self, prompt: Prompt) -> List[dict[str, str]]:
         messages = []
@@ -77,13 +98,31 @@ class OpenAIService(ChatService):
 
         return {k: v for k, v in rendered.items() if v is not None}
 
-    async def _create_chat_completion(self, rendered: List[dict[str, str]]) -> ChatCompletion:
-        chat_completion = await self.client.chat.completions.create(
-            model=self.model.name,
-            messages=rendered
+    async def _create_chat_completion(self, model: Model, rendered: List[dict[str, str]]) -> ChatCompletion:
+        chat_completion = await self.resilience.call(
+            lambda: self.client.chat.completions.create(
+                model=model.name,
+                messages=rendered,
+                max_tokens=model.max_output_tokens
+            )
         )
         return chat_completion
 
+    async def _create_chat_completion_stream(
+            self,
+            model: Model,
+            rendered: List[dict[str, str]]
+    ) -> AsyncStream[ChatCompletionChunk]:
+        stream = await self.resilience.call(
+            lambda: self.client.chat.completions.create(
+                model=model.name,
+                messages=rendered,
+                max_tokens=model.max_output_tokens,
+                stream=True
+            )
+        )
+        return stream
+
     async def send_prompt(self, prompt: Prompt) -> CompletionData:
         rendered_prompt = self.render_prompt(prompt)
         logger.debug(dumps(rendered_prompt, indent=2, default=str))
@@ -108,7 +147,7 @@ class OpenAIService(ChatService):
         #     }
         # }
         try:
-            response = await self._create_chat_completion(rendered_prompt)
+            response = await self._create_chat_completion(self.get_prompt_model(prompt), rendered_prompt)
             content = response.choices[0].message.content
 
             # CompletionResult.OK
@@ -117,9 +156,66 @@ class OpenAIService(ChatService):
                 reply_text=content,
                 status_text=None
             )
-        except openai.BadRequestError as err:
+        except Exception as err:
+            logger.exception(err)
+            return self.__error_to_completion_data(err)
+
+    async def send_prompt_stream(self, prompt: Prompt) -> CompletionData:
+        rendered_prompt = self.render_prompt(prompt)
+        logger.debug(dumps(rendered_prompt, indent=2, default=str))
+
+        # Chat completion chunk:
+        # {
+        #     "id": "chatcmpl-123",
+        #     "object": "chat.completion.chunk",
+        #     "created": 1694268190,
+        #     "choices": [{
+        #         "index": 0,
+        #         "delta": {"content": "Hello"},
+        #         "finish_reason": null
+        #     }]
+        # }
+        try:
+            stream = await self._create_chat_completion_stream(self.get_prompt_model(prompt), rendered_prompt)
+            chunks = self.__iterate_chunks(stream)
+
+            # Wait for the first chunk, so errors before the reply starts are reported in completion status
+            first_chunk = await anext(chunks, None)
+
+            # CompletionResult.OK
+            return CompletionData(
+                status=CompletionResult.OK,
+                reply_text=None,
+                status_text=None,
+                # Closing the reply closes the response, also before the first chunk is pulled
+                reply_stream=ReplyStream(self.__prepend_chunk(first_chunk, chunks), on_close=chunks.aclose)
+            )
+        except Exception as err:
             logger.exception(err)
+            return self.__error_to_completion_data(err)
+
+    @staticmethod
+    async def __iterate_chunks(stream: AsyncStream[ChatCompletionChunk]) -> AsyncIterator[str]:
+        try:
+            async for chunk in stream:
+                # Azure sends prompt filter results in a chunk without choices
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+        finally:
+            await stream.response.aclose()
+
+    @staticmethod
+    async def __prepend_chunk(first_chunk: Optional[str], chunks: AsyncIterator[str]) -> AsyncIterator[str]:
+        if first_chunk is None:
+            return
+
+        yield first_chunk
+        async for chunk in chunks:
+            yield chunk
 
+    @staticmethod
+    def __error_to_completion_data(err: Exception) -> CompletionData:
+        if isinstance(err, openai.BadRequestError):
             # CompletionResult.TOO_LONG
             if "This model's maximum context length" in err.message:
                 return CompletionData(
@@ -142,28 +238,26 @@ class OpenAIService(ChatService):
                 reply_text=None,
                 status_text=str(err),
             )
-        except Exception as err:
-            logger.exception(err)
 
-            # CompletionResult.OTHER_ERROR
-            return CompletionData(
-                status=CompletionResult.OTHER_ERROR,
-                reply_text=None,
-                status_text=str(err)
-            )
+        # CompletionResult.OTHER_ERROR
+        return CompletionData(
+            status=CompletionResult.OTHER_ERROR,
+            reply_text=None,
+            status_text=str(err)
+        )
 
     async def count_token_usage(self, messages: List[Message]) -> int:
         """Returns the number of tokens used by a list of messages."""
         if self.model is None:
             raise ValueError("Model is not set.")
 
-        model_name = ''
-        try:
-            model_name = self.__convert_model_name()
-            encoding = encoding_for_model(model_name)
-        except KeyError:
-            print("Warning: model not found. Using cl100k_base encoding.")
-            encoding = get_encoding("cl100k_base")
+        num_tokens = sum(self.get_message_tokens(message) for message in messages)
+        num_tokens += self.get_prompt_overhead_tokens()
+        return num_tokens
+
+    def count_message_tokens(self, message: Message) -> int:
+        model_name = self.__convert_model_name()
+        encoding = get_model_encoding(model_name)
 
         if model_name.startswith('gpt-3.5-turbo'):
             tokens_per_message = 4  # every message follows <|start|>{role/name}\n{content}<|end|>\n
@@ -177,19 +271,90 @@ class OpenAIService(ChatService):
                 /openai/openai -python/blob/main/chatml.md for information on how messages are converted to tokens."""
             )
 
-        num_tokens = 0
-        for message in messages:
-            num_tokens += tokens_per_message
-            for key, value in self.render_message(message).items():
-                num_tokens += len(encoding.encode(value))
-                if key == "name":
-                    num_tokens += tokens_per_name
+        num_tokens = tokens_per_message + count_label_tokens(model_name, message.role)
+        if message.name is not None:
+            num_tokens += count_label_tokens(model_name, message.name) + tokens_per_name
+        if message.content is not None:
+            num_tokens += len(encoding.encode(message.content))
+        if message.image_url is not None:
+            num_tokens += IMAGE_TOKENS
 
-        num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
         return num_tokens
 
+    def get_prompt_overhead_tokens(self) -> int:
+        return 3  # every reply is primed with <|start|>assistant<|message|>
+
+    async def warm_up(self):
+        await asyncio.gather(self.__load_encodings(), self.__open_connections())
+
+    async def __load_encodings(self):
+        start = perf_counter()
+        model_names = {to_openai_model_name(model.name) for model in self.get_supported_models()}
+        try:
+            # Parsing BPE ranks blocks for a while, the first load also downloads them
+            await asyncio.to_thread(lambda: [get_model_encoding(model_name) for model_name in model_names])
+            logger.info(f"{self.name} loaded encodings of {len(model_names)} models in {perf_counter() - start:.2f}s")
+        except Exception as err:
+            logger.warning(f"{self.name} failed to load encodings: {err!r}")
+
+    async def __open_connections(self):
+        start = perf_counter()
+        # Concurrent requests open separate connections, kept in the pool of client
+        results = await asyncio.gather(
+            *[self.client.models.list() for _ in range(WARM_UP_CONNECTIONS)], return_exceptions=True
+        )
+        errors = [result for result in results if isinstance(result, Exception)]
+        if errors:
+            logger.warning(f"{self.name} failed to open {len(errors)} connections: {errors[0]!r}")
+        logger.info(
+            f"{self.name} opened {len(results) - len(errors)} connections in {perf_counter() - start:.2f}s"
+        )
+
+    def get_retry_after(self, err: Exception) -> Optional[float]:
+        # Connection errors and timeouts
+        if isinstance(err, openai.APIConnectionError):
+            return 0.0
+
+        # Quota is not restored by retrying
+        if isinstance(err, openai.RateLimitError) and err.code == "insufficient_quota":
+            return None
+
+        if isinstance(err, openai.APIStatusError) and (err.status_code in (408, 409, 429) or err.status_code >= 500):
+            return parse_retry_after(err.response.headers)
+
+        return None
+
     def __convert_model_name(self) -> str:
-        # Azure models are named differently from OpenAI models
-        if self.model.name.startswith('gpt-35'):
-            return self.model.name.replace('gpt-35', 'gpt-3.5')
-        return self.model.name
+        return to_openai_model_name(self.model.name)
+
+
+def to_openai_model_name(model_name: str) -> str:
+    # Azure models are named differently from OpenAI models
+    if model_name.startswith('gpt-35'):
+        return model_name.replace('gpt-35', 'gpt-3.5')
+    return model_name
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """Return an HTTP client keeping idle connections open for longer than the default of httpx."""
+    return httpx.AsyncClient(limits=httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_SECONDS
+    ))
+
+
+@lru_cache(maxsize=None)
+def get_model_encoding(model_name: str) -> Encoding:
+    """Return the tokenizer of model, loaded once per process."""
+    try:
+        return encoding_for_model(model_name)
+    except KeyError:
+        logger.warning(f"Model {model_name} not found. Using cl100k_base encoding.")
+        return get_encoding("cl100k_base")
+
+
+@lru_cache(maxsize=1024)
+def count_label_tokens(model_name: str, label: str) -> int:
+    """Return the number of tokens of short repeated strings, e.g. role and name."""
+    return len(get_model_encoding(model_name).encode(label))
@@ -1,10 +1,12 @@
 import logging
 from asyncio import to_thread
+from dataclasses import replace
 
 from json import dumps
-from typing import List, Optional
+from typing import List, Optional, Tuple
 
 import google.generativeai as palm
+from google.api_core import exceptions as google_exceptions
 
 from src.constant.env import PalmEnv
 from src.constant.model import PALM_MODELS
@@ -14,13 +16,14 @@ from src.model.completion_data import CompletionData, CompletionResult
 from src.model.message import Message
 from src.model.model import Model
 from src.model.prompt import Prompt
+from src.model.request_context import RequestContext
 
 logger = logging.getLogger(__name__)
 
 
 class PalmService(ChatService):
     def init_env(self):
-        env = PalmEnv.load()
+        env = PalmEnv.load(self.label)
         palm.configure(api_key=env.palm_api_key)
 
     def get_supported_models(self) -> List[Model]:
@@ -33,30 +36,55 @@ class PalmService(ChatService):
                     "accurately and provide detailed example."
         )
 
-    def build_prompt(self, history: List[Optional[Message]]) -> Prompt:
+    def build_prompt(
+            self,
+            history: List[Optional[Message]],
+            model: Optional[Model] = None,
+            context: Optional[RequestContext] = None
+    ) -> Prompt:
         sys_message = self.build_system_message()
-        all_messages = []
+        # Messages with the contents of consecutive messages from the same author, joined once at the end
+        groups: List[Tuple[Message, List[str]]] = []
 
-        for index, message in enumerate(history):
+        for message in history:
             if message is not None:
                 # Some discord messages are split into chunks if content is too long, we have to concatenate them.
-                if len(all_messages) > 0 and message.role == all_messages[-1].role:
-                    if message.role == Role.USER.value:
-                        all_messages[-1].content += f"\n{message.content}"
-                    else:
-                        all_messages[-1].content += message.content
+                if len(groups) > 0 and message.role == groups[-1][0].role:
+                    groups[-1][1].append(message.content)
                 else:
-                    all_messages.append(message)
+                    groups.append((message, [message.content]))
             else:
                 # Insert empty content for invalid message (e.g. blocked, error), as palm requires messages to be
                 # alternating between authors.
                 empty_msg = Message(
-                    role=Role.ASSISTANT.value if all_messages[-1].role == Role.USER.value else Role.ASSISTANT.value,
+                    role=Role.ASSISTANT.value if groups[-1][0].role == Role.USER.value else Role.ASSISTANT.value,
                     content=' '
                 )
-                all_messages.append(empty_msg)
+                groups.append((empty_msg, [empty_msg.content]))
+
+        # Copy messages as history may be shared with conversation cache
+        all_messages = [
+            replace(message, content=("\n" if message.role == Role.USER.value else "").join(contents))
+            if len(contents) > 1 else replace(message)
+            for message, contents in groups
+        ]
+
+        all_messages = self.trim_history(all_messages, header=sys_message, model=model, context=context)
+
+        # Keep messages alternating between authors after the thread starter message
+        if len(all_messages) > 2 and all_messages[1].role == all_messages[0].role:
+            del all_messages[1]
+
+        # Messages selected by relevance may leave consecutive messages of the same author
+        for index in range(len(all_messages) - 1, 1, -1):
+            if all_messages[index].role == all_messages[index - 1].role:
+                merged = all_messages.pop(index)
+                all_messages[index - 1] = replace(
+                    all_messages[index - 1],
+                    content=f"{all_messages[index - 1].content}\n{merged.content}"
+                )
 
-        return Prompt(conversation=all_messages, header=sys_message)
+        return Prompt(conversation=all_messages, header=sys_message, model=model)
 
     def render_prompt(self, prompt: Prompt) -> List[dict[str, str]]:
         messages = [self.render_message(message) for message in prompt.conversation]
@@ -79,10 +107,12 @@ class PalmService(ChatService):
         logger.debug(dumps(rendered_prompt, indent=2, default=str))
 
         try:
-            response = await palm.chat_async(
-                context=prompt.header.content,
-                messages=rendered_prompt,
-                model=self.model.name
+            response = await self.resilience.call(
+                lambda: palm.chat_async(
+                    context=prompt.header.content,
+                    messages=rendered_prompt,
+                    model=self.get_prompt_model(prompt).name
+                )
             )
 
             logger.debug(
@@ -113,6 +143,19 @@ class PalmService(ChatService):
                 status_text=str(err)
             )
 
+    def count_message_tokens(self, message: Message) -> int:
+        # Palm has no local tokenizer, estimate conservatively with 3 characters per token
+        return len(message.content or '') // 3 + 1
+
+    def get_retry_after(self, err: Exception) -> Optional[float]:
+        transient_errors = (
+            google_exceptions.TooManyRequests,
+            google_exceptions.ResourceExhausted,
+            google_exceptions.ServerError,
+            google_exceptions.DeadlineExceeded,
+        )
+        return 0.0 if isinstance(err, transient_errors) else None
+
     async def count_token_usage(self, messages: List[Message]) -> int:
         token_count = await to_thread(self.__count_token_sync, messages)
         return token_count
@@ -0,0 +1,51 @@
+import inspect
+from typing import AsyncIterator, Callable, Optional, Awaitable, Union
+
+
+class ReplyStream:
+    """Async iterator over the reply chunks of source, which closes source and calls on_close once the reply is
+    exhausted, fails or is closed. Unlike an async generator, closing it before the first chunk is pulled still closes
+    source, so that the request behind it is released."""
+
+    def __init__(
+            self,
+            source: AsyncIterator[str],
+            on_close: Optional[Callable[[], Union[None, Awaitable[None]]]] = None
+    ):
+        self.source = source
+        self.on_close = on_close
+        self.closed = False
+
+    def __aiter__(self) -> "ReplyStream":
+        return self
+
+    async def __anext__(self) -> str:
+        if self.closed:
+            raise StopAsyncIteration
+
+        try:
+            return await anext(self.source)
+        except BaseException:
+            # Exhausted, failed or cancelled while waiting for a chunk
+            await self.aclose()
+            raise
+
+    async def aclose(self):
+        if self.closed:
+            return
+
+        self.closed = True
+        try:
+            await close_stream(self.source)
+        finally:
+            if self.on_close is not None:
+                result = self.on_close()
+                if inspect.isawaitable(result):
+                    await result
+
+
+async def close_stream(stream: AsyncIterator[str]):
+    """Close stream if it can be closed, e.g. an async generator or a reply stream."""
+    aclose = getattr(stream, "aclose", None)
+    if aclose is not None:
+        await aclose()
@@ -0,0 +1,177 @@
+import asyncio
+import logging
+from collections import deque, OrderedDict
+from dataclasses import dataclass, field
+from time import monotonic
+from typing import Dict, Optional, Deque, List
+
+from src.model.request_context import RequestContext, RequestPriority
+
+logger = logging.getLogger(__name__)
+
+WAIT_SAMPLES = 1000
+
+
+@dataclass(frozen=True)
+class RequestLimiterStats:
+    max_concurrency: int
+    active: int
+    queued: Dict[RequestPriority, int]
+    total_requests: int
+    total_wait_seconds: float
+    # Percentiles of recent waits
+    p50_wait_seconds: float
+    p95_wait_seconds: float
+    max_wait_seconds: float
+
+
+@dataclass
+class GuildQueue:
+    # Virtual time at which the guild finishes its last served request
+    finish: float = 0.0
+    users: "OrderedDict[Optional[int], Deque[asyncio.Future]]" = field(default_factory=OrderedDict)
+
+
+class FairQueue:
+    """Weighted fair queue of waiters across guilds, and round robin across users within a guild. Every request served
+    advances the virtual finish time of its guild by 1 / weight, and the guild with the earliest finish is served
+    next."""
+
+    def __init__(self, guild_weights: Dict[int, float]):
+        self.guild_weights = guild_weights
+        self.guilds: Dict[Optional[int], GuildQueue] = {}
+        self.active_guilds: Dict[Optional[int], GuildQueue] = {}
+        self.virtual_time = 0.0
+        self.size = 0
+
+    def push(self, guild_id: Optional[int], user_id: Optional[int], waiter: asyncio.Future):
+        guild = self.guilds.setdefault(guild_id, GuildQueue())
+        if guild_id not in self.active_guilds:
+            # Idle guilds do not save up credit
+            guild.finish = max(guild.finish, self.virtual_time)
+            self.active_guilds[guild_id] = guild
+
+        guild.users.setdefault(user_id, deque()).append(waiter)
+        self.size += 1
+
+    def pop(self) -> Optional[asyncio.Future]:
+        if not self.active_guilds:
+            return None
+
+        guild_id, guild = min(self.active_guilds.items(), key=lambda item: item[1].finish)
+        self.virtual_time = guild.finish
+        guild.finish += 1 / self.guild_weights.get(guild_id, 1.0)
+
+        user_id, waiters = next(iter(guild.users.items()))
+        waiter = waiters.popleft()
+        if waiters:
+            guild.users.move_to_end(user_id)
+        else:
+            del guild.users[user_id]
+
+        if not guild.users:
+            del self.active_guilds[guild_id]
+
+        self.size -= 1
+        return waiter
+
+    def remove(self, guild_id: Optional[int], user_id: Optional[int], waiter: asyncio.Future):
+        guild = self.active_guilds.get(guild_id)
+        waiters = guild.users.get(user_id) if guild else None
+        if not waiters or waiter not in waiters:
+            return
+
+        waiters.remove(waiter)
+        self.size -= 1
+        if not waiters:
+            del guild.users[user_id]
+        if not guild.users:
+            del self.active_guilds[guild_id]
+
+
+class RequestLimiter:
+    """Limit the number of chat requests sent at once. Waiting requests of new threads are served before follow-ups,
+    and each priority is shared fairly across guilds and users."""
+
+    def __init__(self, max_concurrency: int, guild_weights: Optional[Dict[int, float]] = None):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self.lanes: Dict[RequestPriority, FairQueue] = {
+            priority: FairQueue(guild_weights or {}) for priority in RequestPriority
+        }
+        self.total_requests = 0
+        self.total_wait_seconds = 0.0
+        self.recent_waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+
+    async def acquire(self, context: Optional[RequestContext] = None):
+        """Wait until a request slot is available. Every acquire must be followed by a release."""
+        context = context or RequestContext()
+        start = monotonic()
+
+        if self.active < self.max_concurrency and self.__queued() == 0:
+            self.active += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            lane = self.lanes[context.priority]
+            lane.push(context.guild_id, context.user_id, waiter)
+
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # Slot was granted right before cancellation
+                    self.release()
+                else:
+                    lane.remove(context.guild_id, context.user_id, waiter)
+                raise
+
+        wait = monotonic() - start
+        self.total_requests += 1
+        self.total_wait_seconds += wait
+        self.recent_waits.append(wait)
+
+        if wait > 0.1:
+            logger.debug(f"Waited {wait:.2f}s for request slot, {self.__queued()} requests queued")
+
+    def release(self):
+        self.active -= 1
+        self.__dispatch()
+
+    def stats(self) -> RequestLimiterStats:
+        waits = sorted(self.recent_waits)
+        return RequestLimiterStats(
+            max_concurrency=self.max_concurrency,
+            active=self.active,
+            queued={priority: lane.size for priority, lane in self.lanes.items()},
+            total_requests=self.total_requests,
+            total_wait_seconds=self.total_wait_seconds,
+            p50_wait_seconds=percentile(waits, 0.5),
+            p95_wait_seconds=percentile(waits, 0.95),
+            max_wait_seconds=waits[-1] if waits else 0.0,
+        )
+
+    def __queued(self) -> int:
+        return sum(lane.size for lane in self.lanes.values())
+
+    def __dispatch(self):
+        while self.active < self.max_concurrency:
+            waiter = self.__pop_waiter()
+            if waiter is None:
+                return
+            if not waiter.done():
+                self.active += 1
+                waiter.set_result(None)
+
+    def __pop_waiter(self) -> Optional[asyncio.Future]:
+        for priority in RequestPriority:
+            waiter = self.lanes[priority].pop()
+            if waiter is not None:
+                return waiter
+        return None
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Return the value at fraction of sorted values, 0 if empty."""
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import random
+import re
+from email.utils import parsedate_to_datetime
+from time import monotonic, time
+from typing import Callable, Awaitable, Optional, TypeVar, Mapping
+
+from src.constant.service import RETRY_MAX_ATTEMPTS, RETRY_BASE_SECONDS, RETRY_MAX_BACKOFF_SECONDS, \
+    RETRY_DEADLINE_SECONDS, CIRCUIT_FAILURE_THRESHOLD, CIRCUIT_RESET_SECONDS
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+DURATION_PATTERN = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    """Open after consecutive failures, rejecting requests until the cooldown passes. Then a single trial request is
+    allowed, which closes the circuit if it succeeds."""
+
+    def __init__(
+            self,
+            failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+            reset_seconds: float = CIRCUIT_RESET_SECONDS
+    ):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None and monotonic() - self.opened_at < self.reset_seconds
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.is_open or self.trial_in_flight:
+            return False
+
+        # Half open
+        self.trial_in_flight = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.trial_in_flight or self.failures >= self.failure_threshold:
+            self.opened_at = monotonic()
+        self.trial_in_flight = False
+
+
+class Resilience:
+    """Retry transient errors of a chat service with jittered exponential backoff within a deadline, honoring the
+    delay requested by the service. A circuit breaker fails requests fast while the service keeps failing."""
+
+    def __init__(
+            self,
+            name: str,
+            get_retry_after: Callable[[Exception], Optional[float]],
+            max_attempts: int = RETRY_MAX_ATTEMPTS,
+            deadline_seconds: float = RETRY_DEADLINE_SECONDS
+    ):
+        self.name = name
+        self.get_retry_after = get_retry_after
+        self.max_attempts = max_attempts
+        self.deadline_seconds = deadline_seconds
+        self.circuit_breaker = CircuitBreaker()
+
+    async def call(self, request: Callable[[], Awaitable[T]]) -> T:
+        deadline = monotonic() + self.deadline_seconds
+        attempt = 0
+
+        while True:
+            is_trial = self.circuit_breaker.opened_at is not None
+            if not self.circuit_breaker.allow():
+                raise CircuitOpenError(f"{self.name} is temporarily unavailable after repeated errors")
+
+            attempt += 1
+            try:
+                result = await request()
+            except asyncio.CancelledError:
+                # Cancelled trial tells nothing about the service
+                if is_trial:
+                    self.circuit_breaker.trial_in_flight = False
+                raise
+            except Exception as err:
+                retry_after = self.get_retry_after(err)
+                if retry_after is None:
+                    # Service is up, the request itself is wrong
+                    self.circuit_breaker.record_success()
+                    raise
+
+                self.circuit_breaker.record_failure()
+
+                delay = max(retry_after, backoff_seconds(attempt))
+                if (
+                        attempt >= self.max_attempts
+                        or monotonic() + delay > deadline
+                        or self.circuit_breaker.opened_at is not None
+                ):
+                    raise
+
+                logger.warning(f"{self.name} attempt {attempt} failed with {err!r}, retry in {delay:.1f}s")
+                await asyncio.sleep(delay)
+            else:
+                self.circuit_breaker.record_success()
+                return result
+
+
+def backoff_seconds(attempt: int) -> float:
+    """Return full jitter exponential backoff delay after the given attempt."""
+    return random.uniform(0, min(RETRY_MAX_BACKOFF_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1)))
+
+
+def parse_retry_after(headers: Mapping[str, str]) -> float:
+    """Return seconds to wait before retrying from response headers, 0 if headers give no hint. Supports Retry-After
+    and the rate limit reset headers of OpenAI."""
+    if "retry-after-ms" in headers:
+        return float(headers["retry-after-ms"]) / 1000
+
+    if "retry-after" in headers:
+        value = headers["retry-after"]
+        try:
+            return float(value)
+        except ValueError:
+            try:
+                return max(0.0, parsedate_to_datetime(value).timestamp() - time())
+            except (TypeError, ValueError):
+                pass
+
+    # e.g. x-ratelimit-remaining-requests: 0, x-ratelimit-reset-requests: 6m0s
+    delays = [
+        parse_duration(headers.get(f"x-ratelimit-reset-{limit}", ""))
+        for limit in ("requests", "tokens")
+        if headers.get(f"x-ratelimit-remaining-{limit}") == "0"
+    ]
+    return max(delays, default=0.0)
+
+
+def parse_duration(value: str) -> float:
+    """Parse durations such as 1s, 6m0s and 20ms into seconds."""
+    return sum(float(amount) * DURATION_UNITS[unit] for amount, unit in DURATION_PATTERN.findall(value))
@@ -0,0 +1,90 @@
+import math
+import re
+from collections import Counter
+from typing import Dict, Hashable, Iterable, List, Tuple
+
+from cachetools import LRUCache
+
+from src.constant.discord import MAX_CACHED_THREADS
+
+# BM25 term frequency saturation and document length normalization
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+TERM_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> List[str]:
+    return TERM_PATTERN.findall(text.lower())
+
+
+class ThreadIndex:
+    """Inverted index of the messages of a thread for BM25 ranking, updated incrementally as messages change."""
+
+    def __init__(self):
+        # Term frequencies by term and document key
+        self.postings: Dict[str, Dict[Hashable, int]] = {}
+        self.lengths: Dict[Hashable, int] = {}
+        self.document_terms: Dict[Hashable, List[str]] = {}
+        self.total_length = 0
+
+    def add(self, key: Hashable, text: str):
+        if key in self.lengths:
+            return
+
+        terms = Counter(tokenize(text))
+        for term, frequency in terms.items():
+            self.postings.setdefault(term, {})[key] = frequency
+        self.lengths[key] = sum(terms.values())
+        self.document_terms[key] = list(terms)
+        self.total_length += self.lengths[key]
+
+    def remove(self, key: Hashable):
+        if key not in self.lengths:
+            return
+
+        for term in self.document_terms.pop(key):
+            del self.postings[term][key]
+            if not self.postings[term]:
+                del self.postings[term]
+        self.total_length -= self.lengths.pop(key)
+
+    def sync(self, documents: Iterable[Tuple[Hashable, str]]):
+        """Index new documents and drop documents no longer given, e.g. deleted messages."""
+        documents = dict(documents)
+        for key in [key for key in self.lengths if key not in documents]:
+            self.remove(key)
+        for key, text in documents.items():
+            self.add(key, text)
+
+    def score(self, query: str) -> Dict[Hashable, float]:
+        """Return BM25 score of documents matching any term of query."""
+        if not self.lengths:
+            return {}
+
+        scores: Dict[Hashable, float] = {}
+        average_length = self.total_length / len(self.lengths) or 1.0
+        for term in set(tokenize(query)):
+            documents = self.postings.get(term)
+            if not documents:
+                continue
+
+            idf = math.log(1 + (len(self.lengths) - len(documents) + 0.5) / (len(documents) + 0.5))
+            for key, frequency in documents.items():
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[key] / average_length)
+                scores[key] = scores.get(key, 0.0) + idf * frequency * (BM25_K1 + 1) / (frequency + norm)
+        return scores
+
+
+class RetrievalIndex:
+    """Message indexes of recently active threads."""
+
+    def __init__(self, max_threads: int = MAX_CACHED_THREADS):
+        self.threads: LRUCache = LRUCache(maxsize=max_threads)
+
+    def get_thread_index(self, thread_id: int) -> ThreadIndex:
+        index = self.threads.get(thread_id)
+        if index is None:
+            index = ThreadIndex()
+            self.threads[thread_id] = index
+        return index
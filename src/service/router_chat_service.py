@@ -0,0 +1,245 @@
+import asyncio
+import logging
+from dataclasses import dataclass
+from time import monotonic
+from typing import List, Optional, Iterable
+
+from src.model.completion_data import CompletionData, CompletionResult
+from src.model.message import Message
+from src.model.model import Model
+from src.model.prompt import Prompt
+from src.model.request_context import RequestContext
+from src.service.chat_service import ChatService
+from src.service.hedge_policy import HedgePolicy
+from src.service.reply_stream import close_stream
+from src.service.retrieval import RetrievalIndex
+
+logger = logging.getLogger(__name__)
+
+# Weight of the latest sample in moving averages
+EWMA_ALPHA = 0.3
+# Seconds a failed request is considered to cost, as it is followed by a fail over
+FAILURE_COST_SECONDS = 30
+# Error rate halves every minute, so failed backends are tried again once they may have recovered
+ERROR_HALF_LIFE_SECONDS = 60
+
+
+@dataclass
+class BackendStats:
+    # Moving average of seconds until response, or the first chunk when streaming
+    latency: Optional[float] = None
+    error_rate: float = 0.0
+    error_rate_updated_at: float = 0.0
+    in_flight: int = 0
+
+    def record_success(self, latency: float):
+        self.latency = latency if self.latency is None else EWMA_ALPHA * latency + (1 - EWMA_ALPHA) * self.latency
+        self.__set_error_rate(self.get_error_rate() * (1 - EWMA_ALPHA))
+
+    def record_failure(self):
+        self.__set_error_rate(EWMA_ALPHA + (1 - EWMA_ALPHA) * self.get_error_rate())
+
+    def get_error_rate(self) -> float:
+        return self.error_rate * 0.5 ** ((monotonic() - self.error_rate_updated_at) / ERROR_HALF_LIFE_SECONDS)
+
+    def score(self) -> float:
+        # Backends without samples are tried first, outstanding requests spread load across backends
+        latency = self.latency or 0.0
+        return (latency + FAILURE_COST_SECONDS * self.get_error_rate()) * (1 + self.in_flight)
+
+    def __set_error_rate(self, error_rate: float):
+        self.error_rate = error_rate
+        self.error_rate_updated_at = monotonic()
+
+
+class RouterChatService(ChatService):
+    """Route each request to the backend with the best recent latency and error rate, failing over to the next backend
+    on errors. With a hedge policy, slow requests are duplicated to the next backend and the first response wins.
+    Backends are expected to share the same prompt format and model names, e.g. Azure deployments in several regions.
+    Prompts are built by the first backend."""
+
+    def __init__(self, backends: List[ChatService], hedge_policy: Optional[HedgePolicy] = None):
+        self.backends = backends
+        self.backend_stats = [BackendStats() for _ in backends]
+        self.hedge_policy = hedge_policy
+        super().__init__()
+        self.set_current_model(self.model)
+
+    @property
+    def primary(self) -> ChatService:
+        return self.backends[0]
+
+    def get_supported_models(self) -> List[Model]:
+        return self.primary.get_supported_models()
+
+    def set_current_model(self, model: Optional[Model]):
+        super().set_current_model(model)
+        for backend in self.backends:
+            backend_model = next((m for m in backend.get_supported_models() if model and m.name == model.name), None)
+            backend.set_current_model(backend_model)
+
+    def set_retrieval_index(self, retrieval_index: Optional[RetrievalIndex]):
+        # Prompts are trimmed by the first backend
+        super().set_retrieval_index(retrieval_index)
+        self.primary.set_retrieval_index(retrieval_index)
+
+    def build_system_message(self) -> Message:
+        return self.primary.build_system_message()
+
+    def build_prompt(
+            self,
+            history: List[Optional[Message]],
+            model: Optional[Model] = None,
+            context: Optional[RequestContext] = None
+    ) -> Prompt:
+        return self.primary.build_prompt(history, model, context)
+
+    def render_prompt(self, prompt: Prompt) -> List[dict[str, str]]:
+        return self.primary.render_prompt(prompt)
+
+    def render_message(self, message: Message) -> dict[str, str]:
+        return self.primary.render_message(message)
+
+    def count_message_tokens(self, message: Message) -> int:
+        return self.primary.count_message_tokens(message)
+
+    async def count_token_usage(self, messages: List[Message]) -> int:
+        return await self.primary.count_token_usage(messages)
+
+    async def warm_up(self):
+        await asyncio.gather(*[backend.warm_up() for backend in self.backends])
+
+    async def send_prompt(self, prompt: Prompt) -> CompletionData:
+        return await self.__route(prompt, stream=False)
+
+    async def send_prompt_stream(self, prompt: Prompt) -> CompletionData:
+        return await self.__route(prompt, stream=True)
+
+    def rank_backends(self, model: Optional[Model] = None) -> List[int]:
+        """Return indexes of backends able to serve model, current model by default, best first."""
+        model = model or self.model
+        candidates = [
+            index for index, backend in enumerate(self.backends)
+            if backend.model is not None and not backend.resilience.circuit_breaker.is_open
+            and any(m.name == model.name for m in backend.get_supported_models())
+        ]
+        # Outstanding requests also tell apart backends without samples
+        return sorted(candidates, key=lambda index: (
+            self.backend_stats[index].score(), self.backend_stats[index].in_flight
+        ))
+
+    async def send_to_backend(self, index: int, prompt: Prompt, stream: bool) -> CompletionData:
+        backend = self.backends[index]
+        stats = self.backend_stats[index]
+
+        start = monotonic()
+        try:
+            if stream:
+                response_data = await backend.send_prompt_stream(prompt)
+            else:
+                response_data = await backend.send_prompt(prompt)
+        except asyncio.CancelledError:
+            # Lost to a hedged request, or discarded. Its latency is at least the time waited, leaving it out would
+            # bias the hedge delay towards backends which responded
+            if self.hedge_policy is not None:
+                self.hedge_policy.record_latency(backend.get_prompt_model(prompt).name, monotonic() - start)
+            raise
+
+        latency = monotonic() - start
+        if response_data.status is CompletionResult.OTHER_ERROR:
+            stats.record_failure()
+        else:
+            stats.record_success(latency)
+            if self.hedge_policy is not None:
+                self.hedge_policy.record_latency(backend.get_prompt_model(prompt).name, latency)
+
+        return response_data
+
+    def __start_request(self, index: int, prompt: Prompt, stream: bool) -> asyncio.Task:
+        # Request is outstanding from now on, so that requests routed before its task runs see it
+        stats = self.backend_stats[index]
+        stats.in_flight += 1
+
+        def on_done(_):
+            stats.in_flight -= 1
+
+        task = asyncio.create_task(self.send_to_backend(index, prompt, stream))
+        task.add_done_callback(on_done)
+        return task
+
+    async def __route(self, prompt: Prompt, stream: bool) -> CompletionData:
+        response_data = CompletionData(
+            status=CompletionResult.OTHER_ERROR,
+            reply_text=None,
+            status_text="No chat service available"
+        )
+
+        remaining = self.rank_backends(self.get_prompt_model(prompt))
+        hedged = False
+        while remaining:
+            index = remaining.pop(0)
+            tasks = [self.__start_request(index, prompt, stream)]
+
+            # Duplicate the request to the next backend if it is slower than usual
+            hedge_delay = self.__get_hedge_delay(prompt) if remaining and not hedged else None
+            if hedge_delay is not None:
+                try:
+                    done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+                except asyncio.CancelledError:
+                    await self.__discard(tasks)
+                    raise
+                if not done and self.hedge_policy.can_hedge():
+                    logger.info(f"{self.backends[index].name} is slow after {hedge_delay:.2f}s, hedge request")
+                    hedged = True
+                    tasks.append(self.__start_request(remaining.pop(0), prompt, stream))
+
+            response_data = await self.__first_success(tasks)
+
+            # Other results are caused by the request itself, failing over would not help
+            if response_data.status is not CompletionResult.OTHER_ERROR:
+                break
+
+            logger.warning(f"{self.backends[index].name} failed, fail over to next backend")
+
+        if self.hedge_policy is not None:
+            self.hedge_policy.record_request(hedged)
+
+        return response_data
+
+    def __get_hedge_delay(self, prompt: Prompt) -> Optional[float]:
+        if self.hedge_policy is None:
+            return None
+        return self.hedge_policy.get_delay(self.get_prompt_model(prompt).name)
+
+    async def __first_success(self, tasks: List[asyncio.Task]) -> CompletionData:
+        """Return the first response that is not an error, cancelling the other requests."""
+        pending = set(tasks)
+        response_data = None
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    result = task.result()
+                    if response_data is None or response_data.status is CompletionResult.OTHER_ERROR:
+                        response_data = result
+                    elif result.reply_stream is not None:
+                        # Both requests responded at the same time, close the stream of the loser
+                        await close_stream(result.reply_stream)
+
+                if response_data.status is not CompletionResult.OTHER_ERROR:
+                    return response_data
+
+            return response_data
+        finally:
+            await self.__discard(pending)
+
+    @staticmethod
+    async def __discard(tasks: Iterable[asyncio.Task]):
+        """Cancel requests, closing the stream of a request which responded before it was cancelled."""
+        tasks = list(tasks)
+        for task in tasks:
+            task.cancel()
+
+        for result in await asyncio.gather(*tasks, return_exceptions=True):
+            if isinstance(result, CompletionData) and result.reply_stream is not None:
+                await close_stream(result.reply_stream)
@@ -0,0 +1,125 @@
+import asyncio
+from dataclasses import dataclass
+from typing import Dict, Hashable, Callable, Awaitable, TypeVar, Generic, AsyncIterator, List, Optional
+
+from src.service.reply_stream import ReplyStream, close_stream
+
+T = TypeVar("T")
+
+
+@dataclass
+class Flight(Generic[T]):
+    task: asyncio.Task
+    waiters: int = 0
+
+
+class SingleFlight:
+    """Share one call among concurrent callers with the same key. A caller being cancelled does not cancel the call
+    for other callers, the call is cancelled only when all of its callers are cancelled."""
+
+    def __init__(self):
+        self.flights: Dict[Hashable, Flight] = {}
+
+    async def do(
+            self,
+            key: Hashable,
+            call: Callable[[], Awaitable[T]],
+            discard: Optional[Callable[[T], Awaitable[None]]] = None
+    ) -> T:
+        """Return the result of call, shared with concurrent callers of key. If every caller is cancelled after the
+        call has completed, its result is passed to discard, e.g. to release what it holds."""
+        flight = self.flights.get(key)
+        # A call being cancelled by its callers is not shared with new callers
+        if flight is None or flight.task.cancelling():
+            flight = Flight(task=asyncio.create_task(call()))
+            self.flights[key] = flight
+            flight.task.add_done_callback(lambda _: self.__remove(key, flight))
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1:
+                if not flight.task.done():
+                    flight.task.cancel()
+                elif discard is not None and not flight.task.cancelled() and flight.task.exception() is None:
+                    # Completed as its last caller was cancelled, nobody else takes the result
+                    await discard(flight.task.result())
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def __remove(self, key: Hashable, flight: Flight):
+        if self.flights.get(key) is flight:
+            del self.flights[key]
+
+
+class SharedStream:
+    """Let several consumers read the same stream, each from the beginning. Chunks are pulled from the source by a task
+    of its own, so that a consumer being cancelled does not end the stream of the others. The source is closed once
+    every consumer has left."""
+
+    def __init__(self, source: AsyncIterator[str]):
+        self.source = source
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        # Replaced every time it is set, consumers wait for the next chunk on it
+        self.changed = asyncio.Event()
+        self.pump: Optional[asyncio.Task] = None
+
+    def subscribe(self) -> ReplyStream:
+        """Return a stream of the chunks from the beginning, which must be closed or read to the end."""
+        self.subscribers += 1
+        if self.pump is None:
+            self.pump = asyncio.create_task(self.__pump())
+        return ReplyStream(self.__read(), on_close=self.__leave)
+
+    async def __read(self) -> AsyncIterator[str]:
+        index = 0
+        while True:
+            if index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+                continue
+
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+
+            await self.changed.wait()
+
+    async def __pump(self):
+        try:
+            async for chunk in self.source:
+                self.chunks.append(chunk)
+                self.__notify()
+        except asyncio.CancelledError:
+            self.error = RuntimeError("Reply stream was cancelled")
+            raise
+        except Exception as err:
+            self.error = err
+        finally:
+            self.done = True
+            self.__notify()
+            await close_stream(self.source)
+
+    async def __leave(self):
+        self.subscribers -= 1
+        if self.subscribers > 0 or self.done:
+            return
+
+        # Nobody reads the reply any more, stop the request behind it. A pump cancelled before it starts does not
+        # close the source by itself.
+        self.pump.cancel()
+        await asyncio.wait([self.pump])
+        self.done = True
+        if self.error is None:
+            self.error = RuntimeError("Reply stream was cancelled")
+        await close_stream(self.source)
+
+    def __notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
@@ -0,0 +1,43 @@
+import os
+import tempfile
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import AsyncMock
+
+import discord
+
+from src.message.command_sync import CommandSync, command_tree_hash
+
+
+def build_tree(description: str) -> discord.app_commands.CommandTree:
+    tree = discord.app_commands.CommandTree(discord.Client(intents=discord.Intents.none()))
+
+    @tree.command(name="chat", description=description)
+    async def chat(_: discord.Interaction, message: str):
+        pass
+
+    tree.sync = AsyncMock()
+    return tree
+
+
+class CommandSyncTest(IsolatedAsyncioTestCase):
+
+    async def test_sync_when_changed(self):
+        command_sync = CommandSync()
+        tree = build_tree("Create a new thread")
+
+        self.assertTrue(await command_sync.sync(tree))
+        self.assertFalse(await command_sync.sync(tree))
+        tree.sync.assert_awaited_once()
+
+        changed_tree = build_tree("Create a new thread for conversation")
+        self.assertNotEqual(command_tree_hash(tree), command_tree_hash(changed_tree))
+        self.assertTrue(await command_sync.sync(changed_tree))
+
+    async def test_hash_kept_across_restarts(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "commands.sha256")
+            self.assertTrue(await CommandSync(path).sync(build_tree("Create a new thread")))
+
+            tree = build_tree("Create a new thread")
+            self.assertFalse(await CommandSync(path).sync(tree))
+            tree.sync.assert_not_awaited()
@@ -0,0 +1,123 @@
+import os
+import tempfile
+from types import SimpleNamespace
+from typing import List, Optional
+from unittest import IsolatedAsyncioTestCase
+
+import discord
+
+from src.message.conversation_cache import ConversationCache
+from src.message.conversation_store import ConversationStore
+from src.model.message import Message
+from src.model.role import Role
+
+
+def fake_message(message_id: int, channel_id: int, content: str, bot: bool = False):
+    return SimpleNamespace(
+        id=message_id,
+        channel=SimpleNamespace(id=channel_id),
+        type=discord.MessageType.default,
+        content=content,
+        author=SimpleNamespace(bot=bot),
+    )
+
+
+class FakeThread:
+    def __init__(self, thread_id: int, messages: List[SimpleNamespace]):
+        self.id = thread_id
+        self.messages = messages
+        self.last_message_id: Optional[int] = messages[-1].id if messages else None
+        self.history_calls = []
+
+    async def history(self, limit: int, after: Optional[discord.Object], oldest_first: bool):
+        self.history_calls.append(after.id if after else None)
+        for message in self.messages:
+            if after is None or message.id > after.id:
+                yield message
+
+
+class ConversationCacheTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.cache = ConversationCache()
+
+    async def test_get_history_fetches_once(self):
+        thread = FakeThread(1, [fake_message(10, 1, "Hello"), fake_message(11, 1, "Hi there!", bot=True)])
+
+        history = await self.cache.get_history(thread)
+        self.assertEqual([m.content for m in history], ["Hello", "Hi there!"])
+        self.assertEqual([m.role for m in history], [Role.USER.value, Role.ASSISTANT.value])
+
+        # New message received from gateway
+        new_message = fake_message(12, 1, "How are you?")
+        thread.messages.append(new_message)
+        thread.last_message_id = new_message.id
+        self.cache.add_messages([new_message])
+
+        history = await self.cache.get_history(thread)
+        self.assertEqual([m.content for m in history], ["Hello", "Hi there!", "How are you?"])
+        self.assertListEqual(thread.history_calls, [None])
+
+    async def test_get_history_fetches_missing_messages(self):
+        thread = FakeThread(1, [fake_message(10, 1, "Hello")])
+        await self.cache.get_history(thread)
+
+        # Message missed from gateway
+        thread.messages.append(fake_message(11, 1, "Are you there?"))
+        thread.last_message_id = 11
+
+        history = await self.cache.get_history(thread)
+        self.assertEqual([m.content for m in history], ["Hello", "Are you there?"])
+        self.assertListEqual(thread.history_calls, [None, 10])
+
+    async def test_seed_edit_and_delete(self):
+        thread = FakeThread(1, [])
+        self.cache.seed(thread.id, {1: Message(role=Role.USER.value, content="Hello")})
+        self.cache.add_messages([fake_message(2, 1, "Hi", bot=True), fake_message(3, 1, "Typo")])
+
+        self.cache.edit_message(1, 3, "Fixed")
+        history = await self.cache.get_history(thread)
+        self.assertEqual([m.content for m in history], ["Hello", "Hi", "Fixed"])
+
+        self.cache.delete_messages(1, [2])
+        history = await self.cache.get_history(thread)
+        self.assertEqual([m.content for m in history], ["Hello", "Fixed"])
+        self.assertListEqual(thread.history_calls, [])
+
+    async def test_ignore_uncached_threads(self):
+        self.cache.add_messages([fake_message(2, 5, "Hi")])
+        self.assertNotIn(5, self.cache.threads)
+
+
+class ConversationStoreTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "conversations.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    async def test_restart_resumes_from_store(self):
+        store = ConversationStore(self.path)
+        cache = ConversationCache(store=store)
+        thread = FakeThread(1, [fake_message(10, 1, "Hello"), fake_message(11, 1, "Hi there!", bot=True)])
+        await cache.get_history(thread)
+        cache.add_messages([fake_message(12, 1, "Typo")])
+        cache.edit_message(1, 12, "Fixed")
+        cache.delete_messages(1, [11])
+        await store.close()
+
+        # Message received while offline
+        thread.messages.append(fake_message(13, 1, "Still there?"))
+        thread.last_message_id = 13
+
+        store = ConversationStore(self.path)
+        cache = ConversationCache(store=store)
+        await cache.restore()
+        self.assertIn(1, cache.threads)
+
+        history = await cache.get_history(thread)
+        self.assertEqual([m.content for m in history], ["Hello", "Fixed", "Still there?"])
+        self.assertListEqual(thread.history_calls, [None, 12])
+        await store.close()
@@ -0,0 +1,59 @@
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from src.constant.discord import MAX_REPLY_MESSAGES, REPLY_ATTACHMENT_NAME
+from src.message import process_response
+from src.message.process_response import send_reply, send_reply_stream
+from src.message.reply_packer import pack_reply
+from src.message.send_queue import SendQueue
+from test.message.test_send_queue import FakeChannel
+
+
+def create_reply(paragraphs: int) -> str:
+    # Each paragraph fills most of a message
+    return "\n\n".join(" ".join([f"word{index}"] * 250) for index in range(paragraphs))
+
+
+async def stream_reply(text: str, chunk_length: int = 100):
+    for start in range(0, len(text), chunk_length):
+        yield text[start:start + chunk_length]
+
+
+class SendReplyStreamTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        send_queue = patch.object(process_response, "SEND_QUEUE", SendQueue(channel_sends_per_window=100))
+        send_queue.start()
+        self.addCleanup(send_queue.stop)
+
+    async def test_send_reply_filling_every_message(self):
+        text = create_reply(MAX_REPLY_MESSAGES)
+        messages = pack_reply(text)
+        self.assertEqual(len(messages), MAX_REPLY_MESSAGES)
+
+        sent_messages = await send_reply_stream(FakeChannel(1), stream_reply(text))
+        self.assertListEqual([message.content for message in sent_messages], messages)
+
+        replied_messages = await send_reply(FakeChannel(2), text)
+        self.assertListEqual([message.content for message in replied_messages], messages)
+
+    async def test_send_overflowing_reply_as_file(self):
+        text = create_reply(MAX_REPLY_MESSAGES + 1)
+        messages = pack_reply(text)
+
+        channel = FakeChannel(1)
+        sent_messages = await send_reply_stream(channel, stream_reply(text))
+        self.assertListEqual(
+            [message.content for message in sent_messages],
+            messages[:MAX_REPLY_MESSAGES - 1] + ["Full reply is attached."]
+        )
+        self.assertNotIn(messages[MAX_REPLY_MESSAGES], [call[1] for call in channel.calls if call[0] == "send"])
+        self.assertEqual(channel.calls[-1][-1], "attachments")
+
+        replied_channel = FakeChannel(2)
+        replied_messages = await send_reply(replied_channel, text)
+        self.assertListEqual(
+            [message.content for message in replied_messages],
+            [message.content for message in sent_messages]
+        )
+        self.assertEqual(replied_channel.calls[-1][2]["file"].filename, REPLY_ATTACHMENT_NAME)
@@ -0,0 +1,55 @@
+from unittest import TestCase
+
+from src.message.reply_packer import pack_reply, split_reply
+
+
+class ReplyPackerTest(TestCase):
+
+    def test_short_reply(self):
+        self.assertListEqual(pack_reply("Hello"), ["Hello"])
+        self.assertListEqual(pack_reply(""), [])
+
+    def test_split_at_paragraph(self):
+        paragraphs = ["a" * 60 + "\n", "b" * 30 + "\n", "\n", "c" * 50 + "\n", "d" * 30]
+        messages = pack_reply("".join(paragraphs), limit=100)
+
+        # Paragraph break is preferred over the later line break
+        self.assertListEqual(messages, ["a" * 60 + "\n" + "b" * 30 + "\n\n", "c" * 50 + "\n" + "d" * 30])
+
+    def test_split_long_line(self):
+        text = " ".join(["word"] * 100)
+        messages = pack_reply(text, limit=100)
+
+        self.assertTrue(all(len(message) <= 100 for message in messages))
+        self.assertEqual("".join(messages), text)
+        self.assertTrue(all(message.endswith(" ") for message in messages[:-1]))
+
+        self.assertListEqual(pack_reply("x" * 250, limit=100), ["x" * 100, "x" * 100, "x" * 50])
+
+    def test_reopen_code_block(self):
+        code = "".join(f"print({index})\n" for index in range(40))
+        text = f"Here is the code:\n```python\n{code}```\nDone."
+        messages = pack_reply(text, limit=200)
+
+        self.assertGreater(len(messages), 2)
+        for index, message in enumerate(messages):
+            self.assertLessEqual(len(message), 200)
+            # Every message has its code block closed
+            self.assertEqual(message.count("```") % 2, 0)
+            if 0 < index < len(messages) - 1:
+                self.assertTrue(message.startswith("```python\n"))
+                self.assertTrue(message.endswith("```"))
+
+        # Removing the added fences restores the reply
+        restored = messages[0][:-len("```")]
+        for message in messages[1:-1]:
+            restored += message[len("```python\n"):-len("```")]
+        restored += messages[-1][len("```python\n"):]
+        self.assertEqual(restored, text)
+
+    def test_split_reply(self):
+        message, rest = split_reply("```\n" + "line\n" * 30, limit=100)
+
+        self.assertTrue(message.endswith("```"))
+        self.assertTrue(rest.startswith("```\n"))
+        self.assertEqual(split_reply("short", limit=100), ("short", ""))
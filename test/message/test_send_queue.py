@@ -0,0 +1,139 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase, TestCase
+
+from src.message.send_queue import SendQueue, TokenBucket
+
+
+class FakeMessage:
+    def __init__(self, channel: "FakeChannel", message_id: int, content: str):
+        self.channel = channel
+        self.id = message_id
+        self.content = content
+
+    async def edit(self, content: str, **kwargs) -> "FakeMessage":
+        self.channel.calls.append(("edit", self.id, content, *kwargs))
+        await asyncio.sleep(self.channel.latency)
+        self.content = content
+        return self
+
+
+class FakeChannel:
+    def __init__(self, channel_id: int, latency: float = 0.0):
+        self.id = channel_id
+        self.latency = latency
+        self.calls = []
+
+    async def send(self, content=None, **kwargs) -> FakeMessage:
+        self.calls.append(("send", content, kwargs))
+        await asyncio.sleep(self.latency)
+        return FakeMessage(self, len(self.calls), content)
+
+    async def edit(self, **kwargs):
+        self.calls.append(("edit_channel", kwargs))
+        return self
+
+
+class TokenBucketTest(TestCase):
+
+    def test_reserve(self):
+        bucket = TokenBucket(capacity=2, period=1.0)
+
+        self.assertEqual(bucket.reserve(), 0.0)
+        self.assertEqual(bucket.reserve(), 0.0)
+        # Later calls wait for tokens in order
+        self.assertAlmostEqual(bucket.reserve(), 0.5, places=2)
+        self.assertAlmostEqual(bucket.reserve(), 1.0, places=2)
+
+
+class SendQueueTest(IsolatedAsyncioTestCase):
+
+    async def test_send_in_order(self):
+        queue = SendQueue()
+        channel = FakeChannel(1)
+
+        message = await queue.send(channel, "Hello")
+        await queue.edit_message(message, "Hello again")
+        await queue.edit_channel(channel, archived=True)
+
+        self.assertListEqual(channel.calls, [
+            ("send", "Hello", {}),
+            ("edit", 1, "Hello again"),
+            ("edit_channel", {"archived": True}),
+        ])
+
+    async def test_merge_sends(self):
+        queue = SendQueue()
+        channel = FakeChannel(1, latency=0.01)
+        long_content = "x" * 1500
+
+        # First send is in flight while the others are queued
+        results = await asyncio.gather(
+            queue.send(channel, "first"),
+            queue.send(channel, "one", mergeable=True),
+            queue.send(channel, "two", mergeable=True),
+            queue.send(channel, embed="embed", mergeable=True),
+            queue.send(channel, "three", mergeable=True),
+            queue.send(channel, long_content, mergeable=True),
+            queue.send(channel, long_content, mergeable=True),
+            queue.send(channel, "four"),
+        )
+
+        # Content is joined up to the message limit, an embed ends the merged message
+        self.assertListEqual(channel.calls, [
+            ("send", "first", {}),
+            ("send", "one\ntwo", {"embed": "embed"}),
+            ("send", f"three\n{long_content}", {}),
+            ("send", long_content, {}),
+            ("send", "four", {}),
+        ])
+        self.assertIs(results[1], results[3])
+        self.assertEqual(queue.stats().queued, 0)
+
+    async def test_coalesce_edits(self):
+        queue = SendQueue()
+        channel = FakeChannel(1, latency=0.01)
+        message = FakeMessage(channel, 0, "")
+
+        first_edit = asyncio.create_task(queue.edit_message(message, "edit 0"))
+        await asyncio.sleep(0.001)
+        await asyncio.gather(*[queue.edit_message(message, f"edit {index}") for index in range(1, 5)])
+        await first_edit
+
+        # First edit is in flight, the queued ones are replaced by the latest
+        self.assertListEqual(channel.calls, [("edit", 0, "edit 0"), ("edit", 0, "edit 4")])
+
+    async def test_channels_independent(self):
+        queue = SendQueue()
+        slow_channel = FakeChannel(1, latency=1.0)
+        channel = FakeChannel(2)
+
+        slow_send = asyncio.create_task(queue.send(slow_channel, "slow"))
+        await asyncio.sleep(0)
+        await asyncio.wait_for(queue.send(channel, "fast"), timeout=0.5)
+
+        self.assertEqual(queue.stats().queued, 0)
+        slow_send.cancel()
+
+    async def test_keep_order_across_many_channels(self):
+        queue = SendQueue(global_requests_per_second=10000)
+        channel = FakeChannel(1, latency=0.01)
+
+        queued = [asyncio.create_task(queue.send(channel, f"a{index}")) for index in range(3)]
+        await asyncio.sleep(0)
+        # Sends to more channels than threads cached elsewhere, while the channel has sends queued
+        others = [asyncio.create_task(queue.send(FakeChannel(index), "b")) for index in range(2, 600)]
+        await asyncio.sleep(0)
+        await asyncio.gather(*queued, *others, queue.send(channel, "a3"))
+
+        self.assertListEqual([call[1] for call in channel.calls], ["a0", "a1", "a2", "a3"])
+
+    async def test_drop_idle_channel(self):
+        queue = SendQueue(channel_sends_per_window=2, channel_send_window_seconds=0.05)
+        channel = FakeChannel(1)
+
+        await queue.send(channel, "Hello")
+        self.assertIn(channel.id, queue.channels)
+
+        # Kept until the rate limit of the channel has recovered
+        await asyncio.sleep(0.1)
+        self.assertNotIn(channel.id, queue.channels)
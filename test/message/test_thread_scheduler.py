@@ -0,0 +1,63 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from src.message.thread_scheduler import ThreadScheduler
+
+
+class ThreadSchedulerTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.scheduler = ThreadScheduler(min_delay=0.01, max_delay=0.05)
+        self.requests = []
+        self.delivered = []
+
+    def schedule(self, thread_id: int, name: str, request_seconds: float = 0.0) -> asyncio.Task:
+        async def request():
+            self.requests.append(name)
+            await asyncio.sleep(request_seconds)
+            return name
+
+        async def deliver(result):
+            self.delivered.append(result)
+
+        return self.scheduler.schedule(thread_id, request=request, deliver=deliver)
+
+    async def test_debounce_burst(self):
+        self.schedule(1, "first")
+        self.schedule(1, "second")
+        task = self.schedule(1, "third")
+        await task
+
+        self.assertListEqual(self.requests, ["third"])
+        self.assertListEqual(self.delivered, ["third"])
+
+    async def test_cancel_request_in_flight(self):
+        self.schedule(1, "first", request_seconds=1)
+        await asyncio.sleep(0.03)
+        self.assertListEqual(self.requests, ["first"])
+
+        task = self.schedule(1, "second")
+        await task
+
+        self.assertListEqual(self.requests, ["first", "second"])
+        self.assertListEqual(self.delivered, ["second"])
+
+    async def test_threads_are_independent(self):
+        first = self.schedule(1, "first")
+        second = self.schedule(2, "second")
+        await asyncio.gather(first, second)
+
+        self.assertCountEqual(self.delivered, ["first", "second"])
+
+    async def test_drop_idle_thread(self):
+        self.schedule(1, "first", request_seconds=0.2)
+        await self.schedule(2, "second")
+        await asyncio.sleep(0.1)
+
+        # Thread with a request in flight is kept, so a new message still cancels it
+        self.assertListEqual(list(self.scheduler.schedules), [1])
+        await self.schedule(1, "third")
+        self.assertListEqual(self.delivered, ["second", "third"])
+
+        await asyncio.sleep(0.1)
+        self.assertDictEqual(self.scheduler.schedules, {})
@@ -0,0 +1,44 @@
+import asyncio
+import time
+from unittest import IsolatedAsyncioTestCase
+
+from src.metrics.loop_monitor import LoopMonitor, SLOW_CALLBACKS, LOOP_LAG_SECONDS
+
+
+async def blocking_handler():
+    time.sleep(0.05)
+
+
+class LoopMonitorTest(IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.latency = 0.1
+        self.monitor = LoopMonitor(
+            get_heartbeat_latency=lambda: self.latency,
+            interval=0.01,
+            slow_callback_seconds=0.03
+        )
+        self.monitor.start()
+
+    async def asyncTearDown(self):
+        self.monitor.stop()
+
+    async def test_report_slow_callback(self):
+        with self.assertLogs("src.metrics.loop_monitor", level="WARNING") as logs:
+            await asyncio.create_task(blocking_handler())
+
+        self.assertIn("blocking_handler", logs.output[0])
+        self.assertGreaterEqual(SLOW_CALLBACKS.values[("blocking_handler",)], 1)
+
+    async def test_sample_lag(self):
+        samples = sum(count for (counts, (_, count)) in LOOP_LAG_SECONDS.values.values())
+        await asyncio.sleep(0.05)
+        self.assertGreater(sum(count for (counts, (_, count)) in LOOP_LAG_SECONDS.values.values()), samples)
+
+    async def test_warn_on_heartbeat_latency(self):
+        self.latency = 2.0
+        with self.assertLogs("src.metrics.loop_monitor", level="WARNING") as logs:
+            self.monitor.check_heartbeat()
+            self.monitor.check_heartbeat()
+        self.assertEqual(len(logs.output), 1)
+        self.assertIn("heartbeat latency is 2.000s", logs.output[0])
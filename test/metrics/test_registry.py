@@ -0,0 +1,39 @@
+from unittest import TestCase
+
+from src.metrics.instrumentation import track_stage, Stage, STAGE_SECONDS
+from src.metrics.registry import MetricsRegistry
+
+
+class MetricsRegistryTest(TestCase):
+
+    def setUp(self):
+        self.registry = MetricsRegistry()
+
+    def test_render_histogram(self):
+        histogram = self.registry.histogram("latency_seconds", "Latency", ("stage",))
+        histogram.observe(0.02, stage="fetch")
+        histogram.observe(3, stage="fetch")
+
+        lines = self.registry.render().splitlines()
+        self.assertIn("# TYPE latency_seconds histogram", lines)
+        self.assertIn('latency_seconds_bucket{stage="fetch",le="0.01"} 0', lines)
+        self.assertIn('latency_seconds_bucket{stage="fetch",le="0.025"} 1', lines)
+        self.assertIn('latency_seconds_bucket{stage="fetch",le="+Inf"} 2', lines)
+        self.assertIn('latency_seconds_sum{stage="fetch"} 3.02', lines)
+        self.assertIn('latency_seconds_count{stage="fetch"} 2', lines)
+
+    def test_render_counter_and_gauge(self):
+        self.registry.counter("requests_total", "Requests", ("status",)).inc(status='say "hi"')
+        self.registry.gauge("queued", "Queued", lambda: [({"priority": "high"}, 3), ({}, 1)])
+
+        lines = self.registry.render().splitlines()
+        self.assertIn('requests_total{status="say \\"hi\\""} 1.0', lines)
+        self.assertIn('queued{priority="high"} 3', lines)
+        self.assertIn('queued 1', lines)
+
+    def test_track_stage_records_status_of_error(self):
+        with self.assertRaises(ValueError):
+            with track_stage(Stage.PROMPT_BUILD, provider="test"):
+                raise ValueError()
+
+        self.assertIn(("prompt_build", "test", "", "ValueError"), STAGE_SECONDS.values)
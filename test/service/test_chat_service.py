@@ -0,0 +1,82 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+from src.model.completion_data import CompletionData, CompletionResult
+from src.model.message import Message
+from src.model.role import Role
+from src.service.palm_service import PalmService
+from src.service.reply_stream import ReplyStream
+from src.service.request_limiter import RequestLimiter
+
+
+class ChatServiceTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.chat_service = PalmService()
+        self.chat_service.set_request_limiter(RequestLimiter(max_concurrency=2))
+        self.closed = 0
+
+    async def send_prompt_stream(self, _) -> CompletionData:
+        async def reply_stream():
+            try:
+                yield "Hello"
+                await asyncio.sleep(0.01)
+                yield " world"
+            finally:
+                self.closed += 1
+
+        # Provider streams have started by the time they are returned, e.g. to read the first chunk
+        chunks = reply_stream()
+        first_chunk = await anext(chunks)
+
+        async def prepend():
+            yield first_chunk
+            async for chunk in chunks:
+                yield chunk
+
+        # Provider streams close the response once closed, see OpenAIService
+        return CompletionData(
+            status=CompletionResult.OK,
+            reply_text=None,
+            status_text=None,
+            reply_stream=ReplyStream(prepend(), on_close=chunks.aclose)
+        )
+
+    async def chat(self, content: str) -> CompletionData:
+        with patch.object(self.chat_service, "send_prompt_stream", self.send_prompt_stream):
+            return await self.chat_service.chat([Message(role=Role.USER.value, content=content)], stream=True)
+
+    async def test_discard_reply_stream(self):
+        # More discarded replies than request slots
+        for index in range(3):
+            response_data = await asyncio.wait_for(self.chat(f"Question {index}"), timeout=1)
+            await response_data.reply_stream.aclose()
+
+        self.assertEqual(self.chat_service.request_limiter.stats().active, 0)
+
+        response_data = await asyncio.wait_for(self.chat("Question"), timeout=1)
+        self.assertEqual("".join([chunk async for chunk in response_data.reply_stream]), "Hello world")
+        self.assertEqual(self.chat_service.request_limiter.stats().active, 0)
+
+    async def test_share_reply_stream(self):
+        first, second = await asyncio.gather(self.chat("Question"), self.chat("Question"))
+
+        await first.reply_stream.aclose()
+        self.assertEqual("".join([chunk async for chunk in second.reply_stream]), "Hello world")
+        self.assertEqual(self.closed, 1)
+        self.assertEqual(self.chat_service.request_limiter.stats().active, 0)
+
+    async def test_cancel_once_reply_is_shared(self):
+        task = asyncio.create_task(self.chat("Question"))
+        while not self.chat_service.single_flight.flights:
+            await asyncio.sleep(0)
+
+        # Cancel the caller after the shared request completes, before the caller resumes
+        flight = next(iter(self.chat_service.single_flight.flights.values()))
+        flight.task.add_done_callback(lambda _: task.cancel())
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        self.assertEqual(self.closed, 1)
+        self.assertEqual(self.chat_service.request_limiter.stats().active, 0)
@@ -0,0 +1,34 @@
+import subprocess
+import sys
+from unittest import TestCase
+
+from src.service.chat_service_factory import ChatServiceFactory, register_chat_service, CHAT_SERVICES
+from src.service.palm_service import PalmService
+
+
+class ChatServiceFactoryTest(TestCase):
+
+    def tearDown(self):
+        CHAT_SERVICES.pop("test", None)
+
+    def test_get_service_cls(self):
+        self.assertIsInstance(ChatServiceFactory.get_service_cls("palm"), PalmService)
+
+    def test_register_chat_service(self):
+        register_chat_service("test", "src.service.palm_service:PalmService")
+        self.assertIsInstance(ChatServiceFactory.get_service_cls("test"), PalmService)
+
+    def test_unknown_service(self):
+        with self.assertRaises(ValueError):
+            ChatServiceFactory.get_service_cls("unknown")
+        with self.assertRaises(ValueError):
+            register_chat_service("test", "src.service.palm_service")
+        register_chat_service("test", "src.model.message:Message")
+        with self.assertRaises(TypeError):
+            ChatServiceFactory.get_service_cls("test")
+
+    def test_import_without_providers(self):
+        # Run in a new interpreter, as other tests import every provider
+        code = "import sys, src.service.chat_service_factory; print('openai' in sys.modules, 'grpc' in sys.modules)"
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+        self.assertEqual(output.strip(), "False False")
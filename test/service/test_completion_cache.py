@@ -0,0 +1,84 @@
+import asyncio
+import os
+from tempfile import TemporaryDirectory
+from unittest import IsolatedAsyncioTestCase
+
+from src.model.completion_data import CompletionData, CompletionResult
+from src.service.chat_service import stream_chunks
+from src.service.completion_cache import CompletionCache, CACHE_REQUESTS
+
+
+def create_response(reply_stream) -> CompletionData:
+    return CompletionData(status=CompletionResult.OK, reply_text=None, status_text=None, reply_stream=reply_stream)
+
+
+async def failing_stream():
+    yield "Hello"
+    raise RuntimeError("Connection lost")
+
+
+class CompletionCacheTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.directory = TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, "completions.db")
+
+    async def test_get(self):
+        cache = CompletionCache(max_size=10, ttl_seconds=60)
+        hits = CACHE_REQUESTS.values.get(("hit",), 0.0)
+        misses = CACHE_REQUESTS.values.get(("miss",), 0.0)
+
+        self.assertIsNone(await cache.get("key"))
+        await cache.put("key", "Hello")
+        self.assertEqual(await cache.get("key"), "Hello")
+
+        self.assertEqual(cache.stats().hits, 1)
+        self.assertEqual(cache.stats().misses, 1)
+        self.assertEqual(CACHE_REQUESTS.values[("hit",)], hits + 1)
+        self.assertEqual(CACHE_REQUESTS.values[("miss",)], misses + 1)
+
+    async def test_expire(self):
+        cache = CompletionCache(max_size=10, ttl_seconds=0.05, path=self.path)
+        await cache.put("key", "Hello")
+        await asyncio.sleep(0.1)
+
+        # Expired both in memory and in the file
+        self.assertIsNone(await cache.get("key"))
+        self.assertIsNone(await CompletionCache(max_size=10, ttl_seconds=0.05, path=self.path).get("key"))
+
+    async def test_persist(self):
+        await CompletionCache(max_size=10, ttl_seconds=60, path=self.path).put("key", "Hello")
+
+        cache = CompletionCache(max_size=10, ttl_seconds=60, path=self.path)
+        self.assertEqual(await cache.get("key"), "Hello")
+        self.assertEqual(cache.stats().size, 1)
+
+    async def test_put_stream_once_complete(self):
+        cache = CompletionCache(max_size=10, ttl_seconds=60)
+        response_data = await cache.put_response("key", create_response(stream_chunks("Hello", " world")))
+
+        self.assertEqual(await anext(response_data.reply_stream), "Hello")
+        self.assertIsNone(await cache.get("key"))
+
+        self.assertEqual([chunk async for chunk in response_data.reply_stream], [" world"])
+        self.assertEqual(await cache.get("key"), "Hello world")
+
+    async def test_skip_closed_stream(self):
+        cache = CompletionCache(max_size=10, ttl_seconds=60)
+        response_data = await cache.put_response("key", create_response(stream_chunks("Hello", " world")))
+
+        await anext(response_data.reply_stream)
+        await response_data.reply_stream.aclose()
+        self.assertIsNone(await cache.get("key"))
+
+    async def test_skip_failed_stream(self):
+        cache = CompletionCache(max_size=10, ttl_seconds=60, path=self.path)
+        response_data = await cache.put_response("key", create_response(failing_stream()))
+
+        with self.assertRaises(RuntimeError):
+            async for _ in response_data.reply_stream:
+                pass
+
+        self.assertIsNone(await cache.get("key"))
+        self.assertIsNone(await CompletionCache(max_size=10, ttl_seconds=60, path=self.path).get("key"))
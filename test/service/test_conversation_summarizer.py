@@ -0,0 +1,57 @@
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch, AsyncMock
+
+from src.model.completion_data import CompletionData, CompletionResult
+from src.model.message import Message
+from src.model.request_context import RequestContext
+from src.model.role import Role
+from src.service.conversation_summarizer import ConversationSummarizer
+from src.service.palm_service import PalmService
+
+
+class ConversationSummarizerTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.chat_service = PalmService()
+        self.summarizer = ConversationSummarizer(trigger_tokens=1000)
+        self.context = RequestContext(thread_id=1)
+
+    @staticmethod
+    def build_history(length: int) -> list:
+        history = [Message(role=Role.USER.value, content="Thread starter")]
+        for index in range(1, length):
+            role = Role.ASSISTANT.value if index % 2 == 1 else Role.USER.value
+            history.append(Message(role=role, content=f"{index}" * 600))
+        return history
+
+    async def wait_summary(self):
+        summary = self.summarizer.summaries[self.context.thread_id]
+        if summary.task is not None:
+            await summary.task
+
+    async def test_short_history_is_kept(self):
+        history = self.build_history(3)
+        self.assertEqual(self.summarizer.compact(self.chat_service, history, self.context), (history, None))
+
+    async def test_compact_with_background_summary(self):
+        reply = CompletionData(status=CompletionResult.OK, reply_text="Summary", status_text=None)
+        with patch.object(self.chat_service, "send_prompt", AsyncMock(return_value=reply)) as send_prompt:
+            history = self.build_history(8)
+
+            # History is sent as it is until the first summary is ready
+            self.assertEqual(self.summarizer.compact(self.chat_service, history, self.context), (history, None))
+            await self.wait_summary()
+
+            compacted, summary = self.summarizer.compact(self.chat_service, history, self.context)
+            self.assertEqual(summary, "Summary")
+            self.assertEqual(compacted[0], history[0])
+            self.assertListEqual(compacted[1:], history[-2:])
+
+            # Summary model is the cheapest model by default
+            prompt = send_prompt.call_args.args[0]
+            self.assertEqual(prompt.model, self.chat_service.get_supported_models()[0])
+
+            # Editing a summarized message starts over
+            history[3] = Message(role=Role.ASSISTANT.value, content="Edited")
+            self.assertEqual(self.summarizer.compact(self.chat_service, history, self.context), (history, None))
+            await self.wait_summary()
@@ -0,0 +1,29 @@
+from unittest import TestCase
+
+from src.service.hedge_policy import HedgePolicy
+
+
+class HedgePolicyTest(TestCase):
+
+    def test_get_delay(self):
+        hedge_policy = HedgePolicy(latency_percentile=0.9, min_samples=20)
+        for index in range(19):
+            hedge_policy.record_latency("model", (index + 1) / 20)
+        self.assertIsNone(hedge_policy.get_delay("model"))
+
+        hedge_policy.record_latency("model", 1.0)
+        self.assertEqual(hedge_policy.get_delay("model"), 0.95)
+        self.assertIsNone(hedge_policy.get_delay("other model"))
+
+    def test_budget(self):
+        hedge_policy = HedgePolicy(budget=0.1)
+        for _ in range(9):
+            hedge_policy.record_request(hedged=False)
+        self.assertTrue(hedge_policy.can_hedge())
+
+        hedge_policy.record_request(hedged=True)
+        self.assertFalse(hedge_policy.can_hedge())
+
+        for _ in range(10):
+            hedge_policy.record_request(hedged=False)
+        self.assertTrue(hedge_policy.can_hedge())
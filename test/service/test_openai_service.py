@@ -1,5 +1,8 @@
-from unittest import TestCase
+from types import SimpleNamespace
+from unittest import TestCase, IsolatedAsyncioTestCase
+from unittest.mock import patch, AsyncMock
 
+from src.model.completion_data import CompletionData
 from src.model.message import Message
 from src.model.prompt import Prompt
 from src.model.role import Role
@@ -87,3 +90,59 @@ class OpenAIServiceTest(TestCase):
             {"role": "assistant", "content": "Sure, I'd be happy to!"},
         ]
         self.assertListEqual(self.chat_service.render_prompt(prompt), expected)
+
+    def test_select_cheapest_model(self):
+        chat_service = OpenAIService()
+        chat_service.set_auto_model(True)
+        # Between 16K and 32K tokens
+        history = [Message(role=Role.USER.value, content="word " * 16000)]
+        image_history = [Message(role=Role.USER.value, content="word " * 16000, image_url="https://example.com/a.png")]
+
+        # Estimate tokens without a tokenizer download
+        with patch.object(chat_service, "get_message_tokens", lambda message: len(message.content or '') // 4):
+            self.assertEqual(chat_service.select_model(history).name, "gpt-4-32k")
+            self.assertEqual(chat_service.select_model(image_history).name, "gpt-4-vision-preview")
+
+
+class FakeCompletionStream:
+    def __init__(self, *contents: str):
+        self.contents = contents
+        self.response = SimpleNamespace(aclose=AsyncMock())
+
+    async def __aiter__(self):
+        for content in self.contents:
+            yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+
+class OpenAIServiceStreamTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.chat_service = OpenAIService()
+        self.prompt = Prompt(conversation=[Message(role=Role.USER.value, content="Hello")])
+
+    async def send_prompt_stream(self, stream: FakeCompletionStream) -> CompletionData:
+        with patch.object(self.chat_service, "_create_chat_completion_stream", AsyncMock(return_value=stream)):
+            return await self.chat_service.send_prompt_stream(self.prompt)
+
+    async def test_stream_reply(self):
+        stream = FakeCompletionStream("Hello", " world")
+        response_data = await self.send_prompt_stream(stream)
+
+        self.assertEqual("".join([chunk async for chunk in response_data.reply_stream]), "Hello world")
+        stream.response.aclose.assert_awaited()
+
+    async def test_close_response_of_discarded_reply(self):
+        stream = FakeCompletionStream("Hello", " world")
+        response_data = await self.send_prompt_stream(stream)
+
+        # Reply is closed before the first chunk is pulled, e.g. the thread of /chat could not be created
+        await response_data.reply_stream.aclose()
+        stream.response.aclose.assert_awaited_once()
+
+    async def test_request_max_output_tokens(self):
+        model = self.chat_service.get_supported_models()[-1]
+        create = AsyncMock(return_value=FakeCompletionStream("Hello"))
+        with patch.object(self.chat_service.client.chat.completions, "create", create):
+            await self.chat_service._create_chat_completion_stream(model, [])
+
+        self.assertEqual(create.call_args.kwargs["max_tokens"], model.max_output_tokens)
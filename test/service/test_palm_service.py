@@ -1,10 +1,13 @@
 from unittest import TestCase
+from unittest.mock import patch
 
 from src.model.message import Message
 from src.model.prompt import Prompt
+from src.model.request_context import RequestContext
 from src.model.role import Role
 from src.service.chat_service import ChatService
 from src.service.palm_service import PalmService
+from src.service.retrieval import RetrievalIndex
 
 
 class PalmServiceTest(TestCase):
@@ -100,3 +103,94 @@ class PalmServiceTest(TestCase):
             {"author": "1", "content": "Sure, I'd be happy to!"}
         ]
         self.assertListEqual(self.chat_service.render_prompt(prompt), expected)
+
+    def test_build_prompt_merges_chunks(self):
+        history = [
+            Message(role=Role.USER.value, content="Show me a long example"),
+            Message(role=Role.ASSISTANT.value, content="First chunk, "),
+            Message(role=Role.ASSISTANT.value, content="second chunk"),
+            Message(role=Role.USER.value, content="Thanks"),
+            Message(role=Role.USER.value, content="One more question"),
+        ]
+
+        prompt = self.chat_service.build_prompt(history)
+
+        self.assertListEqual(
+            [message.content for message in prompt.conversation],
+            ["Show me a long example", "First chunk, second chunk", "Thanks\nOne more question"]
+        )
+        # History is not modified
+        self.assertEqual(history[1].content, "First chunk, ")
+        self.assertEqual(history[3].content, "Thanks")
+
+    def test_build_prompt_trims_history(self):
+        history = [Message(role=Role.USER.value, content="Thread starter")]
+        for index in range(1, 7):
+            role = Role.ASSISTANT.value if index % 2 == 1 else Role.USER.value
+            history.append(Message(role=role, content=f"{index}" * 3900))
+
+        prompt = self.chat_service.build_prompt(history)
+
+        # Thread starter is kept, and messages keep alternating between authors
+        self.assertEqual(len(prompt.conversation), 3)
+        self.assertEqual(prompt.conversation[0].content, "Thread starter")
+        self.assertEqual(prompt.conversation[1].content, "5" * 3900)
+        self.assertEqual(prompt.conversation[2].content, "6" * 3900)
+
+    def test_build_prompt_selects_relevant_history(self):
+        chat_service = PalmService()
+        chat_service.set_retrieval_index(RetrievalIndex())
+
+        history = [Message(role=Role.USER.value, content="Thread starter")]
+        for index in range(1, 7):
+            role = Role.ASSISTANT.value if index % 2 == 1 else Role.USER.value
+            history.append(Message(role=role, content=" ".join(["filler"] * 1300)))
+        history[1] = Message(role=Role.ASSISTANT.value, content="The deployment password is stored in the vault")
+        history.append(Message(role=Role.ASSISTANT.value, content="Anything else?"))
+        history.append(Message(role=Role.USER.value, content="Where is the deployment password stored?"))
+
+        prompt = chat_service.build_prompt(history, context=RequestContext(thread_id=1))
+
+        # Relevant older message is kept next to the latest messages, merged as both are sent by assistant
+        self.assertListEqual([message.content for message in prompt.conversation], [
+            "Thread starter",
+            "The deployment password is stored in the vault\nAnything else?",
+            "Where is the deployment password stored?"
+        ])
+
+        # Threads starting with the same message are indexed apart
+        chat_service.build_prompt(history, context=RequestContext(thread_id=2))
+        self.assertSetEqual(set(chat_service.retrieval_index.threads), {1, 2})
+
+    def test_fits(self):
+        chat_service = PalmService()
+        messages = [Message(role=Role.USER.value, content="Hello world " * 10)]
+        tokens = chat_service.get_message_tokens(messages[0])
+        upper_bound = chat_service.get_message_tokens_upper_bound(messages[0])
+
+        # Tokens are not counted when the upper bound fits
+        with patch.object(chat_service, "get_message_tokens", side_effect=AssertionError):
+            self.assertTrue(chat_service.fits(messages, upper_bound))
+
+        self.assertTrue(chat_service.fits(messages, tokens))
+        self.assertFalse(chat_service.fits(messages, tokens - 1))
+
+    def test_select_model(self):
+        chat_service = PalmService()
+        short_history = [Message(role=Role.USER.value, content="Hello")]
+        long_history = [Message(role=Role.USER.value, content="1" * 14000)]
+        cheapest, larger = chat_service.get_supported_models()
+
+        # Current model is used unless auto mode is on
+        self.assertEqual(chat_service.select_model(long_history), cheapest)
+
+        chat_service.set_auto_model(True)
+        self.assertEqual(chat_service.select_model(short_history), cheapest)
+        self.assertEqual(chat_service.select_model(long_history), larger)
+
+        # Model pinned to thread wins
+        context = RequestContext(thread_id=1)
+        chat_service.pin_model(1, larger)
+        self.assertEqual(chat_service.select_model(short_history, context), larger)
+        chat_service.pin_model(1, None)
+        self.assertEqual(chat_service.select_model(short_history, context), cheapest)
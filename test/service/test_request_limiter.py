@@ -0,0 +1,90 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from src.model.request_context import RequestContext, RequestPriority
+from src.service.chat_service import call_after_stream, stream_chunks
+from src.service.request_limiter import RequestLimiter
+
+
+class RequestLimiterTest(IsolatedAsyncioTestCase):
+
+    async def run_requests(self, limiter: RequestLimiter, contexts: list) -> list:
+        served = []
+
+        async def request(name: str, context: RequestContext):
+            await limiter.acquire(context)
+            served.append(name)
+            await asyncio.sleep(0)
+            limiter.release()
+
+        # Occupy the only slot, so that all requests are queued
+        await limiter.acquire()
+        tasks = [asyncio.create_task(request(name, context)) for name, context in contexts]
+        await asyncio.sleep(0)
+        limiter.release()
+
+        await asyncio.gather(*tasks)
+        return served
+
+    async def test_fair_across_guilds(self):
+        limiter = RequestLimiter(max_concurrency=1)
+        contexts = [(f"a{i}", RequestContext(guild_id=1, user_id=1)) for i in range(3)]
+        contexts += [(f"b{i}", RequestContext(guild_id=2, user_id=2)) for i in range(3)]
+
+        served = await self.run_requests(limiter, contexts)
+        self.assertListEqual(served, ["a0", "b0", "a1", "b1", "a2", "b2"])
+
+    async def test_guild_weights(self):
+        limiter = RequestLimiter(max_concurrency=1, guild_weights={1: 2.0})
+        contexts = [(f"a{i}", RequestContext(guild_id=1)) for i in range(4)]
+        contexts += [(f"b{i}", RequestContext(guild_id=2)) for i in range(2)]
+
+        served = await self.run_requests(limiter, contexts)
+        self.assertListEqual(served, ["a0", "b0", "a1", "a2", "b1", "a3"])
+
+    async def test_round_robin_users_within_guild(self):
+        limiter = RequestLimiter(max_concurrency=1)
+        contexts = [(f"a{i}", RequestContext(guild_id=1, user_id=1)) for i in range(2)]
+        contexts += [(f"b{i}", RequestContext(guild_id=1, user_id=2)) for i in range(2)]
+
+        served = await self.run_requests(limiter, contexts)
+        self.assertListEqual(served, ["a0", "b0", "a1", "b1"])
+
+    async def test_new_thread_priority(self):
+        limiter = RequestLimiter(max_concurrency=1)
+        contexts = [
+            ("follow_up", RequestContext(guild_id=1)),
+            ("new_thread", RequestContext(guild_id=2, priority=RequestPriority.NEW_THREAD)),
+        ]
+
+        served = await self.run_requests(limiter, contexts)
+        self.assertListEqual(served, ["new_thread", "follow_up"])
+
+    async def test_cancelled_waiter_leaves_queue(self):
+        limiter = RequestLimiter(max_concurrency=1)
+        await limiter.acquire()
+
+        task = asyncio.create_task(limiter.acquire(RequestContext(guild_id=1)))
+        await asyncio.sleep(0)
+        self.assertEqual(limiter.stats().queued[RequestPriority.FOLLOW_UP], 1)
+
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        limiter.release()
+
+        stats = limiter.stats()
+        self.assertEqual(stats.queued[RequestPriority.FOLLOW_UP], 0)
+        self.assertEqual(stats.active, 0)
+
+    async def test_release_discarded_stream(self):
+        limiter = RequestLimiter(max_concurrency=1)
+        await limiter.acquire()
+
+        # Reply stream is dropped before its first chunk is pulled, e.g. its delivery is cancelled
+        reply_stream = call_after_stream(stream_chunks("Hello"), limiter.release)
+        await reply_stream.aclose()
+        await reply_stream.aclose()
+
+        self.assertEqual(limiter.stats().active, 0)
+        await asyncio.wait_for(limiter.acquire(), timeout=1)
+        self.assertListEqual([chunk async for chunk in reply_stream], [])
@@ -0,0 +1,69 @@
+from typing import Optional
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from src.service.resilience import Resilience, CircuitOpenError, parse_retry_after
+
+
+class TransientError(Exception):
+    pass
+
+
+def get_retry_after(err: Exception) -> Optional[float]:
+    return 0.0 if isinstance(err, TransientError) else None
+
+
+@patch("src.service.resilience.backoff_seconds", return_value=0)
+class ResilienceTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.resilience = Resilience(name="test", get_retry_after=get_retry_after, max_attempts=3)
+        self.calls = 0
+
+    def failing_request(self, failures: int, error: Exception):
+        async def request():
+            self.calls += 1
+            if self.calls <= failures:
+                raise error
+            return "ok"
+
+        return request
+
+    async def test_retry_transient_error(self, _):
+        result = await self.resilience.call(self.failing_request(2, TransientError()))
+        self.assertEqual(result, "ok")
+        self.assertEqual(self.calls, 3)
+
+    async def test_give_up_after_max_attempts(self, _):
+        with self.assertRaises(TransientError):
+            await self.resilience.call(self.failing_request(5, TransientError()))
+        self.assertEqual(self.calls, 3)
+
+    async def test_no_retry_for_other_errors(self, _):
+        with self.assertRaises(ValueError):
+            await self.resilience.call(self.failing_request(1, ValueError()))
+        self.assertEqual(self.calls, 1)
+
+    async def test_circuit_opens_after_repeated_failures(self, _):
+        for _ in range(2):
+            with self.assertRaises(TransientError):
+                await self.resilience.call(self.failing_request(100, TransientError()))
+
+        with self.assertRaises(CircuitOpenError):
+            await self.resilience.call(self.failing_request(0, TransientError()))
+
+
+class ParseRetryAfterTest(TestCase):
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after({"retry-after": "2"}), 2)
+        self.assertEqual(parse_retry_after({"retry-after-ms": "1500"}), 1.5)
+        self.assertEqual(
+            parse_retry_after({"x-ratelimit-remaining-requests": "0", "x-ratelimit-reset-requests": "1m30s"}),
+            90
+        )
+        self.assertEqual(
+            parse_retry_after({"x-ratelimit-remaining-tokens": "10", "x-ratelimit-reset-tokens": "20ms"}),
+            0
+        )
+        self.assertEqual(parse_retry_after({}), 0)
@@ -0,0 +1,25 @@
+from unittest import TestCase
+
+from src.service.retrieval import ThreadIndex
+
+
+class ThreadIndexTest(TestCase):
+
+    def setUp(self):
+        self.index = ThreadIndex()
+        self.index.sync([
+            (1, "How do I configure the database connection pool?"),
+            (2, "Set max_connections in the pool settings."),
+            (3, "What about logging?"),
+        ])
+
+    def test_rank_by_relevance(self):
+        scores = self.index.score("database pool size")
+        self.assertGreater(scores[1], scores[2])
+        self.assertNotIn(3, scores)
+
+    def test_sync_removes_documents(self):
+        self.index.sync([(1, "How do I configure the database connection pool?")])
+        self.assertNotIn(2, self.index.score("pool"))
+        self.assertNotIn("max_connections", self.index.postings)
+        self.assertEqual(self.index.total_length, self.index.lengths[1])
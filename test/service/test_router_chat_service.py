@@ -0,0 +1,208 @@
+import asyncio
+from functools import partial
+from time import monotonic
+from unittest import IsolatedAsyncioTestCase, TestCase
+from unittest.mock import patch
+
+from src.model.completion_data import CompletionData, CompletionResult
+from src.model.message import Message
+from src.model.prompt import Prompt
+from src.model.role import Role
+from src.service.chat_service import stream_chunks
+from src.service.hedge_policy import HedgePolicy
+from src.service.palm_service import PalmService
+from src.service.reply_stream import ReplyStream
+from src.service.router_chat_service import RouterChatService, BackendStats, EWMA_ALPHA
+
+
+class BackendStatsTest(TestCase):
+
+    def test_record_success(self):
+        stats = BackendStats()
+        stats.record_success(1.0)
+        stats.record_success(2.0)
+
+        self.assertAlmostEqual(stats.latency, EWMA_ALPHA * 2.0 + (1 - EWMA_ALPHA) * 1.0)
+
+    def test_record_failure(self):
+        stats = BackendStats()
+        stats.record_success(1.0)
+        score = stats.score()
+        stats.record_failure()
+
+        self.assertAlmostEqual(stats.get_error_rate(), EWMA_ALPHA, places=3)
+        self.assertGreater(stats.score(), score)
+
+
+class RouterChatServiceTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.backends = [PalmService(), PalmService()]
+        self.delays = [0.0, 0.0]
+        self.statuses = [CompletionResult.OK, CompletionResult.OK]
+        self.calls = []
+
+        for index, backend in enumerate(self.backends):
+            send_prompt = patch.object(backend, "send_prompt", partial(self.send_prompt, index))
+            send_prompt.start()
+            self.addCleanup(send_prompt.stop)
+
+        self.router = RouterChatService(self.backends)
+
+    async def send_prompt(self, index: int, _) -> CompletionData:
+        self.calls.append(index)
+        await asyncio.sleep(self.delays[index])
+        return CompletionData(status=self.statuses[index], reply_text=f"Backend {index}", status_text=None)
+
+    def build_prompt(self) -> Prompt:
+        return self.router.build_prompt([Message(role=Role.USER.value, content="Hello")])
+
+    async def test_route_to_fastest_backend(self):
+        self.router.backend_stats[0].record_success(2.0)
+        self.router.backend_stats[1].record_success(0.5)
+        self.assertListEqual(self.router.rank_backends(), [1, 0])
+
+        response_data = await self.router.send_prompt(self.build_prompt())
+        self.assertEqual(response_data.reply_text, "Backend 1")
+        self.assertListEqual(self.calls, [1])
+
+    async def test_spread_load_across_backends(self):
+        self.delays = [0.05, 0.05]
+        await asyncio.gather(self.router.send_prompt(self.build_prompt()), self.router.send_prompt(self.build_prompt()))
+        self.assertListEqual(sorted(self.calls), [0, 1])
+
+        # Outstanding requests scale the latency of backends with samples
+        self.router.backend_stats[0].record_success(1.0)
+        self.router.backend_stats[1].record_success(1.5)
+        self.calls.clear()
+        await asyncio.gather(self.router.send_prompt(self.build_prompt()), self.router.send_prompt(self.build_prompt()))
+        self.assertListEqual(self.calls, [0, 1])
+
+    async def test_fail_over(self):
+        self.statuses[0] = CompletionResult.OTHER_ERROR
+
+        response_data = await self.router.send_prompt(self.build_prompt())
+        self.assertEqual(response_data.reply_text, "Backend 1")
+        self.assertListEqual(self.calls, [0, 1])
+
+        # Failed backend is ranked last until its error rate decays
+        self.assertListEqual(self.router.rank_backends(), [1, 0])
+
+    async def test_no_fail_over_on_invalid_request(self):
+        self.statuses[0] = CompletionResult.INVALID_REQUEST
+
+        response_data = await self.router.send_prompt(self.build_prompt())
+        self.assertIs(response_data.status, CompletionResult.INVALID_REQUEST)
+        self.assertListEqual(self.calls, [0])
+
+    async def test_skip_open_circuit(self):
+        self.backends[0].resilience.circuit_breaker.opened_at = monotonic()
+        self.assertListEqual(self.router.rank_backends(), [1])
+
+        response_data = await self.router.send_prompt(self.build_prompt())
+        self.assertEqual(response_data.reply_text, "Backend 1")
+        self.assertListEqual(self.calls, [1])
+
+    async def test_all_circuits_open(self):
+        for backend in self.backends:
+            backend.resilience.circuit_breaker.opened_at = monotonic()
+
+        response_data = await self.router.send_prompt(self.build_prompt())
+        self.assertIs(response_data.status, CompletionResult.OTHER_ERROR)
+        self.assertEqual(response_data.status_text, "No chat service available")
+        self.assertListEqual(self.calls, [])
+
+
+class RouterHedgeTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.backends = [PalmService(), PalmService()]
+        self.delays = [0.0, 0.0]
+        self.respond_when_cancelled = False
+        self.calls = []
+        self.closed = []
+
+        for index, backend in enumerate(self.backends):
+            send_prompt_stream = patch.object(backend, "send_prompt_stream", partial(self.send_prompt_stream, index))
+            send_prompt_stream.start()
+            self.addCleanup(send_prompt_stream.stop)
+
+        self.hedge_policy = HedgePolicy(budget=1.0, min_samples=1)
+        self.router = RouterChatService(self.backends, hedge_policy=self.hedge_policy)
+        self.model_name = self.router.model.name
+
+    async def send_prompt_stream(self, index: int, _) -> CompletionData:
+        self.calls.append(index)
+        try:
+            await asyncio.sleep(self.delays[index])
+        except asyncio.CancelledError:
+            # Response arrived as the request was cancelled
+            if not self.respond_when_cancelled:
+                raise
+
+        return CompletionData(
+            status=CompletionResult.OK,
+            reply_text=None,
+            status_text=None,
+            reply_stream=ReplyStream(stream_chunks(f"Backend {index}"), on_close=partial(self.closed.append, index))
+        )
+
+    def build_prompt(self) -> Prompt:
+        return self.router.build_prompt([Message(role=Role.USER.value, content="Hello")])
+
+    async def test_hedge_slow_request(self):
+        self.hedge_policy.record_latency(self.model_name, 0.01)
+        self.delays = [1.0, 0.0]
+
+        response_data = await asyncio.wait_for(self.router.send_prompt_stream(self.build_prompt()), timeout=0.5)
+        self.assertEqual("".join([chunk async for chunk in response_data.reply_stream]), "Backend 1")
+        self.assertListEqual(self.calls, [0, 1])
+        self.assertListEqual(self.closed, [1])
+
+        # Cancelled request is recorded as taking at least the hedge delay
+        latencies = self.hedge_policy.latencies[self.model_name]
+        self.assertEqual(len(latencies), 3)
+        self.assertGreaterEqual(latencies[-1], 0.01)
+
+    async def test_close_losing_response(self):
+        self.hedge_policy.record_latency(self.model_name, 0.01)
+        self.delays = [1.0, 0.0]
+        self.respond_when_cancelled = True
+
+        response_data = await asyncio.wait_for(self.router.send_prompt_stream(self.build_prompt()), timeout=0.5)
+        self.assertListEqual(self.closed, [0])
+
+        await response_data.reply_stream.aclose()
+        self.assertListEqual(self.closed, [0, 1])
+
+    async def test_close_response_of_discarded_request(self):
+        self.hedge_policy.record_latency(self.model_name, 1.0)
+        self.delays = [1.0, 0.0]
+        self.respond_when_cancelled = True
+
+        # Discarded while waiting for the hedge delay
+        task = asyncio.create_task(self.router.send_prompt_stream(self.build_prompt()))
+        await asyncio.sleep(0.01)
+        task.cancel()
+        with self.assertRaises(asyncio.CancelledError):
+            await task
+
+        self.assertListEqual(self.calls, [0])
+        self.assertListEqual(self.closed, [0])
+
+    async def test_hedge_budget(self):
+        self.hedge_policy.budget = 0.0
+        self.hedge_policy.record_latency(self.model_name, 0.01)
+        self.delays = [0.05, 0.0]
+
+        response_data = await self.router.send_prompt_stream(self.build_prompt())
+        self.assertEqual("".join([chunk async for chunk in response_data.reply_stream]), "Backend 0")
+        self.assertListEqual(self.calls, [0])
+
+    async def test_no_hedge_without_samples(self):
+        self.hedge_policy.min_samples = 2
+        self.hedge_policy.record_latency(self.model_name, 0.01)
+        self.delays = [0.05, 0.0]
+
+        await self.router.send_prompt_stream(self.build_prompt())
+        self.assertListEqual(self.calls, [0])
@@ -0,0 +1,96 @@
+import asyncio
+from unittest import IsolatedAsyncioTestCase
+
+from src.service.chat_service import stream_chunks
+from src.service.reply_stream import ReplyStream
+from src.service.single_flight import SingleFlight, SharedStream
+
+
+class SingleFlightTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.single_flight = SingleFlight()
+        self.calls = 0
+        self.cancelled = False
+
+    async def slow_call(self) -> str:
+        self.calls += 1
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+        return "result"
+
+    async def test_share_result(self):
+        results = await asyncio.gather(*[self.single_flight.do("key", self.slow_call) for _ in range(3)])
+        self.assertListEqual(results, ["result"] * 3)
+        self.assertEqual(self.calls, 1)
+        self.assertDictEqual(self.single_flight.flights, {})
+
+    async def test_cancel_one_caller(self):
+        first = asyncio.create_task(self.single_flight.do("key", self.slow_call))
+        second = asyncio.create_task(self.single_flight.do("key", self.slow_call))
+        await asyncio.sleep(0)
+
+        first.cancel()
+        self.assertEqual(await second, "result")
+        self.assertFalse(self.cancelled)
+        self.assertEqual(self.calls, 1)
+
+    async def test_cancel_all_callers(self):
+        tasks = [asyncio.create_task(self.single_flight.do("key", self.slow_call)) for _ in range(2)]
+        await asyncio.sleep(0)
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await asyncio.sleep(0)
+        self.assertTrue(self.cancelled)
+
+
+class SharedStreamTest(IsolatedAsyncioTestCase):
+
+    async def test_replay_to_every_consumer(self):
+        shared = SharedStream(stream_chunks("Hello", " ", "world"))
+
+        async def consume() -> str:
+            return "".join([chunk async for chunk in shared.subscribe()])
+
+        first = await consume()
+        second, third = await asyncio.gather(consume(), consume())
+        self.assertEqual(first, "Hello world")
+        self.assertEqual(second, "Hello world")
+        self.assertEqual(third, "Hello world")
+
+    async def test_cancel_one_consumer(self):
+        async def source():
+            for index in range(5):
+                await asyncio.sleep(0.01)
+                yield str(index)
+
+        shared = SharedStream(source())
+
+        async def consume() -> list:
+            return [chunk async for chunk in shared.subscribe()]
+
+        first = asyncio.create_task(consume())
+        second = asyncio.create_task(consume())
+        await asyncio.sleep(0.025)
+
+        # A cancelled consumer does not end the stream of the others
+        first.cancel()
+        self.assertListEqual(await second, ["0", "1", "2", "3", "4"])
+        self.assertTrue(first.cancelled())
+
+    async def test_close_source_when_all_consumers_leave(self):
+        closed = []
+        shared = SharedStream(ReplyStream(stream_chunks("Hello", " ", "world"), on_close=lambda: closed.append(True)))
+
+        first, second = shared.subscribe(), shared.subscribe()
+        await first.aclose()
+        self.assertListEqual(closed, [])
+
+        # Left before pulling any chunk
+        await second.aclose()
+        self.assertListEqual(closed, [True])
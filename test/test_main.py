@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import os
+from unittest import IsolatedAsyncioTestCase
+from unittest.mock import patch
+
+# Bot reads its configuration on import, no connection to Discord is made
+os.environ.update({
+    "CHAT_SERVICE": "palm",
+    "DISCORD_BOT_TOKEN": "test",
+    "DISCORD_CLIENT_ID": "1",
+    "ALLOWED_SERVER_IDS": "10",
+    "BOT_INVITE_URL": "",
+})
+
+import discord  # noqa: E402
+
+from benchmark.fake_discord import FakeInteraction, FakeUser, FakeGuild, FakeThread  # noqa: E402
+from src import main  # noqa: E402
+from src.constant.discord import EMBED_FIELD_VALUE_LENGTH  # noqa: E402
+from src.model.completion_data import CompletionData, CompletionResult  # noqa: E402
+from src.service.palm_service import PalmService  # noqa: E402
+from src.service.reply_stream import ReplyStream  # noqa: E402
+from src.service.request_limiter import RequestLimiter  # noqa: E402
+
+# Bot logs at debug level
+logging.getLogger().setLevel(logging.WARNING)
+
+
+class ThreadFailingInteraction(FakeInteraction):
+    async def original_response(self):
+        # Fail after the chat request has started streaming
+        await asyncio.sleep(0.05)
+        raise RuntimeError("Cannot create thread")
+
+
+class RecordingResponse:
+    def __init__(self):
+        self.messages = []
+
+    def is_done(self) -> bool:
+        return bool(self.messages)
+
+    async def send_message(self, content: str, ephemeral: bool = False, **_):
+        self.messages.append((content, ephemeral))
+
+
+class PinModelCommandTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.chat_service = PalmService()
+        chat_service = patch.object(main.client, "chat_service", self.chat_service)
+        chat_service.start()
+        self.addCleanup(chat_service.stop)
+
+        self.guild = FakeGuild()
+        self.model = self.chat_service.get_supported_models()[1]
+        self.choice = discord.app_commands.Choice(name=self.model.name, value=self.model.name)
+
+    def create_interaction(self, channel=None) -> FakeInteraction:
+        interaction = FakeInteraction(FakeUser(user_id=100, name="user"), self.guild)
+        interaction.channel = channel or interaction.channel
+        interaction.response = RecordingResponse()
+        return interaction
+
+    async def test_pin_model_in_thread(self):
+        thread = FakeThread(name="thread", guild=self.guild)
+        interaction = self.create_interaction(thread)
+        await main.pin_model_command.callback(interaction, self.choice)
+
+        self.assertEqual(self.chat_service.pinned_models[thread.id], self.model)
+        self.assertListEqual(interaction.response.messages, [(f"📌 Thread model pinned to `{self.model.name}`", False)])
+
+    async def test_pin_model_outside_thread(self):
+        interaction = self.create_interaction()
+        await main.pin_model_command.callback(interaction, self.choice)
+
+        self.assertEqual(len(self.chat_service.pinned_models), 0)
+        self.assertListEqual(interaction.response.messages, [("❌ Model can only be pinned in a thread", True)])
+
+
+class ChatCommandTest(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.chat_service = PalmService()
+        self.chat_service.set_request_limiter(RequestLimiter(max_concurrency=1))
+        self.closed = False
+
+        chat_service = patch.object(main.client, "chat_service", self.chat_service)
+        chat_service.start()
+        self.addCleanup(chat_service.stop)
+
+    async def send_prompt_stream(self, _) -> CompletionData:
+        async def reply_stream():
+            try:
+                yield "Hello"
+            finally:
+                self.closed = True
+
+        chunks = reply_stream()
+        first_chunk = await anext(chunks)
+
+        async def prepend():
+            yield first_chunk
+            async for chunk in chunks:
+                yield chunk
+
+        # Provider streams close the response once closed, see OpenAIService
+        return CompletionData(
+            status=CompletionResult.OK,
+            reply_text=None,
+            status_text=None,
+            reply_stream=ReplyStream(prepend(), on_close=chunks.aclose)
+        )
+
+    async def test_thread_creation_failure(self):
+        interaction = ThreadFailingInteraction(FakeUser(user_id=100, name="user"), FakeGuild())
+        with patch.object(self.chat_service, "send_prompt_stream", self.send_prompt_stream):
+            with self.assertLogs(level="ERROR"):
+                await main.chat_command.callback(interaction, "Hello", None)
+
+        # Error is reported, and the request is released for the next chat
+        self.assertEqual(len(interaction.followup.messages), 1)
+        self.assertIn("Cannot create thread", interaction.followup.messages[0])
+        self.assertTrue(self.closed)
+        self.assertEqual(self.chat_service.request_limiter.stats().active, 0)
+
+    async def test_seed_thread_starter(self):
+        interaction = FakeInteraction(FakeUser(user_id=100, name="user"), FakeGuild())
+        message = "Hello " * EMBED_FIELD_VALUE_LENGTH
+        with patch.object(self.chat_service, "send_prompt_stream", self.send_prompt_stream):
+            await main.chat_command.callback(interaction, message, None)
+
+        # Thread starter is cached as fetching it from Discord would convert its embed
+        history = main.client.conversation_cache.threads[interaction.thread.id].history()
+        self.assertEqual(history[0].content, message[:EMBED_FIELD_VALUE_LENGTH])
+        self.assertIsNone(history[0].image_url)